@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import zlib
+
+import orjson as json
+
+from endcord import gateway
+
+REPEAT = 5   # how many times recorded traffic is replayed for each codec
+usage = """Usage: python benchmark_gateway.py PATH [REPEAT]
+PATH is directory with recorded gateway events saved as json files (uncomment debug_events in gateway receiver),
+or json lines file with one gateway event per line."""
+
+
+def load_events(path):
+    """Load recorded gateway events as serialized json payloads"""
+    events = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".json"):
+                with open(os.path.join(path, name), "rb") as f:
+                    events.append(json.dumps(json.loads(f.read())))
+    else:
+        with open(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    events.append(json.dumps(json.loads(line)))
+    return events
+
+
+def zlib_frames(events):
+    """Compress events the way gateway sends them with zlib-stream"""
+    compressor = zlib.compressobj()
+    return [compressor.compress(event) + compressor.flush(zlib.Z_SYNC_FLUSH) for event in events]
+
+
+def zstd_frames(events):
+    """Compress events the way gateway sends them with zstd-stream, returns None if zstd is not available"""
+    try:
+        from compression import zstd
+        compressor = zstd.ZstdCompressor()
+        return [compressor.compress(event, mode=zstd.ZstdCompressor.FLUSH_BLOCK) for event in events]
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        compressor = zstandard.ZstdCompressor().compressobj()
+        return [compressor.compress(event) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK) for event in events]
+    except ImportError:
+        return None
+
+
+def run(frames, compression, repeat):
+    """Decompress and parse all frames like gateway receiver does, returns wall and cpu time"""
+    wall = 0
+    cpu = 0
+    for _ in range(repeat):
+        if compression:
+            gateway.reset_inflator(compression)
+            decompress = gateway.zstd_decompress if compression == "zstd-stream" else gateway.zlib_decompress
+        else:
+            decompress = None
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        for frame in frames:
+            json.loads(decompress(frame) if decompress else frame)
+        wall += time.perf_counter() - wall_start
+        cpu += time.process_time() - cpu_start
+    return wall, cpu
+
+
+def main(path, repeat):
+    """Run benchmark for all available codecs and print results"""
+    events = load_events(path)
+    if not events:
+        sys.exit("No events found")
+    raw_size = sum(len(event) for event in events)
+    print(f"{len(events)} events, {raw_size / 1024:.1f} KiB of json, replayed {repeat} times")
+    codecs = {
+        "json": (events, None),
+        "zlib-stream": (zlib_frames(events), "zlib-stream"),
+    }
+    if gateway.zstd_decompressobj and (frames := zstd_frames(events)):
+        codecs["zstd-stream"] = (frames, "zstd-stream")
+    else:
+        print("zstd is not available, skipping zstd-stream")
+    print(f"{"codec":<12} {"wire KiB":>10} {"ratio":>6} {"wire MiB/s":>11} {"json MiB/s":>11} {"CPU us/event":>13}")
+    for name, (frames, compression) in codecs.items():
+        wire_size = sum(len(frame) for frame in frames)
+        wall, cpu = run(frames, compression, repeat)
+        print(
+            f"{name:<12} {wire_size / 1024:>10.1f} {raw_size / wire_size:>6.2f} "
+            f"{wire_size * repeat / wall / 1048576:>11.1f} {raw_size * repeat / wall / 1048576:>11.1f} "
+            f"{cpu / (len(events) * repeat) * 1000000:>13.2f}",
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        sys.exit(usage)
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else REPEAT)
@@ -1,6 +1,8 @@
+import bisect
 import importlib.util
 import logging
 import os
+import queue
 import re
 import shutil
 import subprocess
@@ -18,10 +20,12 @@ from endcord import (
     debug,
     discord,
     downloader,
+    executor,
     formatter,
     game_detection,
     gateway,
     log_queue,
+    message_cache,
     parser,
     peripherals,
     perms,
@@ -52,10 +56,16 @@ SUMMARY_SAVE_INTERVAL = 300   # 5min
 LIMIT_SUMMARIES = 5   # max number of summaries per channel
 INTERACTION_THROTTLING = 3   # delay between sending app interactions
 APP_COMMAND_AUTOCOMPLETE_DELAY = 0.3   # delay for requesting app command autocompletions after stop typing
+CHAT_PREFETCH_SCREENS = 2   # prefetch next chat chunk when view is this many screens from either end of loaded chat
+CHAT_PREFETCH_MAX_AGE = 60   # prefetched chat chunk older than this is discarded
+WARMUP_IDLE_DELAY = 3   # seconds after channel switch or previous warm-up before next channel is warmed up
+WARMUP_INTERVAL = 300   # same channel is not warmed up again for this many seconds
+WARMUP_CHANNEL_TYPES = (0, 1, 3, 5, 11, 12)   # text, dm, group dm, announcement, threads
 MB = 1024 * 1024
 USER_UPLOAD_LIMITS = (10*MB, 50*MB, 500*MB, 50*MB)   # premium tier 0, 1, 2, 3 (none, classic, full, basic)
 GUILD_UPLOAD_LIMITS = (10*MB, 10*MB, 50*MB, 100*MB)   # premium tier 0, 1, 2, 3
 FORUM_COMMANDS = (1, 2, 7, 13, 14, 15, 17, 20, 22, 25, 27, 29, 30, 31, 32, 40)
+MAIN_LOOP_IDLE_TIMEOUT = 1   # max time main loop waits for events, for sources that dont signal them
 
 match_emoji = re.compile(r"<:(.*):(\d*)>")
 match_youtube = re.compile(r"(?:https?:\/\/)?(?:www\.)?(?:youtube\.com\/(?:watch\?v=|embed\/)|youtu\.be\/)[a-zA-Z0-9_-]{11}")
@@ -90,6 +100,7 @@ class Endcord:
         self.enable_game_detection = config["game_detection"]
         self.limit_chat_buffer = max(min(config["limit_chat_buffer"], 1000), 50)
         self.limit_channel_cache = config["limit_channel_cache"]
+        self.warmup_channels = config["warmup_channels"]
         self.msg_num = max(min(config["download_msg"], 100), 20)
         self.limit_typing = max(config["limit_typing_string"], 25)
         self.send_my_typing = config["send_typing"]
@@ -124,6 +135,7 @@ class Endcord:
         self.assist_score_cutoff = config["assist_score_cutoff"]
         self.external_editor = config["external_editor"]
         self.limit_command_history = config["limit_command_history"]
+        self.chat_frame_time = 1 / max(config["chat_max_fps"], 1)
 
         if not self.external_editor or not shutil.which(self.external_editor):
             self.external_editor = os.environ.get("EDITOR", "nano")
@@ -169,8 +181,12 @@ class Endcord:
             "admin": False,
         }
         self.guilds = []
+        self.guilds_lookup = {}   # {guild_id: guild}
+        self.channels_lookup = {}   # {channel_id: channel}, channels from all guilds
+        self.dms_lookup = {}   # {dm_id: dm}
         self.guild_folders = []
         self.all_roles = []
+        self.all_roles_lookup = {}   # {guild_id: roles}
         self.current_roles = []
         self.current_guild_properties = {}
         self.current_channels = []
@@ -208,6 +224,14 @@ class Endcord:
             self.user_agent,
             proxy=config["proxy"],
         )
+        if config["message_cache_channels"]:
+            self.message_cache = message_cache.MessageCache(
+                f"messages_{self.profiles["selected"]}.db",
+                max_channels=config["message_cache_channels"],
+                max_age=config["message_cache_max_age"],
+            )
+        else:
+            self.message_cache = None
         # preload chat for faster startup
         self.preloaded = False
         self.need_preload = True
@@ -218,11 +242,23 @@ class Endcord:
             client_prop_gateway,
             self.user_agent,
             proxy=config["proxy"],
+            compression=config["gateway_compression"],
         )
+        # main loop sleeps on this queue until some component signals new event
+        self.events = queue.Queue()
+        self.gateway.set_event_queue(self.events)
+        if config["resume_session"]:
+            self.gateway.set_session_file(os.path.join(
+                os.path.expanduser(peripherals.config_path),
+                f"session_{self.profiles["selected"]}.json",
+            ))
+        self.executor = executor.Executor()   # for REST calls that must not block main loop
+        self.executor.set_event_queue(self.events)
         # this takes some time, so let other things init in parallel
         threading.Thread(target=self.gateway.connect, daemon=True).start()
         self.downloader = downloader.Downloader(config["proxy"])
         self.tui = tui.TUI(self.screen, self.config, keybindings)
+        self.tui.set_event_queue(self.events)
         if self.fun:
             today = (time.localtime().tm_mon, time.localtime().tm_mday)
             self.fun = 2 if (10, 25) <= today <= (11, 8) else self.fun
@@ -237,6 +273,9 @@ class Endcord:
         self.premium = None    # same
         self.my_user_data = None    # same
         self.channel_cache = []
+        self.warmed_channels = {}   # {channel_id: time}, channel is not warmed up again until it expires
+        self.warm_cache = set()   # ids of channels in channel cache that are warmed up and not opened yet
+        self.warmup_time = time.time()
         self.voice_gateway = None
         self.reset()
         self.gateway_state = self.gateway.get_state()
@@ -253,6 +292,7 @@ class Endcord:
         self.tree_metadata = []
         self.uncollapsed_threads = []
         self.my_roles = []
+        self.my_roles_lookup = {}   # {guild_id: roles}
         self.deleted_cache = []
         self.extra_window_open = False
         self.extra_indexes = []
@@ -422,8 +462,13 @@ class Endcord:
         self.tab_string_format = []
         self.new_unreads = False
         self.this_uread = False
-        self.chat_indexes = []
+        self.chat_line_offsets = []
         self.chat_map = []
+        self.chat_update_pending = False
+        self.chat_update_change = 0
+        self.chat_update_time = 0
+        self.tree_update_pending = False
+        self.tree_update_time = 0
         if self.my_user_data:
             self.update_prompt()
         self.typing = []
@@ -435,6 +480,7 @@ class Endcord:
         self.last_message_id = 0
         self.my_activities = []
         self.chat_end = False
+        self.prefetched_chunks = {}   # {past: (channel_id, start_id, time, messages)}
         self.forum_end = False
         self.forum_old = []
         self.downloader.cancel()
@@ -443,14 +489,15 @@ class Endcord:
         self.ready_attachments = []
         self.selected_attachment = 0
         self.current_my_roles = []
-        self.member_roles = []
-        self.current_member_roles = []
+        self.member_roles = {}
+        self.current_member_roles = {}
         self.threads = []
         self.activities = []
         self.search_messages = []
         self.members = []
         self.subscribed_members = []
         self.current_members = []
+        self.member_list_window = (0, 0)   # start and end of generated part of member list
         self.got_commands = False
         self.my_commands = []
         self.my_apps = []
@@ -506,6 +553,7 @@ class Endcord:
         guilds = self.gateway.get_guilds()
         if guilds:
             self.guilds = guilds
+            self.update_guilds_lookup()
         # not initializing role colors again to avoid issues with media colors
         self.load_dms()
         new_activities = self.gateway.get_dm_activities()
@@ -516,11 +564,8 @@ class Endcord:
         self.blocked = self.gateway.get_blocked()
         self.select_current_member_roles()
         self.my_roles = self.gateway.get_my_roles()
-        self.current_my_roles = []   # user has no roles in dm
-        for roles in self.my_roles:
-            if roles["guild_id"] == self.active_channel["guild_id"]:
-                self.current_my_roles = roles["roles"]
-                break
+        self.update_roles_lookup()
+        self.current_my_roles = self.my_roles_lookup.get(self.active_channel["guild_id"], [])   # user has no roles in dm
         self.compute_permissions()
         self.select_current_channels()
         self.gateway.update_presence(
@@ -563,6 +608,26 @@ class Endcord:
                 if dm["is_spam"]:
                     self.dms_vis_id.remove(dm["id"])
                     self.dms.remove(dm)
+        self.dms_lookup = {dm["id"]: dm for dm in self.dms}
+        search.clear_search_indexes()
+
+
+    def update_guilds_lookup(self):
+        """Rebuild id lookup tables for guilds and their channels, run after self.guilds is updated"""
+        self.guilds_lookup = {}
+        self.channels_lookup = {}
+        for guild in self.guilds:
+            self.guilds_lookup[guild["guild_id"]] = guild
+            for channel in guild["channels"]:
+                if "id" in channel:
+                    self.channels_lookup[channel["id"]] = channel
+        search.clear_search_indexes()
+
+
+    def update_roles_lookup(self):
+        """Rebuild id lookup tables for all roles and my roles, run after self.all_roles or self.my_roles is updated"""
+        self.all_roles_lookup = {roles["guild_id"]: roles["roles"] for roles in self.all_roles}
+        self.my_roles_lookup = {roles["guild_id"]: roles["roles"] for roles in self.my_roles}
 
 
     def switch_channel(self, channel_id, channel_name, guild_id, guild_name, parent_hint=None, open_member_list=False, preload=False):
@@ -596,7 +661,7 @@ class Endcord:
 
         # clear member roles when switching guild so there are no issues with same members in both guilds
         if guild_id != self.active_channel["guild_id"]:
-            self.current_member_roles = []
+            self.current_member_roles = {}
 
         # cache previous channel chat (if not forum)
         if not self.forum and self.messages:
@@ -645,6 +710,14 @@ class Endcord:
                 self.preloaded = False
                 self.need_preload = False
 
+            # load from disk cache and download only newer messages
+            elif (new_messages := self.load_from_message_cache(channel_id)):
+                self.messages = new_messages
+                if self.keep_deleted:
+                    self.messages = self.restore_deleted(self.messages)
+                self.request_missing_members(guild_id, self.messages)
+                self.last_message_id = self.messages[0]["id"]
+
             # download messages
             else:
                 new_messages = self.get_messages_with_members(num=self.msg_num)
@@ -706,6 +779,7 @@ class Endcord:
         self.gateway.subscribe(channel_id, guild_id)
         self.tui.reset_chat_scrolled_top()
         self.gateway.set_subscribed_channels([x[0] for x in self.channel_cache] + [channel_id])
+        self.warmup_time = time.time()
         if self.recording:
             self.recording = False
             _ = recorder.stop()
@@ -719,13 +793,12 @@ class Endcord:
                     incoming_call_ch_id = self.most_recent_incoming_call
                 else:
                     incoming_call_ch_id = channel_id
-                for dm in self.dms:
-                    if dm["id"] == incoming_call_ch_id:
-                        new_permanent_extra_line = formatter.generate_extra_line_ring(
-                            dm["name"],
-                            self.tui.get_dimensions()[2][1],
-                        )
-                        break
+                dm = self.dms_lookup.get(incoming_call_ch_id)
+                if dm:
+                    new_permanent_extra_line = formatter.generate_extra_line_ring(
+                        dm["name"],
+                        self.tui.get_dimensions()[2][1],
+                    )
                 if new_permanent_extra_line and new_permanent_extra_line != self.permanent_extra_line:
                     self.update_extra_line(custom_text=new_permanent_extra_line, permanent=True)
             elif not self.in_call:
@@ -756,16 +829,9 @@ class Endcord:
                 self.default_msg_alt_color[1],
                 guild_id=guild_id,
             )
-        self.current_roles = []   # dm has no roles
-        for roles in self.all_roles:
-            if roles["guild_id"] == guild_id:
-                self.current_roles = roles["roles"]
-                break
-        self.current_my_roles = []   # user has no roles in dm
-        for roles in self.my_roles:
-            if roles["guild_id"] == guild_id:
-                self.current_my_roles = roles["roles"]
-                break
+            self.update_roles_lookup()
+        self.current_roles = self.all_roles_lookup.get(guild_id, [])   # dm has no roles
+        self.current_my_roles = self.my_roles_lookup.get(guild_id, [])   # user has no roles in dm
         self.select_current_member_roles()
         self.forum = forum   # changing it here because previous code takes long time
 
@@ -807,7 +873,7 @@ class Endcord:
         """Switch to None mode, no open channel, no chat displayed"""
         if self.keep_deleted:
             self.cache_deleted()
-        self.current_member_roles = []
+        self.current_member_roles = {}
         if not self.forum and self.messages:
             self.add_to_channel_cache(self.active_channel["channel_id"], self.messages, self.active_channel.get("pinned", False))
 
@@ -841,11 +907,11 @@ class Endcord:
         self.current_members = []
         self.current_roles = []
         self.current_my_roles = []
-        self.current_member_roles = []
+        self.current_member_roles = {}
 
         self.chat = []
         self.chat_format = []
-        self.chat_indexes = []
+        self.chat_line_offsets = []
         self.chat_map = []
 
         self.tui.update_chat(self.chat, self.chat_format)
@@ -939,34 +1005,29 @@ class Endcord:
         if refresh:
             parent_hint = self.current_channel.get("parent_id")
 
-        for this_guild in self.guilds:
-            if this_guild["guild_id"] == guild_id:
-                self.current_channels = this_guild["channels"]
-                break
+        this_guild = self.guilds_lookup.get(guild_id)
+        if this_guild:
+            self.current_channels = this_guild["channels"]
         else:
             self.current_channels = []
             this_guild = {}
 
         # update channel
         self.current_channel = {}
-        for channel in self.current_channels:
-            if channel["id"] == channel_id:
-                self.current_channel = channel
-                break
-
-        # check threads if no channel
-        else:
-            if parent_hint:   # thread will have parent_hint
-                for guild in self.threads:
-                    if guild["guild_id"] == guild_id:
-                        for channel in guild["channels"]:
-                            if channel["channel_id"] == parent_hint:
-                                for thread in channel["threads"]:
-                                    if thread["id"] == channel_id:
-                                        self.current_channel = thread
-                                        break
-                                break
-                        break
+        if this_guild and channel_id in self.channels_lookup:
+            self.current_channel = self.channels_lookup[channel_id]
+        # check threads if no channel, thread will have parent_hint
+        elif parent_hint:
+            for guild in self.threads:
+                if guild["guild_id"] == guild_id:
+                    for channel in guild["channels"]:
+                        if channel["channel_id"] == parent_hint:
+                            for thread in channel["threads"]:
+                                if thread["id"] == channel_id:
+                                    self.current_channel = thread
+                                    break
+                            break
+                    break
 
         # update current guild properties
         if this_guild:
@@ -990,24 +1051,20 @@ class Endcord:
 
     def select_current_member_roles(self):
         """Select member roles for currently active guild and check for missing primary role colors"""
-        if not self.active_channel["guild_id"]:
-            self.current_member_roles = []
+        guild = self.member_roles.get(self.active_channel["guild_id"])
+        if not guild:
+            self.current_member_roles = {}
             return
-        for guild in self.member_roles:
-            if guild["guild_id"] == self.active_channel["guild_id"]:
-                if self.username_role_colors:
-                    for member in guild["members"]:
-                        if "primary_role_color" not in member:
-                            member_roles = member["roles"]
-                            for role in self.current_roles:
-                                if role["id"] in member_roles:
-                                    member["primary_role_color"] = role.get("color_id")
-                                    member["primary_role_alt_color"] = role.get("alt_color_id")
-                                    break
-                self.current_member_roles = guild["members"]
-                break
-        else:
-            self.current_member_roles = []
+        if self.username_role_colors:
+            roles_index = {role["id"]: num for num, role in enumerate(self.current_roles)}
+            for member in list(guild.values()):   # gateway can add members meanwhile
+                if "primary_role_color" not in member:
+                    role_indexes = [roles_index[role_id] for role_id in member["roles"] if role_id in roles_index]
+                    if role_indexes:
+                        role = self.current_roles[min(role_indexes)]
+                        member["primary_role_color"] = role.get("color_id")
+                        member["primary_role_alt_color"] = role.get("alt_color_id")
+        self.current_member_roles = guild
 
 
     def add_to_store(self, channel_id, text):
@@ -1041,6 +1098,9 @@ class Endcord:
         """Add messages to channel cache"""
         # format: channel_cache = [[channel_id, messages, pinned, *invalid], ...]
         # skipping deleted because they are separately cached
+        self.warm_cache.discard(channel_id)
+        if self.message_cache:
+            self.message_cache.save(channel_id, messages[:self.msg_num])
         if self.limit_channel_cache:
             pinned = 0
             for channel in self.channel_cache:
@@ -1064,6 +1124,7 @@ class Endcord:
 
     def load_from_channel_cache(self, num):
         """Load messages from channel cache"""
+        self.warm_cache.discard(self.channel_cache[num][0])
         if self.channel_cache[num][2]:
             cached = self.channel_cache[num]
         else:
@@ -1086,6 +1147,71 @@ class Endcord:
         )
 
 
+    def get_warmup_candidates(self):
+        """Get likely-next channels: mentioned channels, invalid tabs, neighbours of selected channel in tree and unread channels"""
+        tree_channels = set()
+        for obj in self.tree_metadata:
+            if obj and obj["type"] in WARMUP_CHANNEL_TYPES and not obj["muted"]:
+                tree_channels.add(obj["id"])
+        candidates = [channel_id for channel_id in self.get_unseen(mentions=True) if channel_id in tree_channels]
+        candidates += [channel[0] for channel in self.channel_cache if len(channel) > 3 and channel[3]]
+        tree_sel = self.tui.get_tree_selected()
+        for num in (tree_sel + 1, tree_sel - 1, tree_sel + 2, tree_sel - 2):
+            if 0 <= num < len(self.tree_metadata) and self.tree_metadata[num] and self.tree_metadata[num]["id"] in tree_channels:
+                candidates.append(self.tree_metadata[num]["id"])
+        candidates += [channel_id for channel_id in self.get_unseen() if channel_id in tree_channels]
+        return candidates
+
+
+    def warmup_channel(self):
+        """When idle, download messages of one likely-next channel in background and add it to channel cache"""
+        now = time.time()
+        if now - self.warmup_time < WARMUP_IDLE_DELAY or self.executor.is_pending("warmup") or self.tui.get_my_typing():
+            return
+        self.warmup_time = now
+        for channel_id, warmed_time in list(self.warmed_channels.items()):
+            if now - warmed_time > WARMUP_INTERVAL:
+                del self.warmed_channels[channel_id]
+        cached = set()
+        for channel in self.channel_cache:
+            if not (len(channel) > 3 and channel[3]):
+                cached.add(channel[0])
+        self.warm_cache &= cached   # drop evicted channels
+        if len(self.warm_cache) >= min(self.warmup_channels, self.limit_channel_cache - 1):
+            return
+        for channel_id in self.get_warmup_candidates():
+            if channel_id != self.active_channel["channel_id"] and channel_id not in cached and channel_id not in self.warmed_channels:
+                break
+        else:
+            return
+        logger.debug(f"Warming up channel {channel_id}")
+        self.warmed_channels[channel_id] = now
+        self.executor.submit(
+            self.discord.get_messages,
+            (channel_id, self.msg_num, None, None, None, True),
+            callback=lambda messages: self.channel_warmed_up(channel_id, messages),
+            key="warmup",
+        )
+
+
+    def channel_warmed_up(self, channel_id, messages):
+        """Add warmed up channel messages to channel cache"""
+        self.warmup_time = time.time()
+        if not messages or channel_id == self.active_channel["channel_id"]:
+            return
+        pinned = False
+        for channel in self.channel_cache:
+            if channel[0] == channel_id:
+                if not (len(channel) > 3 and channel[3]):
+                    return   # cached meanwhile
+                pinned = channel[2]
+                break
+        self.add_to_channel_cache(channel_id, messages, pinned)
+        if not pinned:   # pinned channels dont take space of recently visited channels
+            self.warm_cache.add(channel_id)
+        self.gateway.set_subscribed_channels([x[0] for x in self.channel_cache] + [self.active_channel["channel_id"]])
+
+
     def remove_channel_cache(self, num=None, active=False):
         """Remove cached channel"""
         if active:
@@ -1100,6 +1226,16 @@ class Endcord:
                 pass
 
 
+    def forget_channel(self, channel_id):
+        """Remove deleted channel from channel cache and on-disk message cache"""
+        for num, channel in enumerate(self.channel_cache):
+            if channel[0] == channel_id:
+                self.remove_channel_cache(num)
+                break
+        if self.message_cache:
+            self.message_cache.remove(channel_id)
+
+
     def toggle_tab(self):
         """Toggle tabbed state of currently active channel"""
         if not self.forum:
@@ -1571,7 +1707,7 @@ class Endcord:
                     if mlist_selected >= len(self.current_members):
                         continue
                     member = self.current_members[mlist_selected]
-                    if "id" in member:
+                    if member and "id" in member:
                         self.restore_input_text = (input_text, "standard extra")
                         user_id = member["id"]
                         guild_id = self.active_channel["guild_id"]
@@ -2723,11 +2859,8 @@ class Endcord:
             avatar_id = None
             if user_id == self.my_id:
                 avatar_id = self.my_user_data["extra"]["avatar"]
-            if not avatar_id:
-                for dm in self.dms:
-                    if dm["id"] == user_id:
-                        avatar_id = dm["avatar"]
-                        break
+            if not avatar_id and user_id in self.dms_lookup:
+                avatar_id = self.dms_lookup[user_id]["avatar"]
             if not avatar_id:
                 avatar_id = self.discord.get_user(user_id, extra=True)["extra"]["avatar"]
             if avatar_id:
@@ -2772,11 +2905,7 @@ class Endcord:
                     success = self.discord.send_mute_channel(mute, channel_id, guild_id)
 
             else:
-                is_dm = False
-                for dm in self.dms:
-                    if dm["id"] == channel_id:
-                        is_dm = True
-                        break
+                is_dm = channel_id in self.dms_lookup
                 if is_dm:   # mute DM
                     mute = self.toggle_mute(channel_id, is_dm=True)
                     if mute is not None:
@@ -2964,27 +3093,24 @@ class Endcord:
                     self.update_extra_line("Cant set that option for channel.")
                 else:
                     success = self.discord.send_notification_setting_channel(cmd_args["setting"], channel_id, guild_id)
-            else:
-                for dm in self.dms:
-                    if dm["id"] == channel_id:
-                        self.update_extra_line("DM has no notification settings.")
+            elif channel_id in self.dms_lookup:
+                self.update_extra_line("DM has no notification settings.")
+            else:   # set guild
+                for guild in self.guilds:
+                    if guild["guild_id"] == channel_id:
                         break
-                else:   # set guild
-                    for guild in self.guilds:
-                        if guild["guild_id"] == channel_id:
-                            break
-                    else:
-                        guild = None
-                    if guild:
-                        if cmd_args["setting"] == "suppress_everyone":
-                            value = not guild.get("suppress_everyone")
-                        elif cmd_args["setting"] == "suppress_roles":
-                            value = not guild.get("suppress_roles")
-                        else:
-                            value = None
-                        success = self.discord.send_notification_setting_guild(cmd_args["setting"], channel_id, value)
+                else:
+                    guild = None
+                if guild:
+                    if cmd_args["setting"] == "suppress_everyone":
+                        value = not guild.get("suppress_everyone")
+                    elif cmd_args["setting"] == "suppress_roles":
+                        value = not guild.get("suppress_roles")
                     else:
-                        self.update_extra_line("Guild not found.")
+                        value = None
+                    success = self.discord.send_notification_setting_guild(cmd_args["setting"], channel_id, value)
+                else:
+                    self.update_extra_line("Guild not found.")
 
         elif cmd_type == 41:   # GIF
             search_text = cmd_args.get("search_text", None)
@@ -3361,10 +3487,9 @@ class Endcord:
                 if channel["id"] == channel_id:
                     return channel_id, channel["name"], guild["guild_id"], guild["name"], channel["parent_id"]
         # check dms
-        for dm in self.dms:
-            if dm["id"] == channel_id:
-                name = dm["name"]
-                return channel_id, name, None, None, None
+        dm = self.dms_lookup.get(channel_id)
+        if dm:
+            return channel_id, dm["name"], None, None, None
         return None, None, None, None, None
 
 
@@ -3754,12 +3879,7 @@ class Endcord:
         missing_members = []
         for message in messages:
             message_user_id = message["user_id"]
-            if message_user_id in missing_members:
-                continue
-            for member in self.current_member_roles:
-                if member["user_id"] == message_user_id:
-                    break
-            else:
+            if message_user_id not in missing_members and message_user_id not in self.current_member_roles:
                 missing_members.append(message_user_id)
 
         # request missing members
@@ -3768,14 +3888,68 @@ class Endcord:
             self.gateway.request_members(current_guild, missing_members, nonce=self.missing_memmbers_nonce)
 
 
+    def prefetch_chat_chunk(self):
+        """Download next chat chunk in background when view is close to either end of loaded chat"""
+        channel_id = self.active_channel["channel_id"]
+        chat_h = self.tui.chat_hw[0]
+        margin = CHAT_PREFETCH_SCREENS * chat_h
+        if not self.chat_end and len(self.chat) - (self.tui.chat_index + chat_h) < margin:
+            self.prefetch_chat_chunk_direction(channel_id, True, self.messages[-1]["id"])
+        if self.tui.chat_index < margin and self.messages[0]["id"] != self.last_message_id:
+            self.prefetch_chat_chunk_direction(channel_id, False, self.messages[0]["id"])
+
+
+    def prefetch_chat_chunk_direction(self, channel_id, past, start_id):
+        """Submit background download of chat chunk before or after start_id, if it is not already prefetched"""
+        prefetched = self.prefetched_chunks.get(past)
+        if prefetched and prefetched[:2] == (channel_id, start_id) and time.time() - prefetched[2] < CHAT_PREFETCH_MAX_AGE:
+            return
+        if past:
+            args = (channel_id, 50, start_id, None, None, True)
+        else:
+            args = (channel_id, 50, None, start_id, None, True)
+        self.executor.submit(
+            self.discord.get_messages,
+            args,
+            callback=lambda messages: self.chat_chunk_prefetched(channel_id, past, start_id, messages),
+            key=("chat_prefetch", past),
+        )
+
+
+    def chat_chunk_prefetched(self, channel_id, past, start_id, messages):
+        """Stage prefetched chat chunk, so it is merged instantly when view reaches end of loaded chat"""
+        if channel_id != self.active_channel["channel_id"] or not self.messages:
+            return
+        if self.messages[-int(past)]["id"] != start_id:
+            return   # chat was changed meanwhile
+        if messages is None:   # network error, dont retry until chunk is requested or expired
+            self.prefetched_chunks[past] = (channel_id, start_id, time.time(), None)
+            return
+        if self.keep_deleted and messages:
+            messages = self.restore_deleted(messages)
+        self.request_missing_members(self.active_channel["guild_id"], messages)
+        self.prefetched_chunks[past] = (channel_id, start_id, time.time(), messages)
+
+
+    def take_prefetched_chunk(self, past, start_id):
+        """Return prefetched chat chunk that continues from start_id, or None if there is none"""
+        prefetched = self.prefetched_chunks.pop(past, None)
+        if prefetched and prefetched[:2] == (self.active_channel["channel_id"], start_id) and time.time() - prefetched[2] < CHAT_PREFETCH_MAX_AGE:
+            logger.debug(f"Using prefetched chat chunk {"before" if past else "after"} {start_id}")
+            return prefetched[3]
+        return None
+
+
     def get_chat_chunk(self, past=True, scroll=False):
         """Get chunk of chat in specified direction and add it to existing chat, trim chat to limited size and trigger update_chat"""
         self.add_running_task("Downloading chat", 4)
         start_id = self.messages[-int(past)]["id"]
 
         if past:
-            logger.debug(f"Requesting chat chunk before {start_id}")
-            new_chunk = self.get_messages_with_members(before=start_id)
+            new_chunk = self.take_prefetched_chunk(True, start_id)
+            if new_chunk is None:
+                logger.debug(f"Requesting chat chunk before {start_id}")
+                new_chunk = self.get_messages_with_members(before=start_id)
             if new_chunk is None:   # network error
                 self.remove_running_task("Downloading chat", 4)
                 return
@@ -3805,8 +3979,10 @@ class Endcord:
             self.tui.reset_chat_scrolled_top()
 
         else:
-            logger.debug(f"Requesting chat chunk after {start_id}")
-            new_chunk = self.get_messages_with_members(after=start_id)
+            new_chunk = self.take_prefetched_chunk(False, start_id)
+            if new_chunk is None:
+                logger.debug(f"Requesting chat chunk after {start_id}")
+                new_chunk = self.get_messages_with_members(after=start_id)
             if new_chunk is None:   # network error
                 self.remove_running_task("Downloading chat", 4)
                 return
@@ -3880,7 +4056,9 @@ class Endcord:
         """Download chat before switching channel to allow faster switching, used for initial chat when starting up"""
         self.state = peripherals.load_json(f"state_{self.profiles["selected"]}.json")
         if self.state and self.state["last_channel_id"]:
-            messages = self.discord.get_messages(self.state["last_channel_id"], self.msg_num)
+            messages = self.load_from_message_cache(self.state["last_channel_id"])
+            if not messages:
+                messages = self.discord.get_messages(self.state["last_channel_id"], self.msg_num)
             if messages is None:   # network error
                 return
             if self.need_preload and messages:
@@ -3888,6 +4066,23 @@ class Endcord:
                 self.preloaded = True
 
 
+    def load_from_message_cache(self, channel_id):
+        """
+        Load messages from disk message cache and download only messages newer than cached ones.
+        Returns None if channel is not cached, on network error, or if there are too many new messages.
+        """
+        if not self.message_cache:
+            return None
+        cached = self.message_cache.load(channel_id)
+        if not cached:
+            return None
+        new_messages = self.discord.get_messages(channel_id, self.msg_num, after=cached[0]["id"])
+        if new_messages is None or len(new_messages) >= self.msg_num:
+            return None   # there may be a gap between new and cached messages
+        logger.debug(f"Loaded {len(cached)} messages from message cache, {len(new_messages)} new")
+        return (new_messages + cached)[:self.msg_num]
+
+
     def toggle_member_list(self):
         """Toggle member list if there is enough space"""
         if self.member_list_visible:
@@ -3957,7 +4152,7 @@ class Endcord:
         elif guild_id:
             if self.get_members:   # first check member list
                 for presence in self.current_members:
-                    if "id" in presence and presence["id"] == user_id:
+                    if presence and "id" in presence and presence["id"] == user_id:
                         selected_presence = presence
                         break
             if not selected_presence:   # then check subscribed list
@@ -4137,7 +4332,7 @@ class Endcord:
         """Show live log in chat area"""
         self.messages = []
         log = log_queue.read_log_file(os.path.expanduser(f"{peripherals.log_path}{peripherals.APP_NAME}.log"))
-        self.chat, self.chat_format, self.chat_indexes, self.chat_map = formatter.generate_log(
+        self.chat, self.chat_format, self.chat_line_offsets, self.chat_map = formatter.generate_log(
             log,
             self.colors,
              self.tui.get_dimensions()[2][1],
@@ -4161,7 +4356,7 @@ class Endcord:
                 log.pop(0)
             selected_line, chat_index = self.tui.get_chat_selected()
             old_chat_len = len(self.chat)
-            self.chat, self.chat_format, self.chat_indexes, self.chat_map = formatter.generate_log(
+            self.chat, self.chat_format, self.chat_line_offsets, self.chat_map = formatter.generate_log(
                 log,
                 self.colors,
                 self.tui.get_dimensions()[2][1],
@@ -4190,7 +4385,6 @@ class Endcord:
 
         my_present_emojis = []
         my_present_ids = []
-        success = False
         for reaction in all_reactions:
             if reaction["me"]:
                 if reaction["emoji_id"]:
@@ -4215,19 +4409,19 @@ class Endcord:
         if emoji.is_emoji(emoji_string):   # standard emoji
             if emoji_string not in my_present_emojis:
                 if len(all_reactions) < 20 or add_to_existing:
-                    success = self.discord.send_reaction(
+                    self.executor.submit(self.discord.send_reaction, (
                         self.active_channel["channel_id"],
                         self.messages[msg_index]["id"],
                         emoji_string,
-                    )
+                    ), callback=self.network_call_done)
                 else:
                     self.update_extra_line("Maximum number of reactions reached.")
             else:
-                success = self.discord.remove_reaction(
+                self.executor.submit(self.discord.remove_reaction, (
                     self.active_channel["channel_id"],
                     self.messages[msg_index]["id"],
                     emoji_string,
-                )
+                ), callback=self.network_call_done)
 
         else:   # discord emoji
             match = re.match(match_emoji, emoji_string)
@@ -4249,22 +4443,19 @@ class Endcord:
                                 valid = True
                                 break
                         if valid:
-                            success = self.discord.send_reaction(
+                            self.executor.submit(self.discord.send_reaction, (
                                 self.active_channel["channel_id"],
                                 self.messages[msg_index]["id"],
                                 f"{emoji_name}:{emoji_id}",
-                            )
+                            ), callback=self.network_call_done)
                     else:
                         self.update_extra_line("Maximum number of reactions reached.")
                 else:
-                    success = self.discord.remove_reaction(
+                    self.executor.submit(self.discord.remove_reaction, (
                         self.active_channel["channel_id"],
                         self.messages[msg_index]["id"],
                         f"{emoji_name}:{emoji_id}",
-                    )
-        if success is None:
-            self.gateway.set_offline()
-            self.update_extra_line("Network error.")
+                    ), callback=self.network_call_done)
         self.restore_input_text = (None, None)
 
 
@@ -4723,8 +4914,34 @@ class Endcord:
             peripherals.native_open(path, mpv_path, yt_in_mpv=self.config["yt_in_mpv"])
 
 
+    def schedule_chat_update(self, change_amount=0):
+        """
+        Mark chat as needing regeneration, instead of regenerating it right away.
+        All scheduled updates are merged and performed once per frame with flush_chat_update().
+        """
+        self.chat_update_pending = True
+        self.chat_update_change += change_amount
+
+
+    def flush_chat_update(self):
+        """Perform scheduled chat update, if there is one and enough time has passed since last chat update"""
+        if not self.chat_update_pending:
+            return
+        if self.forum:   # scheduled before switching to forum
+            self.chat_update_pending = False
+            self.chat_update_change = 0
+            return
+        if time.time() - self.chat_update_time >= self.chat_frame_time:
+            self.update_chat(scroll=False)
+
+
     def update_chat(self, keep_selected=True, change_amount=0, select_message_index=None, scroll=True):
-        """Generate chat and update it in TUI"""
+        """Generate chat and update it in TUI, this will also perform any scheduled chat update"""
+        # selected message is shifted by all scheduled updates, because chat still has lines from before them
+        change_amount += self.chat_update_change
+        self.chat_update_pending = False
+        self.chat_update_change = 0
+        self.chat_update_time = time.time()
         if not self.messages:
             return
 
@@ -4750,7 +4967,7 @@ class Endcord:
             if last_acked_unreads_line and (not last_message_id or int(last_acked_unreads_line) < int(last_message_id)):
                 last_seen_msg = channel["last_acked_unreads_line"]
 
-        self.chat, self.chat_format, self.chat_indexes, self.chat_map = formatter.generate_chat(
+        self.chat, self.chat_format, self.chat_line_offsets, self.chat_map = formatter.generate_chat(
             self.messages,
             self.current_roles,
             self.current_channels,
@@ -4802,17 +5019,35 @@ class Endcord:
 
 
     def update_member_list(self, last_index=None, reset=False):
-        """Generate member list and update it in TUI"""
-        if last_index is not None and not self.tui.mlist_index-1 < last_index < self.tui.mlist_index-1 + self.screen.getmaxyx()[0]:
-            return   # dont regenerate for changes that are not visible
+        """Generate visible part of member list and update it in TUI"""
+        h = self.screen.getmaxyx()[0]
+        total = len(self.current_members)
+        index = 0 if reset else min(self.tui.mlist_index, max(total - 1, 0))
+        if last_index is not None and last_index > index + h:
+            return   # dont regenerate for changes that are below visible part
+        # format one screen above and below visible part, so scrolling has something to draw
+        start = max(index - h, 0)
+        end = index + 2 * h
+        self.member_list_window = (start, end)
         member_list, member_list_format = formatter.generate_member_list(
             self.current_members,
             self.current_roles,
             self.member_list_width,
             self.use_nick,
             self.status_char,
+            start=start,
+            end=end,
         )
-        self.tui.draw_member_list(member_list, member_list_format, reset=reset)
+        self.tui.draw_member_list(member_list, member_list_format, reset=reset, start=start, total=max(total, 1))
+
+
+    def check_member_list_window(self):
+        """Regenerate member list if it is scrolled outside generated part, and subscribe to member list ranges around it"""
+        index = self.tui.mlist_index
+        start, end = self.member_list_window
+        if index < start or (index + self.screen.getmaxyx()[0] > end and end < len(self.current_members)):
+            self.update_member_list()
+        self.gateway.subscribe_member_list(self.active_channel["channel_id"], self.active_channel["guild_id"], index)
 
 
     def update_tabs(self, no_redraw=False, add_current=False):
@@ -5091,16 +5326,32 @@ class Endcord:
                 self.tui.remove_extra_line()
 
 
+    def schedule_tree_update(self):
+        """
+        Mark tree as needing regeneration, instead of regenerating it right away.
+        All scheduled updates are merged and performed once per frame with flush_tree_update().
+        """
+        self.tree_update_pending = True
+
+
+    def flush_tree_update(self):
+        """Perform scheduled tree update, if there is one and enough time has passed since last tree update"""
+        if self.tree_update_pending and time.time() - self.tree_update_time >= self.chat_frame_time:
+            self.update_tree()
+
+
     def update_tree(self, collapsed=None):
-        """Generate channel tree"""
+        """Generate channel tree, this will also perform any scheduled tree update"""
+        self.tree_update_pending = False
+        self.tree_update_time = time.time()
         if collapsed is None:
             collapsed = self.state["collapsed"]
         self.tree, self.tree_format, self.tree_metadata = formatter.generate_tree(
             self.dms,
             self.guilds,
             self.threads,
-            self.get_unseen(),
-            self.get_unseen(mentions=True),
+            set(self.get_unseen()),
+            set(self.get_unseen(mentions=True)),
             self.guild_folders,
             self.activities,
             collapsed,
@@ -5147,27 +5398,25 @@ class Endcord:
 
     def lines_to_msg(self, lines):
         """Convert line index from formatted chat to message index"""
-        total_len = 0
-        for num, msg_len in enumerate(self.chat_indexes):
-            total_len += msg_len
-            if total_len >= lines + 1:
-                return num
+        num = bisect.bisect_left(self.chat_line_offsets, lines + 1)
+        if num < len(self.chat_line_offsets):
+            return num
         return 0
 
 
     def lines_to_msg_with_remainder(self, lines):
         """Convert line index from formatted chat to message index and remainder"""
-        total_len = 0
-        for num, msg_len in enumerate(self.chat_indexes):
-            total_len += msg_len
-            if total_len >= lines + 1:
-                return num, total_len - (lines + 1)
+        num = bisect.bisect_left(self.chat_line_offsets, lines + 1)
+        if num < len(self.chat_line_offsets):
+            return num, self.chat_line_offsets[num] - (lines + 1)
         return 0, 0
 
 
     def msg_to_lines(self, msg):
         """Convert message index to line index from formatted chat"""
-        return sum(self.chat_indexes[:msg + 1]) - 1
+        if msg < 0 or not self.chat_line_offsets:
+            return -1
+        return self.chat_line_offsets[min(msg, len(self.chat_line_offsets) - 1)] - 1
 
 
     def set_mix_seen(self, target_id):
@@ -5281,7 +5530,7 @@ class Endcord:
         if channel_id == self.active_channel["channel_id"] and not bool(self.tui.get_chat_selected()[1]):
             self.set_channel_seen(self.active_channel["channel_id"], message_id)
         if update_tree and not skip_unread:
-            self.update_tree()
+            self.schedule_tree_update()
 
 
     def set_channel_me_seen(self, channel_id, message_id):
@@ -5323,39 +5572,77 @@ class Endcord:
 
         # try to send
         if self.pending_acks and time.time() - self.sent_ack_time > self.ack_throttling:
-            success = self.discord.send_ack(*self.pending_acks.pop(0), manual=manual)
-            if success is None:
-                self.gateway.set_offline()
-                self.update_extra_line("Network error.")
+            channel_id, message_id = self.pending_acks.pop(0)
+            self.executor.submit(self.discord.send_ack, (channel_id, message_id, manual), callback=self.network_call_done)
             self.sent_ack_time = time.time()
 
 
+    def get_app_commands(self, guild_id):
+        """Get my and guild app commands, runs in background"""
+        my_commands, my_apps = self.discord.get_my_commands()
+        guild_commands, guild_apps = None, None
+        if guild_id:
+            guild_commands, guild_apps = self.discord.get_guild_commands(guild_id)
+        return guild_id, my_commands, my_apps, guild_commands, guild_apps
+
+
+    def app_commands_done(self, commands):
+        """Store app commands obtained in background and refresh app commands assist"""
+        guild_id, my_commands, my_apps, guild_commands, guild_apps = commands
+        if guild_id != self.active_channel["guild_id"]:
+            # guild changed meanwhile, run lookup again unless its already running for current guild
+            self.got_commands = self.executor.is_pending(("app_commands", self.active_channel["guild_id"]))
+            return
+        self.my_commands, self.my_apps = my_commands, my_apps
+        if guild_id:
+            self.guild_commands, self.guild_apps = guild_commands, guild_apps
+            # permissions depend on channel so they myt be computed each time
+            self.guild_commands_permitted = perms.compute_command_permissions(
+                self.guild_commands,
+                self.guild_apps,
+                self.active_channel["channel_id"],
+                guild_id,
+                self.current_my_roles,
+                self.my_id,
+                self.active_channel["admin"],
+                self.current_channel.get("perms_computed", 0),
+            )
+        if self.assist_type == 6:
+            self.assist(self.assist_word, self.assist_type)
+
+
+    def typing_sent_done(self, channel_id, slowmode_time):
+        """Check for slowmode after typing is sent"""
+        if slowmode_time and slowmode_time != 1 and channel_id not in self.slowmode_times:
+            self.slowmode_times[channel_id] = slowmode_time
+            if channel_id == self.active_channel["channel_id"]:
+                self.update_extra_line(f"Slowmode is enabled, will be able to send message in {slowmode_time}s")
+            if not self.slowmode_thread or not self.slowmode_thread.is_alive():
+                self.slowmode_thread = threading.Thread(target=self.wait_slowmode, daemon=True, args=())
+                self.slowmode_thread.start()
+
+
+    def network_call_done(self, success):
+        """Handle network error in background REST call"""
+        if success is None:
+            self.gateway.set_offline()
+            self.update_extra_line("Network error.")
+
+
     def compute_permissions(self):
         """Compute permissions for all guilds. Run after roles have been obtained"""
         for guild in self.guilds:
             guild_id = guild["guild_id"]
-            # get my roles
-            my_roles = None
-            for roles in self.my_roles:
-                if roles["guild_id"] == guild_id:
-                    my_roles = roles["roles"]
-                    break
+            my_roles = self.my_roles_lookup.get(guild_id)
             if my_roles is None:
                 continue
-            # get guild roles
-            this_guild_roles = []
-            for roles in self.all_roles:
-                if roles["guild_id"] == guild_id:
-                    this_guild_roles = roles["roles"]
-                    break
-            # get permissions
-            self.guilds = perms.compute_permissions(
-                self.guilds,
-                this_guild_roles,
-                guild_id,
+            perms.compute_permissions(
+                guild,
+                self.all_roles_lookup.get(guild_id, []),
                 my_roles,
                 self.my_id,
             )
+        search.clear_search_indexes()   # permitted channels could change
 
 
     def clean_permissions(self, guild_id):
@@ -5373,13 +5660,9 @@ class Endcord:
 
     def hide_channel(self, channel_id, guild_id):
         """Locally hide this channel, for this session"""
-        for guild in self.guilds:
-            if guild["guild_id"] == guild_id:
-                for channel in guild["channels"]:
-                    if channel["id"] == channel_id:
-                        channel["hidden"] = True
-                        break
-                break
+        channel = self.channels_lookup.get(channel_id)
+        if channel and guild_id in self.guilds_lookup:
+            channel["hidden"] = True
 
 
     def load_threads(self, event):
@@ -5428,7 +5711,7 @@ class Endcord:
                     for channel in guild["channels"]:
                         channel["threads"] = sorted(channel["threads"], key=lambda x: x["id"], reverse=True)
                 break
-        self.update_tree()
+        self.schedule_tree_update()
         if self.forum:
             self.update_forum(self.active_channel["guild_id"], self.active_channel["channel_id"])
             self.tui.update_chat(self.chat, self.chat_format)
@@ -5450,7 +5733,7 @@ class Endcord:
                         if thread["id"] == new_thread["id"]:
                             channel["threads"].pop(tnum)
                     break
-        self.update_tree()
+        self.schedule_tree_update()
         if self.forum:
             self.update_forum(self.active_channel["guild_id"], self.active_channel["channel_id"])
             self.tui.update_chat(self.chat, self.chat_format)
@@ -5481,16 +5764,16 @@ class Endcord:
     def toggle_mute(self, channel_id, guild_id=None, is_dm=False):
         """Toggle mute setting of channel, category, guild or DM"""
         if is_dm:   # dm
-            for dm in self.dms:
-                if dm["id"] == channel_id:
-                    if dm.get("muted"):
-                        dm["muted"] = False
-                        self.dms_vis_id.remove(channel_id)
-                    else:
-                        dm["muted"] = True
-                        self.dms_vis_id.append(channel_id)
-                    self.update_tree()
-                    return dm.get("muted")
+            dm = self.dms_lookup.get(channel_id)
+            if dm:
+                if dm.get("muted"):
+                    dm["muted"] = False
+                    self.dms_vis_id.remove(channel_id)
+                else:
+                    dm["muted"] = True
+                    self.dms_vis_id.append(channel_id)
+                self.update_tree()
+                return dm.get("muted")
         elif guild_id:   # channel/category
             for guild in self.guilds:
                 if guild["guild_id"] == guild_id:
@@ -5540,7 +5823,7 @@ class Endcord:
             # limit chat size
             if len(self.messages) > self.limit_chat_buffer:
                 self.messages.pop(-1)
-            self.update_chat(change_amount=1, scroll=False)
+            self.schedule_chat_update(change_amount=1)
             update_status_line = False
             if bool(self.tui.get_chat_selected()[1]):
                 if not self.new_unreads:
@@ -5567,7 +5850,7 @@ class Endcord:
                         for element in MESSAGE_UPDATE_ELEMENTS:
                             loaded_message[element] = data[element]
                             loaded_message["spoiled"] = 0
-                        self.update_chat(scroll=False)
+                        self.schedule_chat_update()
                     elif op == "MESSAGE_DELETE":
                         if self.keep_deleted:
                             self.messages[num]["deleted"] = True
@@ -5576,9 +5859,9 @@ class Endcord:
                             if num == 0:
                                 self.last_message_id = self.messages[0]["id"]
                         if num < selected_line and not self.keep_deleted:
-                            self.update_chat(change_amount=-1, scroll=False)
+                            self.schedule_chat_update(change_amount=-1)
                         else:
-                            self.update_chat(scroll=False)
+                            self.schedule_chat_update()
                     elif op == "MESSAGE_REACTION_ADD":
                         for num2, reaction in enumerate(loaded_message["reactions"]):
                             if data["emoji_id"] == reaction["emoji_id"] and data["emoji"] == reaction["emoji"]:
@@ -5593,7 +5876,7 @@ class Endcord:
                                 "count": 1,
                                 "me": my_message,
                             })
-                        self.update_chat(scroll=False)
+                        self.schedule_chat_update()
                     elif op == "MESSAGE_REACTION_REMOVE":
                         for num2, reaction in enumerate(loaded_message["reactions"]):
                             if data["emoji_id"] == reaction["emoji_id"] and data["emoji"] == reaction["emoji"]:
@@ -5604,7 +5887,7 @@ class Endcord:
                                     if my_message:
                                         loaded_message["reactions"][num2]["me"] = False
                                 break
-                        self.update_chat(scroll=False)
+                        self.schedule_chat_update()
                     elif op in ("MESSAGE_POLL_VOTE_ADD", "MESSAGE_POLL_VOTE_REMOVE") and "poll" in loaded_message:
                         if "poll" in loaded_message:
                             add = op == "MESSAGE_POLL_VOTE_ADD"
@@ -5614,7 +5897,7 @@ class Endcord:
                                     if my_message:
                                         loaded_message["poll"]["options"][num2]["me_voted"] = add
                                     break
-                        self.update_chat(scroll=False)
+                        self.schedule_chat_update()
 
 
     def process_msg_events_cached_channel(self, new_message, ch_num):
@@ -5684,24 +5967,17 @@ class Endcord:
             elif data["user_id"] not in self.blocked:
                 # skip muted channels
                 muted = False
-                for guild in self.guilds:
-                    if guild["guild_id"] == data["guild_id"]:
-                        if guild.get("muted"):
-                            break
-                        for channel in guild["channels"]:
-                            if new_message_channel_id == channel["id"] and (channel.get("muted") or channel.get("hidden")):
-                                muted = True
-                                break
-                        break
+                guild = self.guilds_lookup.get(data["guild_id"])
+                if guild and not guild.get("muted"):
+                    channel = self.channels_lookup.get(new_message_channel_id)
+                    if channel and (channel.get("muted") or channel.get("hidden")):
+                        muted = True
                 if not muted:
                     # check if this message should ping
                     ping = False
                     mentions = data["mentions"]
                     # select my roles from same guild as message
-                    my_roles = []
-                    for guild in self.my_roles:
-                        if guild["guild_id"] == data["guild_id"]:
-                            my_roles = guild["roles"]
+                    my_roles = self.my_roles_lookup.get(data["guild_id"], [])
                     if (
                         data["mention_everyone"] or
                         bool([i for i in my_roles if i in data["mention_roles"]]) or
@@ -5735,7 +6011,7 @@ class Endcord:
             if channel_id in self.read_state and new_message["d"]["id"] in self.read_state[channel_id]:
                      # if channel is from ready event - message is unknown
                     self.read_state[channel_id]["mentions"].remove(new_message["d"]["id"])
-                    self.update_tree()
+                    self.schedule_tree_update()
                     if self.enable_notifications:
                         for num_1, notification in enumerate(self.notifications):
                             if notification["channel_id"] == channel_id:
@@ -5763,22 +6039,17 @@ class Endcord:
                 self.my_user_data["nick"] = new_user_data["nick"]
             if changed_guild:   # its my roles update from guild_member_update
                 self.my_roles = self.gateway.get_my_roles()
+                self.update_roles_lookup()
                 self.clean_permissions(changed_guild)
                 self.compute_permissions()
-                for roles in self.my_roles:
-                    if roles["guild_id"] == changed_guild:
-                        self.current_my_roles = roles["roles"]
-                        break
-                for guild in self.member_roles:
-                    if guild["guild_id"] == self.active_channel["guild_id"]:
-                        for member in guild["members"]:
-                            if member["user_id"] == self.my_id:
-                                member["roles"] = self.current_my_roles
-                                member.pop("primary_role_color", None)
-                                break
-                        break
+                if changed_guild in self.my_roles_lookup:
+                    self.current_my_roles = self.my_roles_lookup[changed_guild]
+                member = self.member_roles.get(self.active_channel["guild_id"], {}).get(self.my_id)
+                if member:
+                    member["roles"] = self.current_my_roles
+                    member.pop("primary_role_color", None)
                 self.select_current_member_roles()
-                self.update_tree()
+                self.schedule_tree_update()
                 self.update_chat()
             self.update_status_line()
             self.update_prompt()
@@ -5786,12 +6057,7 @@ class Endcord:
         if guild_roles_changed:
             guild_id = guild_roles_changed[0]
             role_id = guild_roles_changed[1]
-            for num, roles in enumerate(self.my_roles):
-                if roles["guild_id"] == guild_id:
-                    break
-            else:
-                num = None
-            if num is not None:
+            if guild_id in self.my_roles_lookup:
                 self.all_roles = color.convert_role_colors(self.all_roles, guild_id, role_id, default=self.config["color_default"][0])
                 # 255_curses_bug - update only portion of roles color ids
                 self.all_roles = self.tui.init_role_colors(
@@ -5800,32 +6066,26 @@ class Endcord:
                     self.default_msg_alt_color[1],
                     guild_id=guild_id,
                 )
-                for roles in self.all_roles:
-                    if roles["guild_id"] == guild_id:
-                        self.current_roles = roles["roles"]
-                        break
-                for guild in self.member_roles:
-                    if guild["guild_id"] == guild_id:
-                        for member in guild["members"]:
-                            member.pop("primary_role_color", None)
-                        break
+                self.update_roles_lookup()
+                if guild_id == self.active_channel["guild_id"]:
+                    self.current_roles = self.all_roles_lookup.get(guild_id, [])
+                for member in list(self.member_roles.get(guild_id, {}).values()):
+                    member.pop("primary_role_color", None)
                 self.select_current_member_roles()
 
                 # update perms and redraw
-                if role_id in roles["roles"]:
+                if role_id in self.my_roles_lookup[guild_id]:
                     self.clean_permissions(guild_id)
                     self.compute_permissions()
-                    self.update_tree()
+                    self.schedule_tree_update()
                 if guild_id == self.active_channel["guild_id"]:
                     self.update_chat(scroll=False)
 
 
     def process_call_gateway_events(self, event):
         """Process call related event from gateway"""
-        for dm in self.dms:
-            if dm["id"] == event["channel_id"]:
-                break
-        else:
+        dm = self.dms_lookup.get(event["channel_id"])
+        if not dm:
             return
         if dm["is_spam"] or dm["muted"]:
             return
@@ -5914,31 +6174,30 @@ class Endcord:
         elif event["op"] == "USER_JOIN":
             self.stop_ringing()
             if self.in_call and not self.in_call["guild_id"]:
-                for dm in self.dms:
-                    if dm["id"] == self.in_call["channel_id"]:
-                        for recipient in dm["recipients"]:
-                            if recipient["id"] == event["user_id"]:
-                                name = recipient["global_name"] if recipient["global_name"] else recipient["username"]
-                                self.update_extra_line(f"{name} joined the call")
-                                # add call participant
-                                for num, participant in enumerate(self.call_participants):
-                                    if participant["user_id"] == event["user_id"]:
-                                        if not participant["name"]:
-                                            self.call_participants[num]["name"] = name
-                                            self.update_call_extra_line()
-                                        break
-                                else:
-                                    self.call_participants.append({
-                                        "user_id": recipient["id"],
-                                        "name": name,
-                                        "muted": False,
-                                        "speaking": False,
-                                    })
-                                    self.update_call_extra_line()
-                                if self.voice_call_list_open:
-                                    self.view_voice_call_list()
-                                break
-                        break
+                dm = self.dms_lookup.get(self.in_call["channel_id"])
+                if dm:
+                    for recipient in dm["recipients"]:
+                        if recipient["id"] == event["user_id"]:
+                            name = recipient["global_name"] if recipient["global_name"] else recipient["username"]
+                            self.update_extra_line(f"{name} joined the call")
+                            # add call participant
+                            for num, participant in enumerate(self.call_participants):
+                                if participant["user_id"] == event["user_id"]:
+                                    if not participant["name"]:
+                                        self.call_participants[num]["name"] = name
+                                        self.update_call_extra_line()
+                                    break
+                            else:
+                                self.call_participants.append({
+                                    "user_id": recipient["id"],
+                                    "name": name,
+                                    "muted": False,
+                                    "speaking": False,
+                                })
+                                self.update_call_extra_line()
+                            if self.voice_call_list_open:
+                                self.view_voice_call_list()
+                            break
             elif self.in_call:
                 for participant in self.call_participants:
                     if participant["user_id"] == event["user_id"] and participant["name"]:
@@ -6023,6 +6282,7 @@ class Endcord:
             self.user_agent,
             proxy=self.config["proxy"],
         )
+        self.voice_gateway.set_event_queue(self.events)
         self.in_call = {"guild_id": guild_id, "channel_id": channel_id}
         for _ in range(100):   # wait for 10s
             if self.voice_gateway.get_state() == 2:
@@ -6040,12 +6300,11 @@ class Endcord:
 
         if not guild_id:
             recipients = []
-            for dm in self.dms:
-                if dm["id"] == channel_id:
-                    for recipient in dm["recipients"]:
-                        if recipient["id"] != self.my_id:
-                            recipients.append(recipient["id"])
-                    break
+            dm = self.dms_lookup.get(channel_id)
+            if dm:
+                for recipient in dm["recipients"]:
+                    if recipient["id"] != self.my_id:
+                        recipients.append(recipient["id"])
             if recipients:
                 self.discord.send_ring(channel_id, recipients)
 
@@ -6088,14 +6347,13 @@ class Endcord:
 
         # keep popup (will be removed on CALL_DELETE event)
         if self.in_call and call_channel_id == self.active_channel["channel_id"]:
-            for dm in self.dms:
-                if dm["id"] == call_channel_id:
-                    new_permanent_extra_line = formatter.generate_extra_line_ring(
-                        dm["name"],
-                        self.tui.get_dimensions()[2][1],
-                    )
-                    self.update_extra_line(custom_text=new_permanent_extra_line, permanent=True)
-                    break
+            dm = self.dms_lookup.get(call_channel_id)
+            if dm:
+                new_permanent_extra_line = formatter.generate_extra_line_ring(
+                    dm["name"],
+                    self.tui.get_dimensions()[2][1],
+                )
+                self.update_extra_line(custom_text=new_permanent_extra_line, permanent=True)
         else:
             self.update_extra_line(permanent=True)
         self.in_call = None
@@ -6250,6 +6508,36 @@ class Endcord:
             })
 
 
+    def get_main_loop_timeout(self):
+        """Get time until the next timed main loop action is due, limited to MAIN_LOOP_IDLE_TIMEOUT"""
+        now = time.time()
+        timeout = MAIN_LOOP_IDLE_TIMEOUT
+        if self.pending_acks:
+            timeout = min(timeout, self.sent_ack_time + self.ack_throttling - now)
+        if self.typing:
+            timeout = min(timeout, min(user["timestamp"] for user in self.typing) + 11 - now)
+        if self.chat_update_pending:
+            timeout = min(timeout, self.chat_update_time + self.chat_frame_time - now)
+        if self.tree_update_pending:
+            timeout = min(timeout, self.tree_update_time + self.chat_frame_time - now)
+        if self.assist_type == 6 and not self.allow_app_command_autocomplete:
+            timeout = min(timeout, self.app_command_last_keypress + APP_COMMAND_AUTOCOMPLETE_DELAY - now)
+        return max(timeout, 0.01)
+
+
+    def wait_events(self, timeout):
+        """Block until any event is signaled in event queue or timeout expires, then drain all signaled events"""
+        try:
+            self.events.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                break
+
+
     def main(self):
         """Main app method"""
         logger.info("Init sequence started")
@@ -6261,7 +6549,7 @@ class Endcord:
             if self.gateway.error:
                 logger.fatal(f"Gateway error: \n {self.gateway.error}")
                 sys.exit(self.gateway.error + ERROR_TEXT)
-            time.sleep(0.2)
+            self.wait_events(0.2)
         self.my_id = self.gateway.get_my_id()
         self.premium = self.gateway.get_premium()
         self.my_user_data = self.gateway.get_my_user_data()
@@ -6327,12 +6615,14 @@ class Endcord:
         guilds = self.gateway.get_guilds()
         if guilds:
             self.guilds = guilds
+            self.update_guilds_lookup()
         self.all_roles = self.gateway.get_roles()
         self.all_roles = color.convert_role_colors(self.all_roles, default=self.config["color_default"][0])
         last_free_color_id = self.tui.get_last_free_color_id()
 
         # get my roles and compute perms
         self.my_roles = self.gateway.get_my_roles()
+        self.update_roles_lookup()
         self.compute_permissions()
 
         # load locally hidden channels
@@ -6405,11 +6695,8 @@ class Endcord:
                     if channel["id"] == channel_id and channel.get("permitted"):
                         channel_name = channel["name"]
                         break
-            else:
-                for channel in self.dms:
-                    if channel["id"] == channel_id:
-                        channel_name = channel["name"]
-                        break
+            elif channel_id in self.dms_lookup:
+                channel_name = self.dms_lookup[channel_id]["name"]
             if channel_name:
                 self.switch_channel(channel_id, channel_name, guild_id, guild_name, open_member_list=self.member_list_auto_open, preload=True)
                 self.tui.tree_select_active()
@@ -6486,91 +6773,74 @@ class Endcord:
             self.execute_extensions_methods("on_main_loop", cache=True)
 
             # get new messages
-            while self.run:
-                new_message = self.gateway.get_messages()
-                if new_message:
-                    new_message, = self.execute_extensions_methods("on_message_event", new_message, cache=True)
-                    new_message_channel_id = new_message["d"]["channel_id"]
-                    this_channel = (new_message_channel_id == self.active_channel["channel_id"])
-                    if this_channel:
-                        self.process_msg_events_active_channel(new_message, selected_line)
-                    # handle cached channels
-                    elif self.limit_channel_cache:
-                        in_cache = False
-                        for ch_num, channel in enumerate(self.channel_cache):
-                            if channel[0] == new_message_channel_id:
-                                in_cache = True
-                                break
-                        if in_cache:
-                            self.process_msg_events_cached_channel(new_message, ch_num)
-                    # handle unseen and mentions
-                    if not this_channel or (this_channel and (self.new_unreads or self.ping_this_channel or self.tui.disable_drawing or self.tui.is_window_open())):
-                        self.process_msg_events_other_channels(new_message)
-                    # remove ghost pings
-                    self.process_msg_events_ghost_ping(new_message)
-                else:
+            for raw_message in self.gateway.drain_messages():
+                if not self.run:
                     break
+                new_message, = self.execute_extensions_methods("on_message_event", raw_message, cache=True)
+                new_message_channel_id = new_message["d"]["channel_id"]
+                this_channel = (new_message_channel_id == self.active_channel["channel_id"])
+                if this_channel:
+                    self.process_msg_events_active_channel(new_message, selected_line)
+                # handle cached channels
+                elif self.limit_channel_cache:
+                    in_cache = False
+                    for ch_num, channel in enumerate(self.channel_cache):
+                        if channel[0] == new_message_channel_id:
+                            in_cache = True
+                            break
+                    if in_cache:
+                        self.process_msg_events_cached_channel(new_message, ch_num)
+                # handle unseen and mentions
+                if not this_channel or (this_channel and (self.new_unreads or self.ping_this_channel or self.tui.disable_drawing or self.tui.is_window_open())):
+                    self.process_msg_events_other_channels(new_message)
+                # remove ghost pings
+                self.process_msg_events_ghost_ping(new_message)
+            self.flush_chat_update()
 
             # get new typing
-            while self.run:
-                new_typing = self.gateway.get_typing()
-                if new_typing:
-                    if (
-                        new_typing["channel_id"] == self.active_channel["channel_id"] and
-                        new_typing["user_id"] not in self.blocked and
-                        new_typing["user_id"] != self.my_id
-                    ):
-                        if not new_typing["username"]:   # its DM
-                            for dm in self.dms:
-                                if dm["id"] == new_typing["channel_id"]:
-                                    new_typing["username"] = dm["recipients"][0]["username"]
-                                    new_typing["global_name"] = dm["recipients"][0]["global_name"]
-                                    break
-                        for num, user in enumerate(self.typing):
-                            if user["user_id"] == new_typing["user_id"]:
-                                self.typing[num]["timestamp"] = new_typing["timestamp"]
-                                break
-                        else:
-                            self.typing.append(new_typing)
-                        self.update_status_line()
-                else:
-                    break
+            for new_typing in self.gateway.drain_typing():
+                if (
+                    new_typing["channel_id"] == self.active_channel["channel_id"] and
+                    new_typing["user_id"] not in self.blocked and
+                    new_typing["user_id"] != self.my_id
+                ):
+                    if not new_typing["username"]:   # its DM
+                        dm = self.dms_lookup.get(new_typing["channel_id"])
+                        if dm:
+                            new_typing["username"] = dm["recipients"][0]["username"]
+                            new_typing["global_name"] = dm["recipients"][0]["global_name"]
+                    for num, user in enumerate(self.typing):
+                        if user["user_id"] == new_typing["user_id"]:
+                            self.typing[num]["timestamp"] = new_typing["timestamp"]
+                            break
+                    else:
+                        self.typing.append(new_typing)
+                    self.update_status_line()
 
             # get new summaries
             if self.save_summaries:
-                while self.run:
-                    new_summary = self.gateway.get_summaries()
-                    if new_summary:
-                        self.update_summary(new_summary)
-                    else:
-                        break
+                for new_summary in self.gateway.drain_summaries():
+                    self.update_summary(new_summary)
 
             # get new message_ack
-            while self.run:
-                new_message_ack = self.gateway.get_message_ack()
-                if new_message_ack:
-                    self.set_channel_seen(new_message_ack["channel_id"], new_message_ack["message_id"], ack=False)
-                else:
-                    break
+            for new_message_ack in self.gateway.drain_message_ack():
+                self.set_channel_seen(new_message_ack["channel_id"], new_message_ack["message_id"], ack=False, update_tree=False)
+                self.schedule_tree_update()
 
             # get thread updates
-            while self.run:
-                thread_event = self.gateway.get_threads()
-                if thread_event:
-                    if thread_event["op"] == "THREAD_UPDATE":
-                        self.load_threads(thread_event)   # add or update thread
-                    elif thread_event["op"] == "THREAD_DELETE":
-                        self.remove_thread()
-                else:
-                    break
+            for thread_event in self.gateway.drain_threads():
+                if thread_event["op"] == "THREAD_UPDATE":
+                    self.load_threads(thread_event)   # add or update thread
+                elif thread_event["op"] == "THREAD_DELETE":
+                    self.remove_thread()
+
+            # forget deleted channels and channels of left guilds
+            for channel_id in self.gateway.drain_removed_channels():
+                self.forget_channel(channel_id)
 
             # get new call events
-            while self.run:
-                new_call_event = self.gateway.get_call_events()
-                if new_call_event:
-                    self.process_call_gateway_events(new_call_event)
-                else:
-                    break
+            for new_call_event in self.gateway.drain_call_events():
+                self.process_call_gateway_events(new_call_event)
 
             # voice gateway stuff
             if self.voice_gateway:
@@ -6628,15 +6898,14 @@ class Endcord:
                 my_typing = self.tui.get_my_typing()
                 # typing indicator on server expires in 10s, so lest stay safe with 7s
                 if not self.ignore_typing and my_typing and time.time() >= self.typing_sent + 7:
-                    slowmode_time = self.discord.send_typing(self.active_channel["channel_id"])
+                    channel_id = self.active_channel["channel_id"]
+                    self.executor.submit(
+                        self.discord.send_typing,
+                        (channel_id, ),
+                        callback=lambda slowmode_time, channel_id=channel_id: self.typing_sent_done(channel_id, slowmode_time),
+                        key="typing",
+                    )
                     self.typing_sent = int(time.time())
-                    # check for slowmode
-                    if slowmode_time and slowmode_time != 1 and self.active_channel["channel_id"] not in self.slowmode_times:
-                        self.slowmode_times[self.active_channel["channel_id"]] = slowmode_time
-                        self.update_extra_line(f"Slowmode is enabled, will be able to send message in {slowmode_time}s")
-                        if not self.slowmode_thread or not self.slowmode_thread.is_alive():
-                            self.slowmode_thread = threading.Thread(target=self.wait_slowmode, daemon=True, args=())
-                            self.slowmode_thread.start()
 
             # remove unseen after scrolled to bottom on unseen channel
             if self.new_unreads or self.this_uread:
@@ -6666,10 +6935,12 @@ class Endcord:
             guilds = self.gateway.get_guilds()
             if guilds:
                 self.guilds = guilds
+                self.update_guilds_lookup()
+                formatter.clear_chat_cache()   # channels are updated in place
                 self.load_dms()
                 self.compute_permissions()
                 self.select_current_channels(refresh=True)
-                self.update_tree()
+                self.schedule_tree_update()
                 self.update_status_line()
 
             # check changes in dimensions
@@ -6688,13 +6959,12 @@ class Endcord:
                         incoming_call_ch_id = self.most_recent_incoming_call
                     else:
                         incoming_call_ch_id = self.active_channel["channel_id"]
-                    for dm in self.dms:
-                        if dm["id"] == incoming_call_ch_id:
-                            new_permanent_extra_line = formatter.generate_extra_line_ring(
-                                dm["name"],
-                                self.tui.get_dimensions()[2][1],
-                            )
-                            break
+                    dm = self.dms_lookup.get(incoming_call_ch_id)
+                    if dm:
+                        new_permanent_extra_line = formatter.generate_extra_line_ring(
+                            dm["name"],
+                            self.tui.get_dimensions()[2][1],
+                        )
                     if self.in_call:
                         new_permanent_extra_line = formatter.generate_extra_line_call(
                             self.call_participants,
@@ -6728,7 +6998,7 @@ class Endcord:
             new_activities = self.gateway.get_dm_activities()
             if new_activities:
                 self.activities = new_activities
-                self.update_tree()
+                self.schedule_tree_update()
 
             # check for user data updates
             new_user_data = self.gateway.get_user_update()
@@ -6751,6 +7021,8 @@ class Endcord:
                             self.view_profile(self.viewing_user_data)
                         if self.member_list_visible:
                             self.update_member_list(last_index)
+                if self.member_list_visible and self.active_channel["guild_id"]:
+                    self.check_member_list_window()
 
             # check for subscribed member presences
             new_members, changed_guilds = self.gateway.get_subscribed_activities()
@@ -6772,12 +7044,15 @@ class Endcord:
                     self.select_current_member_roles()
                     self.update_chat(scroll=False)
                     self.missing_memmbers_nonce = False
+                elif self.member_roles.get(self.active_channel["guild_id"]) is not self.current_member_roles:
+                    self.select_current_member_roles()   # guild was evicted and added again
 
             # check for tree format changes
             self.check_tree_format()
 
             # check if new chat chunks needs to be downloaded in any direction
             if not self.forum and self.messages:
+                self.prefetch_chat_chunk()
                 if (selected_line == 0 or text_index == 0) and self.messages[0]["id"] != self.last_message_id:
                     self.get_chat_chunk(past=False, scroll=not(text_index == 0 and selected_line <= 2))
                 elif (selected_line >= len(self.chat) - 1 or self.tui.get_chat_scrolled_top()) and not self.chat_end:
@@ -6803,21 +7078,12 @@ class Endcord:
                         self.ignore_typing = True
                         if not self.got_commands:
                             # this will be allowed to run when channel changes
-                            self.got_commands = True
-                            self.my_commands, self.my_apps = self.discord.get_my_commands()
-                            if self.active_channel["guild_id"]:
-                                self.guild_commands, self.guild_apps = self.discord.get_guild_commands(self.active_channel["guild_id"])
-                                # permissions depend on channel so they myt be computed each time
-                                self.guild_commands_permitted = perms.compute_command_permissions(
-                                    self.guild_commands,
-                                    self.guild_apps,
-                                    self.active_channel["channel_id"],
-                                    self.active_channel["guild_id"],
-                                    self.current_my_roles,
-                                    self.my_id,
-                                    self.active_channel["admin"],
-                                    self.current_channel.get("perms_computed", 0),
-                                )
+                            self.got_commands = self.executor.submit(
+                                self.get_app_commands,
+                                (self.active_channel["guild_id"], ),
+                                callback=self.app_commands_done,
+                                key=("app_commands", self.active_channel["guild_id"]),
+                            ) is not None
                         self.assist(assist_word, assist_type)
                     elif not self.allow_app_command_autocomplete and time.time() - self.app_command_last_keypress >= APP_COMMAND_AUTOCOMPLETE_DELAY:
                         self.allow_app_command_autocomplete = True
@@ -6842,4 +7108,23 @@ class Endcord:
                 logger.fatal(f"Gateway error: \n {self.gateway.error}")
                 sys.exit(self.gateway.error + ERROR_TEXT)
 
-            time.sleep(0.1)   # some reasonable delay
+            # run callbacks of completed background REST calls
+            self.executor.run_callbacks()
+
+            # download likely-next channels when idle
+            if self.warmup_channels and self.limit_channel_cache > 1:
+                self.warmup_channel()
+
+            self.flush_tree_update()
+
+            # sleep until there is new event or some timer is due
+            self.wait_events(self.get_main_loop_timeout())
+
+        # save active channel chat to disk cache
+        if self.message_cache:
+            if not self.forum and self.messages and self.messages[0]["id"] == self.last_message_id:
+                self.message_cache.save(self.active_channel["channel_id"], self.messages[:self.msg_num])
+            self.message_cache.close()
+
+        # keep gateway session resumable for next start
+        self.gateway.save_session(self.threads)
@@ -1,9 +1,46 @@
 import json
 import os
+import time
 
 from endcord import peripherals
 
 
+class TimeProfile:
+    """Measure time spent in named stages of some work and format it as report"""
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []   # [(stage_name, seconds, items), ...]
+        self.start_time = time.perf_counter()
+        self.stage_time = self.start_time
+
+
+    def stage(self, name, items=None):
+        """End current stage and start next one, items is optional number of processed items"""
+        now = time.perf_counter()
+        self.stages.append((name, now - self.stage_time, items))
+        self.stage_time = now
+
+
+    def total(self):
+        """Get total time since profile was started"""
+        return time.perf_counter() - self.start_time
+
+
+    def report(self):
+        """Format time profile as aligned table with duration, share of total time and items per stage"""
+        total = self.total()
+        width = max([len(x[0]) for x in self.stages] + [5])
+        lines = [f"{self.name} time profile:"]
+        for name, duration, items in self.stages:
+            line = f"    {name.ljust(width)} {duration * 1000:10.3f}ms {duration / total * 100 if total else 0:5.1f}%"
+            if items is not None:
+                line += f"  {items} items"
+            lines.append(line)
+        lines.append(f"    {"total".ljust(width)} {total * 1000:10.3f}ms")
+        return "\n".join(lines)
+
+
 def hash_none(value):
     """Hash an integer value as a string and return it as a string, omitting None"""
     if value is None:
@@ -6,6 +6,11 @@ settings = {
     "downloads_path": None,
     "limit_chat_buffer": 100,
     "limit_channel_cache": 5,
+    "message_cache_channels": 0,
+    "message_cache_max_age": 24,
+    "warmup_channels": 0,
+    "resume_session": False,
+    "gateway_compression": "zlib-stream",
     "download_msg": 25,
     "convert_timezone": True,
     "send_typing": True,
@@ -30,6 +35,7 @@ settings = {
     "mouse_scroll_sensitivity": 3,
     "mouse_scroll_selection": False,
     "screen_update_delay": 0.01,
+    "chat_max_fps": 30,
     "extra_line_delay": 5,
     "tenor_gif_type": 1,
     "trim_embed_url_size": 40,
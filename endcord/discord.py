@@ -5,6 +5,7 @@ import os
 import re
 import socket
 import ssl
+import threading
 import time
 import urllib.parse
 import uuid
@@ -24,6 +25,12 @@ SEARCH_PARAMS = ("content", "channel_id", "author_id", "mentions", "has", "max_i
 SEARCH_HAS_OPTS = ("link", "embed", "poll", "file", "video", "image", "sound", "sticker", "forward")
 PING_OPTIONS = ("all", "mention", "nothing")
 SUPPRESS_OPTIONS = ("suppress_everyone", "suppress_roles")
+POOL_IDLE_TIMEOUT = 60   # close kept-alive connections that are idle for longer than this
+POOL_MAX_IDLE = 4   # max number of idle connections kept per host
+RATE_LIMIT_MAX_WAIT = 10   # dont wait for rate limit longer than this, let request fail instead
+RATE_LIMIT_RETRIES = 2   # how many times request is sent again after 429
+MAJOR_PARAMETERS = ("channels", "guilds", "webhooks")
+BACKGROUND_ROUTES = ("/ack", "/typing", "/read-states/", "/settings-proto/", "/activities")   # these requests leave room in bucket for user-visible requests
 logger = logging.getLogger(__name__)
 
 
@@ -53,6 +60,32 @@ def generate_nonce():
     return str((int(time.time() * 1000) - DISCORD_EPOCH * 1000) << 22)
 
 
+def get_route(method, url):
+    """Get rate limit route from request method and url, ids other than major parameter are generalized"""
+    parts = url.split("?")[0].split("/")
+    major = False
+    for num, part in enumerate(parts):
+        if part.isdigit():
+            if not major and num and parts[num-1] in MAJOR_PARAMETERS:
+                major = True
+            else:
+                parts[num] = "id"
+    return method + " " + "/".join(parts)
+
+
+def get_major_id(route):
+    """Get major parameter id from rate limit route, or None if route has no major parameter"""
+    for part in route.split("/"):
+        if part.isdigit():
+            return part
+    return None
+
+
+def resendable(body):
+    """Check if request body can be sent again, streamed body cant be rewound"""
+    return body is None or isinstance(body, (bytes, str))
+
+
 def build_multipart_body(data):
     """
     Build multipart/form-data body for http.client.
@@ -75,6 +108,274 @@ def build_multipart_body(data):
     return body, content_type, content_len
 
 
+class SocksHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPSConnection that connects through SOCKS5 proxy, so it can reconnect by itself"""
+
+    def __init__(self, host, port, proxy_host, proxy_port, timeout=10):
+        super().__init__(host, port, timeout=timeout)
+        self.proxy_host = proxy_host
+        self.proxy_port = proxy_port
+
+
+    def connect(self):
+        """Connect to the host through proxy and wrap socket with TLS"""
+        proxy_sock = socks.socksocket()
+        proxy_sock.set_proxy(socks.SOCKS5, self.proxy_host, self.proxy_port)
+        proxy_sock.settimeout(self.timeout)
+        proxy_sock.connect((self.host, self.port))
+        ssl_context = ssl.create_default_context()
+        ssl_context.minimum_version = ssl.TLSVersion.TLSv1_2
+        self.sock = ssl_context.wrap_socket(proxy_sock, server_hostname=self.host)
+
+
+class RateLimiter():
+    """
+    Thread-safe tracker of Discord rate limit buckets.
+    Requests wait for their bucket and global limit, background requests leave last slot to user-visible ones.
+    """
+
+    def __init__(self):
+        self.routes = {}   # {route: (bucket, major_id)}
+        self.buckets = {}   # {(bucket, major_id): [remaining, reset_time]}
+        self.waiting = {}   # {(bucket, major_id): number of waiting user-visible requests}
+        self.global_reset = 0
+        self.condition = threading.Condition()
+
+
+    def get_delay(self, bucket, background, now):
+        """Get how long request should wait before it is sent, must be called with condition acquired"""
+        delay = self.global_reset - now
+        state = self.buckets.get(bucket)
+        if state and state[1] > now and state[0] <= int(background):
+            delay = max(delay, state[1] - now)
+        if background and self.waiting.get(bucket):
+            delay = max(delay, 0.1)
+        return delay
+
+
+    def acquire(self, route, background=False):
+        """Wait until request on this route can be sent, returns False if wait would be too long"""
+        with self.condition:
+            bucket = self.routes.get(route, route)
+            if not background:
+                self.waiting[bucket] = self.waiting.get(bucket, 0) + 1
+            start = time.time()
+            try:
+                while True:
+                    now = time.time()
+                    delay = self.get_delay(bucket, background, now)
+                    if delay <= 0:
+                        break
+                    if now + delay - start > RATE_LIMIT_MAX_WAIT:
+                        logger.debug(f"Rate limit wait on {route} is too long, not sending")
+                        return False
+                    self.condition.wait(delay)
+                state = self.buckets.get(bucket)
+                if state and state[1] > now:
+                    state[0] -= 1
+                return True
+            finally:
+                if not background:
+                    self.waiting[bucket] -= 1
+                    if not self.waiting[bucket]:
+                        del self.waiting[bucket]
+                    self.condition.notify_all()
+
+
+    def update(self, route, response):
+        """Update bucket state from response headers"""
+        bucket = response.getheader("X-RateLimit-Bucket")
+        remaining = response.getheader("X-RateLimit-Remaining")
+        reset_after = response.getheader("X-RateLimit-Reset-After")
+        with self.condition:
+            if bucket:
+                bucket = (bucket, get_major_id(route))   # limits are per bucket and major parameter
+                self.routes[route] = bucket
+            else:
+                bucket = self.routes.get(route, route)
+            if remaining is not None and reset_after is not None:
+                self.buckets[bucket] = [int(remaining), time.time() + float(reset_after)]
+            self.condition.notify_all()
+
+
+    def limit_hit(self, route, retry_after, is_global):
+        """Block route or all routes after 429 was received"""
+        with self.condition:
+            reset_time = time.time() + retry_after
+            if is_global:
+                self.global_reset = max(self.global_reset, reset_time)
+            else:
+                self.buckets[self.routes.get(route, route)] = [0, reset_time]
+
+
+class PooledConnection():
+    """
+    Wrapper around HTTPSConnection taken from ConnectionPool.
+    Calling close() will return connection to the pool if its response is fully read, otherwise it is closed.
+    If kept-alive connection is closed by the server, request is sent again on new connection.
+    If rate limiter is set, request waits for its bucket and is sent again after 429.
+    If rate limit wait is too long, request is not sent and TimeoutError is raised.
+    """
+
+    def __init__(self, pool, key, connection, reused, rate_limiter=None):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.reused = reused
+        self.rate_limiter = rate_limiter
+        self.response = None
+        self.request_args = None
+        self.route = None
+        self.background = False
+
+
+    def __getattr__(self, name):
+        """Forward other attributes to wrapped HTTPSConnection"""
+        return getattr(self.connection, name)
+
+
+    def can_retry(self, body):
+        """Check if request can be sent again on new connection"""
+        return self.reused and resendable(body)
+
+
+    def request(self, method, url, body=None, headers={}, background=False):
+        """Same as HTTPSConnection.request(), background requests leave room in bucket for user-visible requests"""
+        self.response = None
+        self.request_args = (method, url, body, headers)
+        if self.rate_limiter:
+            self.route = get_route(method, url)
+            self.background = background or any(x in url for x in BACKGROUND_ROUTES)
+            if not self.rate_limiter.acquire(self.route, self.background):
+                raise TimeoutError(f"Rate limit wait on {self.route} is too long")
+        try:
+            self.connection.request(method, url, body, headers)
+        except (BrokenPipeError, ConnectionResetError):
+            if not self.can_retry(body):
+                raise
+            logger.debug(f"Kept-alive connection to {self.key[0]} was closed, reconnecting")
+            self.reused = False
+            self.connection.close()
+            self.connection.request(method, url, body, headers)
+
+
+    def getresponse(self):
+        """Same as HTTPSConnection.getresponse()"""
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            response = self.receive()
+            if not self.rate_limiter:
+                break
+            self.rate_limiter.update(self.route, response)
+            if response.status != 429:
+                break
+            retry_after = float(response.getheader("Retry-After", 1))
+            is_global = response.getheader("X-RateLimit-Global") == "true" or response.getheader("X-RateLimit-Scope") == "global"
+            self.rate_limiter.limit_hit(self.route, retry_after, is_global)
+            logger.debug(f"Rate limited on {self.route}, retry after: {retry_after}, global: {is_global}")
+            if attempt == RATE_LIMIT_RETRIES or retry_after > RATE_LIMIT_MAX_WAIT or not resendable(self.request_args[2]):
+                break
+            response.read()
+            self.request(*self.request_args, background=self.background)
+        return response
+
+
+    def receive(self):
+        """Get response and send request again if kept-alive connection was closed"""
+        try:
+            self.response = self.connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            if not (self.request_args and self.can_retry(self.request_args[2])):
+                raise
+            logger.debug(f"Kept-alive connection to {self.key[0]} was closed, reconnecting")
+            self.reused = False
+            self.connection.close()
+            self.connection.request(*self.request_args)
+            self.response = self.connection.getresponse()
+        return self.response
+
+
+    def close(self):
+        """Return connection to the pool or close it if it cant be reused"""
+        self.pool.release(self)
+
+
+class ConnectionPool():
+    """Thread-safe pool of kept-alive HTTPS connections, grouped by host, handles proxying"""
+
+    def __init__(self, proxy, idle_timeout=POOL_IDLE_TIMEOUT, max_idle=POOL_MAX_IDLE):
+        self.proxy = proxy
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.idle = {}   # {(host, port): [(connection, release_time), ...]}
+        self.lock = threading.Lock()
+
+
+    def new_connection(self, host, port):
+        """Create new connection object and handle proxying"""
+        if self.proxy.scheme:
+            if self.proxy.scheme.lower() == "http":
+                connection = http.client.HTTPSConnection(self.proxy.hostname, self.proxy.port)
+                connection.set_tunnel(host, port=port)
+            elif "socks" in self.proxy.scheme.lower():
+                connection = SocksHTTPSConnection(host, port, self.proxy.hostname, self.proxy.port, timeout=10)
+            else:
+                connection = http.client.HTTPSConnection(host, port)
+        else:
+            connection = http.client.HTTPSConnection(host, port, timeout=5)
+        return connection
+
+
+    def evict_idle(self, now):
+        """Close all connections that are idle for too long, must be called with lock acquired"""
+        for key, connections in list(self.idle.items()):
+            fresh = []
+            for connection, release_time in connections:
+                if now - release_time < self.idle_timeout and connection.sock:
+                    fresh.append((connection, release_time))
+                else:
+                    connection.close()
+            if fresh:
+                self.idle[key] = fresh
+            else:
+                del self.idle[key]
+
+
+    def get(self, host, port, rate_limiter=None):
+        """Get idle connection to the host, or create new one"""
+        key = (host, port)
+        with self.lock:
+            self.evict_idle(time.time())
+            connections = self.idle.get(key)
+            if connections:
+                connection, _ = connections.pop()
+                return PooledConnection(self, key, connection, True, rate_limiter)
+        return PooledConnection(self, key, self.new_connection(host, port), False, rate_limiter)
+
+
+    def release(self, pooled):
+        """Return connection to the pool if it can be reused, otherwise close it"""
+        connection = pooled.connection
+        response = pooled.response
+        if connection.sock is None or response is None or not response.isclosed() or response.will_close:
+            connection.close()
+            return
+        with self.lock:
+            connections = self.idle.setdefault(pooled.key, [])
+            if len(connections) < self.max_idle:
+                connections.append((connection, time.time()))
+                return
+        connection.close()
+
+
+    def close_all(self):
+        """Close all idle connections"""
+        with self.lock:
+            for connections in self.idle.values():
+                for connection, _ in connections:
+                    connection.close()
+            self.idle = {}
+
+
 class Discord():
     """Methods for fetching and sending data to Discord using REST API"""
 
@@ -105,6 +406,8 @@ class Discord():
         }
         self.user_agent = user_agent
         self.proxy = urllib.parse.urlsplit(proxy)
+        self.pool = ConnectionPool(self.proxy)
+        self.rate_limiter = RateLimiter()
         self.my_id = self.get_my_id(exit_on_error=True)
         self.activity_token = None
         self.protos = [[], []]
@@ -127,27 +430,14 @@ class Discord():
 
 
     def get_connection(self, host, port):
-        """Get connection object and handle proxying"""
-        if self.proxy.scheme:
-            if self.proxy.scheme.lower() == "http":
-                connection = http.client.HTTPSConnection(self.proxy.hostname, self.proxy.port)
-                connection.set_tunnel(host, port=port)
-            elif "socks" in self.proxy.scheme.lower():
-                proxy_sock = socks.socksocket()
-                proxy_sock.set_proxy(socks.SOCKS5, self.proxy.hostname, self.proxy.port)
-                proxy_sock.settimeout(10)
-                proxy_sock.connect((host, port))
-                ssl_context = ssl.create_default_context()
-                ssl_context.minimum_version = ssl.TLSVersion.TLSv1_2
-                proxy_sock = ssl_context.wrap_socket(proxy_sock, server_hostname=host)
-                # proxy_sock.do_handshake()   # seems like its not needed
-                connection = http.client.HTTPSConnection(host, port, timeout=10)
-                connection.sock = proxy_sock
-            else:
-                connection = http.client.HTTPSConnection(host, port)
-        else:
-            connection = http.client.HTTPSConnection(host, port, timeout=5)
-        return connection
+        """
+        Get kept-alive connection object from the pool, proxying is handled by the pool.
+        Calling close() on it will return it to the pool.
+        Requests to API host are scheduled by rate limiter.
+        """
+        if host == self.host:
+            return self.pool.get(host, port, self.rate_limiter)
+        return self.pool.get(host, port)
 
 
     def get_my_id(self, exit_on_error=False):
@@ -370,8 +660,11 @@ class Discord():
         return []
 
 
-    def get_messages(self, channel_id, num=50, before=None, after=None, around=None):
-        """Get specified number of messages, optionally number before and after message ID"""
+    def get_messages(self, channel_id, num=50, before=None, after=None, around=None, background=False):
+        """
+        Get specified number of messages, optionally number before and after message ID.
+        Background requests leave room in rate limit bucket for user-visible requests.
+        """
         message_data = None
         url = f"/api/v9/channels/{channel_id}/messages?limit={num}"
         if before:
@@ -382,7 +675,7 @@ class Discord():
             url += f"&around={around}"
         try:
             connection = self.get_connection(self.host, 443)
-            connection.request("GET", url, message_data, self.header)
+            connection.request("GET", url, message_data, self.header, background=background)
             response = connection.getresponse()
         except (socket.gaierror, TimeoutError):
             connection.close()
@@ -0,0 +1,77 @@
+import collections
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+WORKERS = 3   # max number of calls running at the same time
+MAX_PENDING = 50   # calls submitted above this are dropped
+
+
+class Executor():
+    """Run blocking calls (mostly REST) in pool of worker threads, completion callbacks are run from main loop"""
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING):
+        self.max_pending = max_pending
+        self.tasks = queue.Queue()
+        self.done = collections.deque()
+        self.pending_keys = set()
+        self.lock = threading.Lock()
+        self.event_queue = None
+        for _ in range(workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+
+    def worker(self):
+        """Run submitted calls and store callbacks of completed calls"""
+        while True:
+            future, function, args, callback, key = self.tasks.get()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(function(*args))
+                except Exception as e:
+                    logger.error(f"Error in background call {getattr(function, "__name__", function)}: {e}")
+                    future.set_exception(e)
+            with self.lock:
+                self.pending_keys.discard(key)
+            if callback and not future.cancelled() and future.exception() is None:
+                self.done.append((callback, future.result()))
+                if self.event_queue is not None:
+                    self.event_queue.put("EXECUTOR")
+
+
+    def submit(self, function, args=(), callback=None, key=None):
+        """
+        Run function(*args) in worker thread, and return its future, or None if call is dropped.
+        callback(result) is later run from main loop with run_callbacks().
+        Call is dropped if call with same key is still pending, or if there are too many pending calls.
+        """
+        with self.lock:
+            if key is not None and key in self.pending_keys:
+                return None
+            if self.tasks.qsize() >= self.max_pending:
+                logger.warning("Too many pending background calls, dropping call")
+                return None
+            if key is not None:
+                self.pending_keys.add(key)
+        future = Future()
+        self.tasks.put((future, function, args, callback, key))
+        return future
+
+
+    def is_pending(self, key):
+        """Check if call with this key is still pending"""
+        return key in self.pending_keys
+
+
+    def run_callbacks(self):
+        """Run callbacks of all completed calls, must be called from main loop"""
+        while self.done:
+            callback, result = self.done.popleft()
+            callback(result)
+
+
+    def set_event_queue(self, event_queue):
+        """Set queue into which completed calls are signaled, used to wake up main loop"""
+        self.event_queue = event_queue
@@ -7,7 +7,7 @@ from datetime import UTC, datetime
 
 import emoji
 
-from endcord.wide_ranges import WIDE_RANGES
+from endcord.wide_ranges import WIDE_ASTRAL, WIDE_BMP
 
 logger = logging.getLogger(__name__)
 DAY_MS = 24*60*60*1000
@@ -17,6 +17,10 @@ TREE_EMOJI_REPLACE = "▮"
 
 TIME_DIVS = [1, 60, 3600, 86400, 2678400, 31190400]
 TIME_UNITS = ["second", "minute", "hour", "day", "month", "year"]
+CHAT_CACHE_LIMIT = 2000   # max number of formatted messages kept in cache
+WIDTH_CACHE_LIMIT = 5000   # max number of strings with memoized width
+WIDTH_CACHE_MAX_LEN = 100   # longer strings are not memoized
+DM_STATUS_CODES = {"online": 2, "idle": 3, "dnd": 4}   # tree_format offsets for DM status
 
 match_emoji = re.compile(r"(?<!\\):.+:")
 match_d_emoji = re.compile(r"<(.?):(.*?):(\d*?)>")
@@ -37,6 +41,9 @@ match_url = re.compile(r"https?:\/\/\w+(\.\w+)+[^\r\n\t\f\v )\]>]*")
 match_discord_channel_url = re.compile(r"https:\/\/discord\.com\/channels\/(\d*)\/(\d*)(?:\/(\d*))?")
 match_discord_channel_combined = re.compile(r"<#(\d*?)>|https:\/\/discord\.com\/channels\/(\d*)\/(\d*)(?:\/(\d*))?")
 match_sticker_id = re.compile(r"<;\d*?;>")
+chat_cache = {}   # {message_id: (render_key, lines, formats, chat_map)}
+chat_cache_context = ()
+width_cache = {}   # {text: width}
 
 
 def sort_by_indexes(input_list, indexes):
@@ -188,18 +195,18 @@ def replace_emoji_string(line):
 
 
 def binary_search(codepoint, ranges):
-    """Binary-search a tuple of (start, end) ranges and return 1 if codepoint is inside any range, else 0"""
+    """Binary-search a tuple of (start, end) ranges, with end excluded, and return 1 if codepoint is inside any range, else 0"""
     low = 0
     high = len(ranges) - 1
 
-    if codepoint < ranges[0][0] or codepoint > ranges[high][1]:
+    if codepoint < ranges[0][0] or codepoint >= ranges[high][1]:
         return 0
 
     while low <= high:
         mid = (low + high) // 2
         start, end = ranges[mid]
 
-        if codepoint > end:
+        if codepoint >= end:
             low = mid + 1
         elif codepoint < start:
             high = mid - 1
@@ -209,15 +216,17 @@ def binary_search(codepoint, ranges):
     return 0
 
 
-def limit_width_wch(text, max_width):
-    """Limit width of the text on the screen, because "wide characters" are 2 characters wide"""
+def crop_width_wch(text, max_width):
+    """Crop text to max_width on the screen, because "wide characters" are 2 characters wide"""
     total_width = 0
     for i, ch in enumerate(text):
         character = ord(ch)
         if 32 <= character < 0x7f:
             char_width = 1
+        elif character < 0x10000:
+            char_width = 1 + ((WIDE_BMP[character >> 3] >> (character & 7)) & 1)
         else:
-            char_width = 1 + binary_search(character, WIDE_RANGES)
+            char_width = 1 + binary_search(character, WIDE_ASTRAL)
         if total_width + char_width > max_width:
             return text[:i], total_width
         total_width += char_width
@@ -226,10 +235,25 @@ def limit_width_wch(text, max_width):
 
 # use cython if available, ~5 times faster
 if importlib.util.find_spec("endcord_cython") and importlib.util.find_spec("endcord_cython.formatter"):
-    from endcord_cython.formatter import limit_width_wch as limit_width_wch_cython
-    def limit_width_wch(text, max_width):
-        """Limit width of the text on the screen, because "wide characters" are 2 characters wide"""
-        return limit_width_wch_cython(text, max_width, WIDE_RANGES)
+    from endcord_cython.formatter import crop_width_wch as crop_width_wch_cython
+    def crop_width_wch(text, max_width):
+        """Crop text to max_width on the screen, because "wide characters" are 2 characters wide"""
+        return crop_width_wch_cython(text, max_width, WIDE_BMP, WIDE_ASTRAL)
+
+
+def limit_width_wch(text, max_width):
+    """Limit width of the text on the screen, widths of short strings that fit are memoized"""
+    if max_width >= 0 and text.isascii():
+        return text[:max_width], min(len(text), max_width)
+    width = width_cache.get(text)
+    if width is not None and width <= max_width:
+        return text, width
+    cropped, width = crop_width_wch(text, max_width)
+    if len(cropped) == len(text) and len(text) <= WIDTH_CACHE_MAX_LEN:
+        if len(width_cache) >= WIDTH_CACHE_LIMIT:
+            width_cache.clear()
+        width_cache[text] = width
+    return cropped, width
 
 
 def normalize_string(input_string, max_length, emoji_safe=False, dots=False, fill=True):
@@ -621,6 +645,50 @@ def format_poll(poll):
     return content.strip("\n")
 
 
+def clear_chat_cache():
+    """Remove all formatted messages from chat cache, should be called when channels or roles have changed in place"""
+    global chat_cache_context
+    chat_cache.clear()
+    chat_cache_context = ()
+
+
+def check_chat_cache_context(context):
+    """Check if chat cache is generated with same context, if not, clear it and store new context"""
+    global chat_cache_context
+    if len(context) == len(chat_cache_context) and all(a is b or a == b for a, b in zip(context, chat_cache_context)):
+        return
+    chat_cache.clear()
+    chat_cache_context = context
+
+
+def message_render_key(message, mentioned, role_color, alt_role_color, color_base, blocked_reply):
+    """
+    Get key that changes whenever formatted lines of this message would change.
+    Returns None if message should not be cached because its content depends on current time.
+    """
+    if "poll" in message or "<t:" in message["content"]:
+        return None
+    reference = message["referenced_message"]
+    if reference and "<t:" in reference["content"]:
+        return None
+    return (
+        message["content"],
+        message["edited"],
+        message.get("spoiled"),
+        message["username"],
+        message["global_name"],
+        message["nick"],
+        tuple((embed["url"], embed["type"], embed.get("hidden")) for embed in message["embeds"]),
+        tuple((reaction["emoji"], reaction["count"], reaction["me"]) for reaction in message["reactions"]),
+        len(message["stickers"]),
+        mentioned,
+        role_color,
+        alt_role_color,
+        color_base[0],
+        blocked_reply,
+    )
+
+
 def generate_chat(messages, roles, channels, max_length, my_id, my_roles, member_roles, colors, colors_formatted, blocked, last_seen_msg, show_blocked, config):
     """
     Generate chat according to provided formatting.
@@ -656,8 +724,9 @@ def generate_chat(messages, roles, channels, max_length, my_id, my_roles, member
         1 - mask blocked messages
         2 - hide blocked messages
     limit_username normalizes length of usernames, by cropping them or appending spaces. Set to None to disable.
-    Returned indexes correspond to each message as how many lines it is covering.
+    Returned line_offsets are cumulative, for each message: number of chat lines up to and including that message.
     use_nick will make it use nick instead global_name whenever possible.
+    Formatted lines of each message are cached, so only new and changed messages are formatted again.
     """
 
     # load from config
@@ -685,7 +754,7 @@ def generate_chat(messages, roles, channels, max_length, my_id, my_roles, member
 
     chat = []
     chat_format = []
-    indexes = []
+    line_offsets = []
     chat_map = []   # ((num, username:(st, end), is_reply, reactions:((st, end), ...), date:(st, end), url:(st, end, index)), ...)
     len_edited = len(edited_string)
     enable_separator = format_date and date_separator
@@ -742,6 +811,7 @@ def generate_chat(messages, roles, channels, max_length, my_id, my_roles, member
     else:
         end_name = pre_name_len + limit_global_name + 1
     len_messages = len(messages)
+    check_chat_cache_context((max_length, my_id, tuple(my_roles), roles, channels, colors, colors_formatted, tuple(blocked), show_blocked, config))
 
     for num, message in enumerate(messages):
         temp_chat = []   # stores only one multiline message
@@ -778,11 +848,10 @@ def generate_chat(messages, roles, channels, max_length, my_id, my_roles, member
         # get member role color
         role_color = None
         alt_role_color = None
-        for member in member_roles:
-            if member["user_id"] == user_id:
-                role_color = member.get("primary_role_color")
-                alt_role_color = member.get("primary_role_alt_color")
-                break
+        member = member_roles.get(user_id)
+        if member:
+            role_color = member.get("primary_role_color")
+            alt_role_color = member.get("primary_role_alt_color")
 
         reply_color_format = color_base
 
@@ -797,7 +866,7 @@ def generate_chat(messages, roles, channels, max_length, my_id, my_roles, member
                 message["stickers"] = []
                 color_base = color_blocked
             else:
-                indexes.append(0)
+                line_offsets.append(len(chat))
                 temp_chat_map.append(None)
                 continue   # to not break message-to-chat conversion
 
@@ -830,429 +899,457 @@ def generate_chat(messages, roles, channels, max_length, my_id, my_roles, member
         except IndexError:
             pass
 
-        # replied message line
-        if message["referenced_message"]:
-            ref_message = message["referenced_message"].copy()
-            if ref_message["id"]:
-                if blocked_mode and ref_message["user_id"] in blocked and not show_blocked:
-                    ref_message["username"] = "blocked"
-                    ref_message["global_name"] = "blocked"
-                    ref_message["nick"] = "blocked"
-                    ref_message["content"] = "Blocked message"
-                    reply_color_format = color_blocked
-                if use_nick and ref_message["nick"]:
-                    global_name_nick = ref_message["nick"]
-                elif ref_message["global_name"]:
-                    global_name_nick = ref_message["global_name"]
+        # try to load this message lines from cache
+        reference = message["referenced_message"]
+        blocked_reply = bool(blocked_mode and reference and reference.get("user_id") in blocked and not show_blocked)
+        render_key = message_render_key(message, mentioned, role_color, alt_role_color, color_base, blocked_reply)
+        cached = chat_cache.get(message["id"])
+        if render_key and cached and cached[0] == render_key:
+            temp_chat.extend(cached[1])
+            temp_format.extend(cached[2])
+            for line_map in cached[3]:
+                if line_map and line_map[0] != num:
+                    temp_chat_map.append((num, *line_map[1:]))   # message index changed since caching
                 else:
-                    global_name_nick = ref_message["username"]
-                reply_embeds = ref_message["embeds"].copy()
-                content = ""
-                if ref_message["content"]:
-                    content, _ = replace_escaped_md(ref_message["content"])
-                    content = replace_spoilers_oneline(content)
-                    content = replace_discord_emoji(content)
-                    content = replace_mentions(content, ref_message["mentions"])
-                    content = replace_roles(content, roles)
-                    content = replace_discord_url(content)
-                    content = replace_channels(content, channels)
-                    content = replace_timestamps(content, convert_timezone)
-                    if emoji_as_text:
-                        content = emoji.demojize(content)
-                if reply_embeds:
-                    for embed in reply_embeds:
-                        embed_url = embed["url"]
-                        if embed_url and not embed.get("hidden") and embed_url not in content:
-                            if content:
-                                content += "\n"
-                            if "main_url" not in embed:   # its attachment
-                                if trim_embed_url_size:
-                                    embed_url = trim_string(embed_url, trim_embed_url_size)
-                                content += f"[{clean_type(embed["type"])} attachment]: {embed_url}"
-                            elif embed["type"] == "rich":
-                                content += f"[rich embed]: {embed_url}"
-                            else:
-                                if trim_embed_url_size:
-                                    embed_url = trim_string(embed_url, trim_embed_url_size)
-                                content += f"[{clean_type(embed["type"])} embed]: {embed_url}"
-                reply_line = lazy_replace(format_reply, "%username", lambda: normalize_string(ref_message["username"], limit_username, emoji_safe=True))
-                reply_line = lazy_replace(reply_line, "%global_name", lambda: normalize_string(str(global_name_nick), limit_global_name, emoji_safe=True))
-                reply_line = lazy_replace(reply_line, "%timestamp", lambda: generate_timestamp(ref_message["timestamp"], format_timestamp, convert_timezone))
-                reply_line = lazy_replace(reply_line, "%content", lambda: content.replace("\r", " ").replace("\n", " "))
-            else:
-                reply_line = lazy_replace(format_reply, "%username", lambda: normalize_string("Unknown", limit_username))
-                reply_line = lazy_replace(reply_line, "%global_name", lambda: normalize_string("Unknown", limit_global_name))
-                reply_line = reply_line.replace("%timestamp", "")
-                reply_line = lazy_replace(reply_line, "%content", lambda: ref_message["content"].replace("\r", "").replace("\n", ""))
-            reply_line = normalize_string(reply_line, max_length, emoji_safe=True, dots=True)
-            temp_chat.append(reply_line)
-            if disable_formatting or reply_color_format == color_blocked:
-                temp_format.append([reply_color_format])
-            elif mentioned:
-                temp_format.append(color_mention_reply)
-            else:
-                temp_format.append(color_reply)
-            temp_chat_map.append((num, None, True, None, None, None))
-
-        # bot interaction
-        elif message["interaction"]:
-            interaction_line = (
-                format_interaction
-                .replace("%username", message["interaction"]["username"][:limit_username])
-                .replace("%command", message["interaction"]["command"])
-            )
-            interaction_line = normalize_string(interaction_line, max_length, emoji_safe=True, dots=True)
-            temp_chat.append(interaction_line)
-            if disable_formatting or reply_color_format == color_blocked:
-                temp_format.append([reply_color_format])
-            elif mentioned:
-                temp_format.append(color_mention_reply)
-            else:
-                temp_format.append(color_reply)
-            temp_chat_map.append((num, None, False, None, None, None))
-
-        # main message
-        quote = False
-        if use_global_name:
-            if use_nick and message["nick"]:
-                global_name_nick = message["nick"]
-            elif message["global_name"]:
-                global_name_nick = message["global_name"]
-            else:
-                global_name_nick = message["username"]
+                    temp_chat_map.append(line_map)
         else:
-            global_name_nick = ""
-        content = ""
-        if "poll" in message:
-            message["content"] = format_poll(message["poll"])
-        if message["content"]:
-            content = replace_discord_emoji(message["content"])
-            content = replace_mentions(content, message["mentions"])
-            content = replace_roles(content, roles)
-            content = replace_discord_url(content)
-            content = replace_channels(content, channels)
-            content = replace_timestamps(content, convert_timezone)
-            if emoji_as_text:
-                content = emoji.demojize(content)
-            if content.startswith("> "):
-                content = quote_character + " " + content[2:]
-                quote = True
-        for embed in message["embeds"]:
-            embed_url = embed["url"]
-            if embed_url and not embed.get("hidden") and embed_url not in content:
-                if content:
-                    content += "\n"
-                if "main_url" not in embed:   # its attachment
-                    if trim_embed_url_size:
-                        embed_url = trim_string(embed_url, trim_embed_url_size)
-                    content += f"[{clean_type(embed["type"])} attachment]: {embed_url}"
-                elif embed["type"] == "rich":
-                    content += f"[rich embed]:\n{embed_url}"
+            cache_start = len(temp_chat)
+            # replied message line
+            if message["referenced_message"]:
+                ref_message = message["referenced_message"].copy()
+                if ref_message["id"]:
+                    if blocked_mode and ref_message["user_id"] in blocked and not show_blocked:
+                        ref_message["username"] = "blocked"
+                        ref_message["global_name"] = "blocked"
+                        ref_message["nick"] = "blocked"
+                        ref_message["content"] = "Blocked message"
+                        reply_color_format = color_blocked
+                    if use_nick and ref_message["nick"]:
+                        global_name_nick = ref_message["nick"]
+                    elif ref_message["global_name"]:
+                        global_name_nick = ref_message["global_name"]
+                    else:
+                        global_name_nick = ref_message["username"]
+                    reply_embeds = ref_message["embeds"].copy()
+                    content = ""
+                    if ref_message["content"]:
+                        content, _ = replace_escaped_md(ref_message["content"])
+                        content = replace_spoilers_oneline(content)
+                        content = replace_discord_emoji(content)
+                        content = replace_mentions(content, ref_message["mentions"])
+                        content = replace_roles(content, roles)
+                        content = replace_discord_url(content)
+                        content = replace_channels(content, channels)
+                        content = replace_timestamps(content, convert_timezone)
+                        if emoji_as_text:
+                            content = emoji.demojize(content)
+                    if reply_embeds:
+                        for embed in reply_embeds:
+                            embed_url = embed["url"]
+                            if embed_url and not embed.get("hidden") and embed_url not in content:
+                                if content:
+                                    content += "\n"
+                                if "main_url" not in embed:   # its attachment
+                                    if trim_embed_url_size:
+                                        embed_url = trim_string(embed_url, trim_embed_url_size)
+                                    content += f"[{clean_type(embed["type"])} attachment]: {embed_url}"
+                                elif embed["type"] == "rich":
+                                    content += f"[rich embed]: {embed_url}"
+                                else:
+                                    if trim_embed_url_size:
+                                        embed_url = trim_string(embed_url, trim_embed_url_size)
+                                    content += f"[{clean_type(embed["type"])} embed]: {embed_url}"
+                    reply_line = lazy_replace(format_reply, "%username", lambda: normalize_string(ref_message["username"], limit_username, emoji_safe=True))
+                    reply_line = lazy_replace(reply_line, "%global_name", lambda: normalize_string(str(global_name_nick), limit_global_name, emoji_safe=True))
+                    reply_line = lazy_replace(reply_line, "%timestamp", lambda: generate_timestamp(ref_message["timestamp"], format_timestamp, convert_timezone))
+                    reply_line = lazy_replace(reply_line, "%content", lambda: content.replace("\r", " ").replace("\n", " "))
                 else:
-                    if trim_embed_url_size:
-                        embed_url = trim_string(embed_url, trim_embed_url_size)
-                    content += f"[{clean_type(embed["type"])} embed]: {embed_url}"
-        for sticker in message["stickers"]:
-            sticker_type = sticker["format_type"]
-            if content:
-                content += "\n"
-            if sticker_type == 1:
-                content += f"[png sticker] (can be opened): {sticker["name"]}"
-            elif sticker_type == 2:
-                content += f"[apng sticker] (can be opened): {sticker["name"]}"
-            elif sticker_type == 3:
-                content += f"[lottie sticker] (cannot be opened): {sticker["name"]}"
-            else:
-                content += f"[gif sticker] (can be opened): {sticker["name"]}"
-
-        message_line = lazy_replace(format_message, "%username", lambda: normalize_string(message["username"], limit_username, emoji_safe=True))
-        message_line = lazy_replace(message_line, "%global_name", lambda: normalize_string(global_name_nick, limit_global_name))
-        message_line = lazy_replace(message_line, "%timestamp", lambda: generate_timestamp(message["timestamp"], format_timestamp, convert_timezone))
-        message_line = message_line.replace("%edited", edited_string if edited else "")
-        message_line = message_line.replace("%content", content)
-
-        # find all code snippets and blocks
-        code_snippets = []
-        code_blocks = []
-        for match in re.finditer(match_md_code_snippet, message_line):
-            code_snippets.append([match.start(), match.end()])
-        for match in re.finditer(match_md_code_block, message_line):
-            code_blocks.append([match.start(), match.end()])
-        except_ranges = code_snippets + code_blocks
-
-        # find all urls
-        urls = []
-        if color_chat_url:
-            for match in re.finditer(match_url, message_line):
-                start = match.start()
-                end = match.end()
-                skip = False
-                for except_range in except_ranges:
-                    start_r = except_range[0]
-                    end_r = except_range[1]
-                    if start > start_r and start < end_r and end > start_r and end <= end_r:
-                        skip = True
-                        break
-                if not skip:
-                    urls.append([start, end])
-
-        # find all spoilers
-        spoilers = []
-        for match in re.finditer(match_md_spoiler, message_line):
-            spoilers.append([match.start(), match.end()])
-        spoilers = spoilers[message.get("spoiled"):]   # exclude spoiled messages
-
-        # find all markdown and correct format indexes
-        message_line, md_format, md_indexes = format_md_all(message_line, pre_content_len, except_ranges + urls)
-        if md_indexes:
-            code_snippets = move_by_indexes(code_snippets, md_indexes)
-            code_blocks = move_by_indexes(code_blocks, md_indexes)
-            urls = move_by_indexes(urls, md_indexes)
-            spoilers = move_by_indexes(spoilers, md_indexes)
-        message_line, escaped_indexes = replace_escaped_md(message_line, except_ranges + urls)
-        if escaped_indexes:
-            code_snippets = move_by_indexes(code_snippets, escaped_indexes)
-            code_blocks = move_by_indexes(code_blocks, escaped_indexes)
-            urls = move_by_indexes(urls, escaped_indexes)
-            spoilers = move_by_indexes(spoilers, escaped_indexes)
-            md_format = move_by_indexes(md_format, escaped_indexes, start=1)
-
-        # limit message_line and split to multiline
-        newline_sign = False
-        newline_index = max_length
-        quote_nl = True
-        if len(message_line) > max_length:
-            newline_index = len(message_line[:max_length].rsplit(" ", 1)[0])   #  splits line on space
-            # if there is \n on current line, use its position to split line
-            if "\n" in message_line[:max_length]:
-                newline_index = message_line.index("\n")
-                quote = False
-                newline_sign = True
-                split_on_space = 0
-            else:
-                newline_text = lazy_replace(format_newline, "%timestamp", lambda: generate_timestamp(message["timestamp"], format_timestamp, convert_timezone))
-                newline_text = newline_text.replace("%content", "")
-                if newline_index <= len(newline_text):
-                    newline_index = max_length
-                    quote_nl = False
+                    reply_line = lazy_replace(format_reply, "%username", lambda: normalize_string("Unknown", limit_username))
+                    reply_line = lazy_replace(reply_line, "%global_name", lambda: normalize_string("Unknown", limit_global_name))
+                    reply_line = reply_line.replace("%timestamp", "")
+                    reply_line = lazy_replace(reply_line, "%content", lambda: ref_message["content"].replace("\r", "").replace("\n", ""))
+                reply_line = normalize_string(reply_line, max_length, emoji_safe=True, dots=True)
+                temp_chat.append(reply_line)
+                if disable_formatting or reply_color_format == color_blocked:
+                    temp_format.append([reply_color_format])
+                elif mentioned:
+                    temp_format.append(color_mention_reply)
                 else:
-                    quote_nl = False
-            if message_line[newline_index] in (" ", "\n"):   # remove space and \n
-                next_line = message_line[newline_index+1:]
-                split_on_space = 1
-            else:
-                next_line = message_line[newline_index:]
-                split_on_space = 0
-            message_line = message_line[:newline_index]
-        elif "\n" in message_line:
-            newline_index = message_line.index("\n")
-            next_line = message_line[newline_index+1:]
-            message_line = message_line[:newline_index]
+                    temp_format.append(color_reply)
+                temp_chat_map.append((num, None, True, None, None, None))
+
+            # bot interaction
+            elif message["interaction"]:
+                interaction_line = (
+                    format_interaction
+                    .replace("%username", message["interaction"]["username"][:limit_username])
+                    .replace("%command", message["interaction"]["command"])
+                )
+                interaction_line = normalize_string(interaction_line, max_length, emoji_safe=True, dots=True)
+                temp_chat.append(interaction_line)
+                if disable_formatting or reply_color_format == color_blocked:
+                    temp_format.append([reply_color_format])
+                elif mentioned:
+                    temp_format.append(color_mention_reply)
+                else:
+                    temp_format.append(color_reply)
+                temp_chat_map.append((num, None, False, None, None, None))
+
+            # main message
             quote = False
-            newline_sign = True
-            split_on_space = 1
-        else:
-            next_line = None
-
-        if newline_sign and next_line and next_line.startswith("> "):
-            next_line = next_line[2:]
-            quote = True
-
-        # replace spoilers
-        format_spoilers = format_multiline_one_line(spoilers, newline_index+1, 0, selected_color_spoiler, quote)
-        for spoiler_range in format_spoilers:
-            start = spoiler_range[1]
-            end = spoiler_range[2]
-            message_line = message_line[:start] + "▒" * (end - start) + message_line[end:]
-
-        # code blocks formatting here to add spaces to end of string
-        code_block_format = format_multiline_one_line_end(code_blocks, newline_index+1, 0, color_code, max_length-1, quote)
-        if code_block_format:
-            message_line = message_line.ljust(max_length-1)
-
-        temp_chat.append(message_line)
-        urls_this_line = urls_multiline_one_line(urls, newline_index+1, 0, quote)
-        temp_chat_map.append((num, (pre_name_len, end_name), False, None, timestamp_range, urls_this_line))
-
-        # formatting
-        if disable_formatting:
-            temp_format.append([color_base])
-        elif mentioned:
-            format_line = color_mention_message[:]
-            format_line += format_multiline_one_line_format(md_format, newline_index+1, 0, quote)
-            format_line += format_multiline_one_line(urls, newline_index+1, 0, color_mention_chat_url, quote)
-            format_line += format_multiline_one_line(code_snippets, newline_index+1, 0, color_code, quote)
-            format_line += code_block_format
-            format_line += format_spoilers
-            if alt_role_color:
-                format_line.append([alt_role_color, pre_name_len, end_name])
-            if edited and not next_line:
-                format_line.append(color_mention_chat_edited + [len(message_line) - len_edited, len(message_line)])
-            temp_format.append(format_line)
-        else:
-            format_line = color_message[:]
-            format_line += format_multiline_one_line_format(md_format, newline_index+1, 0, quote)
-            format_line += format_multiline_one_line(urls, newline_index+1, 0, color_chat_url, quote)
-            format_line += format_multiline_one_line(code_snippets, newline_index+1, 0, color_code, quote)
-            format_line += code_block_format
-            format_line += format_spoilers
-            if role_color:
-                format_line.append([role_color, pre_name_len, end_name])
-            if edited and not next_line:
-                format_line.append([*color_chat_edited, len(message_line) - len_edited, len(message_line)])
-            temp_format.append(format_line)
-
-        # newline
-        line_num = 1
-        quote_nl = quote_nl and quote
-        while next_line:
-            this_quote = False
-            if quote:
-                full_content = quote_character + " " + next_line
-                extra_newline_len = 2
-                this_quote = True
+            if use_global_name:
+                if use_nick and message["nick"]:
+                    global_name_nick = message["nick"]
+                elif message["global_name"]:
+                    global_name_nick = message["global_name"]
+                else:
+                    global_name_nick = message["username"]
             else:
-                full_content = next_line
-                extra_newline_len = 0
-            new_line = lazy_replace(format_newline, "%timestamp", lambda: generate_timestamp(message["timestamp"], format_timestamp, convert_timezone))
-            new_line = new_line.replace("%content", full_content)
-
-            # correct index for each new line
-            content_index_correction = newline_len + extra_newline_len - 1 + (not split_on_space) - newline_index - quote_nl*2
-            for url in urls:
-                url[0] += content_index_correction
-                url[1] += content_index_correction
-            for spoiler in spoilers:
-                spoiler[0] += content_index_correction
-                spoiler[1] += content_index_correction
-            for code_snippet in code_snippets:
-                code_snippet[0] += content_index_correction
-                code_snippet[1] += content_index_correction
-            for code_block in code_blocks:
-                code_block[0] += content_index_correction
-                code_block[1] += content_index_correction
-            for md in md_format:
-                md[1] += content_index_correction
-                md[2] += content_index_correction
-            quote_nl = False
-
-            # limit new_line and split to next line
+                global_name_nick = ""
+            content = ""
+            if "poll" in message:
+                message["content"] = format_poll(message["poll"])
+            if message["content"]:
+                content = replace_discord_emoji(message["content"])
+                content = replace_mentions(content, message["mentions"])
+                content = replace_roles(content, roles)
+                content = replace_discord_url(content)
+                content = replace_channels(content, channels)
+                content = replace_timestamps(content, convert_timezone)
+                if emoji_as_text:
+                    content = emoji.demojize(content)
+                if content.startswith("> "):
+                    content = quote_character + " " + content[2:]
+                    quote = True
+            for embed in message["embeds"]:
+                embed_url = embed["url"]
+                if embed_url and not embed.get("hidden") and embed_url not in content:
+                    if content:
+                        content += "\n"
+                    if "main_url" not in embed:   # its attachment
+                        if trim_embed_url_size:
+                            embed_url = trim_string(embed_url, trim_embed_url_size)
+                        content += f"[{clean_type(embed["type"])} attachment]: {embed_url}"
+                    elif embed["type"] == "rich":
+                        content += f"[rich embed]:\n{embed_url}"
+                    else:
+                        if trim_embed_url_size:
+                            embed_url = trim_string(embed_url, trim_embed_url_size)
+                        content += f"[{clean_type(embed["type"])} embed]: {embed_url}"
+            for sticker in message["stickers"]:
+                sticker_type = sticker["format_type"]
+                if content:
+                    content += "\n"
+                if sticker_type == 1:
+                    content += f"[png sticker] (can be opened): {sticker["name"]}"
+                elif sticker_type == 2:
+                    content += f"[apng sticker] (can be opened): {sticker["name"]}"
+                elif sticker_type == 3:
+                    content += f"[lottie sticker] (cannot be opened): {sticker["name"]}"
+                else:
+                    content += f"[gif sticker] (can be opened): {sticker["name"]}"
+
+            message_line = lazy_replace(format_message, "%username", lambda: normalize_string(message["username"], limit_username, emoji_safe=True))
+            message_line = lazy_replace(message_line, "%global_name", lambda: normalize_string(global_name_nick, limit_global_name))
+            message_line = lazy_replace(message_line, "%timestamp", lambda: generate_timestamp(message["timestamp"], format_timestamp, convert_timezone))
+            message_line = message_line.replace("%edited", edited_string if edited else "")
+            message_line = message_line.replace("%content", content)
+
+            # find all code snippets and blocks
+            code_snippets = []
+            code_blocks = []
+            for match in re.finditer(match_md_code_snippet, message_line):
+                code_snippets.append([match.start(), match.end()])
+            for match in re.finditer(match_md_code_block, message_line):
+                code_blocks.append([match.start(), match.end()])
+            except_ranges = code_snippets + code_blocks
+
+            # find all urls
+            urls = []
+            if color_chat_url:
+                for match in re.finditer(match_url, message_line):
+                    start = match.start()
+                    end = match.end()
+                    skip = False
+                    for except_range in except_ranges:
+                        start_r = except_range[0]
+                        end_r = except_range[1]
+                        if start > start_r and start < end_r and end > start_r and end <= end_r:
+                            skip = True
+                            break
+                    if not skip:
+                        urls.append([start, end])
+
+            # find all spoilers
+            spoilers = []
+            for match in re.finditer(match_md_spoiler, message_line):
+                spoilers.append([match.start(), match.end()])
+            spoilers = spoilers[message.get("spoiled"):]   # exclude spoiled messages
+
+            # find all markdown and correct format indexes
+            message_line, md_format, md_indexes = format_md_all(message_line, pre_content_len, except_ranges + urls)
+            if md_indexes:
+                code_snippets = move_by_indexes(code_snippets, md_indexes)
+                code_blocks = move_by_indexes(code_blocks, md_indexes)
+                urls = move_by_indexes(urls, md_indexes)
+                spoilers = move_by_indexes(spoilers, md_indexes)
+            message_line, escaped_indexes = replace_escaped_md(message_line, except_ranges + urls)
+            if escaped_indexes:
+                code_snippets = move_by_indexes(code_snippets, escaped_indexes)
+                code_blocks = move_by_indexes(code_blocks, escaped_indexes)
+                urls = move_by_indexes(urls, escaped_indexes)
+                spoilers = move_by_indexes(spoilers, escaped_indexes)
+                md_format = move_by_indexes(md_format, escaped_indexes, start=1)
+
+            # limit message_line and split to multiline
             newline_sign = False
-            if len(new_line) > max_length - bool(code_block_format):
-                newline_index = len(new_line[:max_length - bool(code_block_format)].rsplit(" ", 1)[0])
-                if "\n" in new_line[:max_length]:
-                    newline_index = new_line.index("\n")
+            newline_index = max_length
+            quote_nl = True
+            if len(message_line) > max_length:
+                newline_index = len(message_line[:max_length].rsplit(" ", 1)[0])   #  splits line on space
+                # if there is \n on current line, use its position to split line
+                if "\n" in message_line[:max_length]:
+                    newline_index = message_line.index("\n")
                     quote = False
                     newline_sign = True
                     split_on_space = 0
-                elif newline_index <= newline_len + 2*quote:
-                    newline_index = max_length - bool(code_block_format)
-                try:
-                    if new_line[newline_index] in (" ", "\n"):   # remove space and \n
-                        next_line = new_line[newline_index+1:]
-                        split_on_space = 1
+                else:
+                    newline_text = lazy_replace(format_newline, "%timestamp", lambda: generate_timestamp(message["timestamp"], format_timestamp, convert_timezone))
+                    newline_text = newline_text.replace("%content", "")
+                    if newline_index <= len(newline_text):
+                        newline_index = max_length
+                        quote_nl = False
                     else:
-                        next_line = new_line[newline_index:]
-                        split_on_space = 0
-                except IndexError:
-                    next_line = new_line[newline_index+1:]
+                        quote_nl = False
+                if message_line[newline_index] in (" ", "\n"):   # remove space and \n
+                    next_line = message_line[newline_index+1:]
                     split_on_space = 1
-                new_line = new_line[:newline_index]
-            elif "\n" in new_line:
-                newline_index = new_line.index("\n")
-                next_line = new_line[newline_index+1:]
-                new_line = new_line[:newline_index]
+                else:
+                    next_line = message_line[newline_index:]
+                    split_on_space = 0
+                message_line = message_line[:newline_index]
+            elif "\n" in message_line:
+                newline_index = message_line.index("\n")
+                next_line = message_line[newline_index+1:]
+                message_line = message_line[:newline_index]
                 quote = False
                 newline_sign = True
                 split_on_space = 1
             else:
                 next_line = None
 
-            if newline_sign and next_line.startswith("> "):
+            if newline_sign and next_line and next_line.startswith("> "):
                 next_line = next_line[2:]
-                quote_nl = True
                 quote = True
 
             # replace spoilers
-            format_spoilers = format_multiline_one_line(spoilers, len(new_line), newline_len, selected_color_spoiler, this_quote)
+            format_spoilers = format_multiline_one_line(spoilers, newline_index+1, 0, selected_color_spoiler, quote)
             for spoiler_range in format_spoilers:
                 start = spoiler_range[1]
                 end = spoiler_range[2]
-                new_line = new_line[:start] + "▒" * (end - start) + new_line[end:]
+                message_line = message_line[:start] + "▒" * (end - start) + message_line[end:]
 
             # code blocks formatting here to add spaces to end of string
-            code_block_format = format_multiline_one_line_end(code_blocks, len(new_line), newline_len, color_code, max_length-1, this_quote)
+            code_block_format = format_multiline_one_line_end(code_blocks, newline_index+1, 0, color_code, max_length-1, quote)
             if code_block_format:
-                new_line = new_line.ljust(max_length-1)
+                message_line = message_line.ljust(max_length-1)
 
-            temp_chat.append(new_line)
-            urls_this_line = urls_multiline_one_line(urls, len(new_line), newline_len, quote)
-            temp_chat_map.append((num, None, None, None, None, urls_this_line))
+            temp_chat.append(message_line)
+            urls_this_line = urls_multiline_one_line(urls, newline_index+1, 0, quote)
+            temp_chat_map.append((num, (pre_name_len, end_name), False, None, timestamp_range, urls_this_line))
 
             # formatting
             if disable_formatting:
                 temp_format.append([color_base])
             elif mentioned:
-                format_line = color_mention_newline[:]
-                format_line += format_multiline_one_line_format(md_format, len(new_line), newline_len, this_quote)
-                format_line += format_multiline_one_line(urls, len(new_line), newline_len, color_mention_chat_url, this_quote)
-                format_line += format_multiline_one_line(code_snippets, len(new_line), newline_len, color_code, this_quote)
+                format_line = color_mention_message[:]
+                format_line += format_multiline_one_line_format(md_format, newline_index+1, 0, quote)
+                format_line += format_multiline_one_line(urls, newline_index+1, 0, color_mention_chat_url, quote)
+                format_line += format_multiline_one_line(code_snippets, newline_index+1, 0, color_code, quote)
                 format_line += code_block_format
                 format_line += format_spoilers
+                if alt_role_color:
+                    format_line.append([alt_role_color, pre_name_len, end_name])
                 if edited and not next_line:
-                    format_line.append(color_mention_chat_edited + [len(new_line) - len_edited, len(new_line)])
+                    format_line.append(color_mention_chat_edited + [len(message_line) - len_edited, len(message_line)])
                 temp_format.append(format_line)
             else:
-                format_line = color_newline[:]
-                format_line += format_multiline_one_line_format(md_format, len(new_line), newline_len, this_quote)
-                format_line += format_multiline_one_line(urls, len(new_line), newline_len, color_chat_url, this_quote)
-                format_line += format_multiline_one_line(code_snippets, len(new_line), newline_len, color_code, this_quote)
+                format_line = color_message[:]
+                format_line += format_multiline_one_line_format(md_format, newline_index+1, 0, quote)
+                format_line += format_multiline_one_line(urls, newline_index+1, 0, color_chat_url, quote)
+                format_line += format_multiline_one_line(code_snippets, newline_index+1, 0, color_code, quote)
                 format_line += code_block_format
                 format_line += format_spoilers
+                if role_color:
+                    format_line.append([role_color, pre_name_len, end_name])
                 if edited and not next_line:
-                    format_line.append([*color_chat_edited, len(new_line) - len_edited, len(new_line)])
+                    format_line.append([*color_chat_edited, len(message_line) - len_edited, len(message_line)])
                 temp_format.append(format_line)
-            line_num += 1
 
-        # reactions
-        if message["reactions"]:
-            reactions = []
-            for reaction in message["reactions"]:
-                emoji_str = reaction["emoji"]
-                if emoji_as_text:
-                    emoji_str = emoji_name(emoji_str)
-                my_reaction = ""
-                if reaction["me"]:
-                    my_reaction = "*"
-                reactions.append(
-                    format_one_reaction
-                    .replace("%reaction", emoji_str)
-                    .replace("%count", f"{my_reaction}{reaction["count"]}"),
+            # newline
+            line_num = 1
+            quote_nl = quote_nl and quote
+            while next_line:
+                this_quote = False
+                if quote:
+                    full_content = quote_character + " " + next_line
+                    extra_newline_len = 2
+                    this_quote = True
+                else:
+                    full_content = next_line
+                    extra_newline_len = 0
+                new_line = lazy_replace(format_newline, "%timestamp", lambda: generate_timestamp(message["timestamp"], format_timestamp, convert_timezone))
+                new_line = new_line.replace("%content", full_content)
+
+                # correct index for each new line
+                content_index_correction = newline_len + extra_newline_len - 1 + (not split_on_space) - newline_index - quote_nl*2
+                for url in urls:
+                    url[0] += content_index_correction
+                    url[1] += content_index_correction
+                for spoiler in spoilers:
+                    spoiler[0] += content_index_correction
+                    spoiler[1] += content_index_correction
+                for code_snippet in code_snippets:
+                    code_snippet[0] += content_index_correction
+                    code_snippet[1] += content_index_correction
+                for code_block in code_blocks:
+                    code_block[0] += content_index_correction
+                    code_block[1] += content_index_correction
+                for md in md_format:
+                    md[1] += content_index_correction
+                    md[2] += content_index_correction
+                quote_nl = False
+
+                # limit new_line and split to next line
+                newline_sign = False
+                if len(new_line) > max_length - bool(code_block_format):
+                    newline_index = len(new_line[:max_length - bool(code_block_format)].rsplit(" ", 1)[0])
+                    if "\n" in new_line[:max_length]:
+                        newline_index = new_line.index("\n")
+                        quote = False
+                        newline_sign = True
+                        split_on_space = 0
+                    elif newline_index <= newline_len + 2*quote:
+                        newline_index = max_length - bool(code_block_format)
+                    try:
+                        if new_line[newline_index] in (" ", "\n"):   # remove space and \n
+                            next_line = new_line[newline_index+1:]
+                            split_on_space = 1
+                        else:
+                            next_line = new_line[newline_index:]
+                            split_on_space = 0
+                    except IndexError:
+                        next_line = new_line[newline_index+1:]
+                        split_on_space = 1
+                    new_line = new_line[:newline_index]
+                elif "\n" in new_line:
+                    newline_index = new_line.index("\n")
+                    next_line = new_line[newline_index+1:]
+                    new_line = new_line[:newline_index]
+                    quote = False
+                    newline_sign = True
+                    split_on_space = 1
+                else:
+                    next_line = None
+
+                if newline_sign and next_line.startswith("> "):
+                    next_line = next_line[2:]
+                    quote_nl = True
+                    quote = True
+
+                # replace spoilers
+                format_spoilers = format_multiline_one_line(spoilers, len(new_line), newline_len, selected_color_spoiler, this_quote)
+                for spoiler_range in format_spoilers:
+                    start = spoiler_range[1]
+                    end = spoiler_range[2]
+                    new_line = new_line[:start] + "▒" * (end - start) + new_line[end:]
+
+                # code blocks formatting here to add spaces to end of string
+                code_block_format = format_multiline_one_line_end(code_blocks, len(new_line), newline_len, color_code, max_length-1, this_quote)
+                if code_block_format:
+                    new_line = new_line.ljust(max_length-1)
+
+                temp_chat.append(new_line)
+                urls_this_line = urls_multiline_one_line(urls, len(new_line), newline_len, quote)
+                temp_chat_map.append((num, None, None, None, None, urls_this_line))
+
+                # formatting
+                if disable_formatting:
+                    temp_format.append([color_base])
+                elif mentioned:
+                    format_line = color_mention_newline[:]
+                    format_line += format_multiline_one_line_format(md_format, len(new_line), newline_len, this_quote)
+                    format_line += format_multiline_one_line(urls, len(new_line), newline_len, color_mention_chat_url, this_quote)
+                    format_line += format_multiline_one_line(code_snippets, len(new_line), newline_len, color_code, this_quote)
+                    format_line += code_block_format
+                    format_line += format_spoilers
+                    if edited and not next_line:
+                        format_line.append(color_mention_chat_edited + [len(new_line) - len_edited, len(new_line)])
+                    temp_format.append(format_line)
+                else:
+                    format_line = color_newline[:]
+                    format_line += format_multiline_one_line_format(md_format, len(new_line), newline_len, this_quote)
+                    format_line += format_multiline_one_line(urls, len(new_line), newline_len, color_chat_url, this_quote)
+                    format_line += format_multiline_one_line(code_snippets, len(new_line), newline_len, color_code, this_quote)
+                    format_line += code_block_format
+                    format_line += format_spoilers
+                    if edited and not next_line:
+                        format_line.append([*color_chat_edited, len(new_line) - len_edited, len(new_line)])
+                    temp_format.append(format_line)
+                line_num += 1
+
+            # reactions
+            if message["reactions"]:
+                reactions = []
+                for reaction in message["reactions"]:
+                    emoji_str = reaction["emoji"]
+                    if emoji_as_text:
+                        emoji_str = emoji_name(emoji_str)
+                    my_reaction = ""
+                    if reaction["me"]:
+                        my_reaction = "*"
+                    reactions.append(
+                        format_one_reaction
+                        .replace("%reaction", emoji_str)
+                        .replace("%count", f"{my_reaction}{reaction["count"]}"),
+                    )
+                reactions_line = lazy_replace(format_reactions, "%timestamp", lambda: generate_timestamp(message["timestamp"], format_timestamp, convert_timezone))
+                reactions_line = reactions_line.replace("%reactions", reactions_separator.join(reactions))
+                reactions_line = normalize_string(reactions_line, max_length-1, emoji_safe=True, dots=True, fill=False)
+                temp_chat.append(reactions_line)
+                if disable_formatting:
+                    temp_format.append([color_base])
+                elif mentioned:
+                    temp_format.append(color_mention_reactions)
+                else:
+                    temp_format.append(color_reactions)
+                reactions_map = []
+                offset = 0
+                for reaction in reactions:
+                    reactions_map.append([pre_reaction_len + offset, pre_reaction_len + len(reaction) + offset])
+                    offset += len(reactions_separator) + len(reaction)
+                temp_chat_map.append((num, None, False, reactions_map, None, None))
+            if render_key:
+                chat_cache[message["id"]] = (
+                    render_key,
+                    temp_chat[cache_start:],
+                    temp_format[cache_start:],
+                    temp_chat_map[cache_start:],
                 )
-            reactions_line = lazy_replace(format_reactions, "%timestamp", lambda: generate_timestamp(message["timestamp"], format_timestamp, convert_timezone))
-            reactions_line = reactions_line.replace("%reactions", reactions_separator.join(reactions))
-            reactions_line = normalize_string(reactions_line, max_length-1, emoji_safe=True, dots=True, fill=False)
-            temp_chat.append(reactions_line)
-            if disable_formatting:
-                temp_format.append([color_base])
-            elif mentioned:
-                temp_format.append(color_mention_reactions)
-            else:
-                temp_format.append(color_reactions)
-            reactions_map = []
-            offset = 0
-            for reaction in reactions:
-                reactions_map.append([pre_reaction_len + offset, pre_reaction_len + len(reaction) + offset])
-                offset += len(reactions_separator) + len(reaction)
-            temp_chat_map.append((num, None, False, reactions_map, None, None))
-        indexes.append(len(temp_chat))
-
         # invert message lines order and append them to chat
         # it is inverted because chat is drawn from down to upside
         chat.extend(temp_chat[::-1])
         chat_format.extend(temp_format[::-1])
         chat_map.extend(temp_chat_map[::-1])
-    return chat, chat_format, indexes, chat_map
+        line_offsets.append(len(chat))
+
+    # keep only messages from this chat if cache is too large
+    if len(chat_cache) > CHAT_CACHE_LIMIT:
+        message_ids = {message["id"] for message in messages}
+        for message_id in [x for x in chat_cache if x not in message_ids]:
+            del chat_cache[message_id]
+
+    return chat, chat_format, line_offsets, chat_map
 
 
 def generate_status_line(my_user_data, my_status, unseen, typing, active_channel, action, tasks, tabs, tabs_format, format_status_line, format_rich, slowmode=None, limit_typing=30, use_nick=True, fun=True):
@@ -1542,16 +1639,16 @@ def generate_log(log, colors, max_w):
     """Generate log lines shown in chat area"""
     chat = []
     chat_format = []
-    indexes = []
+    line_offsets = []
     chat_map = []
     for message in log:
         temp_chat = split_long_line(message, max_w, 4)
         chat.extend(temp_chat)
         chat_format.extend([[[colors[0]]]] * len(temp_chat))
-        indexes.append(len(temp_chat))
+        line_offsets.append(len(chat))
         chat_map.extend([None] * len(temp_chat))
     chat = chat[::-1]
-    return chat, chat_format, indexes, chat_map
+    return chat, chat_format, line_offsets, chat_map
 
 
 def generate_extra_line(attachments, selected, max_len):
@@ -2025,16 +2122,19 @@ def generate_forum(threads, blocked, max_length, colors, colors_formatted, confi
     return forum, forum_format
 
 
-def generate_member_list(member_list_raw, guild_roles, width, use_nick, status_sign):
-    """Generate member list"""
+def generate_member_list(member_list_raw, guild_roles, width, use_nick, status_sign, start=0, end=None):
+    """Generate member list, only members between start and end are formatted, members that are not loaded are empty lines"""
     # colors: 18 - green, 19 - orange, 20 - red
     member_list = []
     member_list_format = []
     if not member_list_raw:
         return [normalize_string("No online members", width-1)], [[]]
-    for member in member_list_raw:
+    roles_index = {role["id"]: num for num, role in enumerate(guild_roles)}
+    for member in member_list_raw[start:end]:
         this_format = []
-        if "id" in member:
+        if not member:   # not yet loaded
+            text = ""
+        elif "id" in member:
 
             # format text
             if use_nick and member["nick"]:
@@ -2057,12 +2157,11 @@ def generate_member_list(member_list_raw, guild_roles, width, use_nick, status_s
                 this_format.append([18, 0, 2])
 
             # get role color
-            member_roles = member["roles"]
-            for role in guild_roles:
-                if role["id"] in member_roles:
-                    if role.get("color_id"):
-                        this_format.append([role["color_id"], 2, width])
-                    break
+            role_indexes = [roles_index[role_id] for role_id in member["roles"] if role_id in roles_index]
+            if role_indexes:
+                role = guild_roles[min(role_indexes)]
+                if role.get("color_id"):
+                    this_format.append([role["color_id"], 2, width])
 
         else:   # user group
             text = "Unknown group"
@@ -2071,9 +2170,8 @@ def generate_member_list(member_list_raw, guild_roles, width, use_nick, status_s
             elif member["group"] == "offline":
                 text = "Offline"
             group_id = member["group"]
-            for role in guild_roles:
-                if role["id"] == group_id:
-                    text = role["name"]
+            if group_id in roles_index:
+                text = guild_roles[roles_index[group_id]]["name"]
             this_format = []
         member_list.append(normalize_string(text, width-1, emoji_safe=True))
         member_list_format.append(this_format)
@@ -2129,6 +2227,7 @@ def generate_tree(dms, guilds, threads, unseen, mentioned, guild_folders, activi
         "muted": False,
         "parent_index": None,
     })
+    statuses = {activity["id"]: activity["status"] for activity in activities}
     for dm in dms:
         name = dm["name"]
         unseen_dm = False
@@ -2144,19 +2243,10 @@ def generate_tree(dms, guilds, threads, unseen, mentioned, guild_folders, activi
         code = 300
         # get dm status
         if len(dm["recipients"]) == 1:
-            for activity in activities:
-                if activity["id"] == dm["recipients"][0]["id"]:
-                    status = activity["status"]
-                    if status == "online":
-                        code += 2
-                    elif status == "idle":
-                        code += 3
-                    elif status == "dnd":
-                        code += 4
-                    else:
-                        break
-                    name = dm_status_char + name
-                    break
+            status = statuses.get(dm["recipients"][0]["id"])
+            if status in ("online", "idle", "dnd"):
+                code += DM_STATUS_CODES[status]
+                name = dm_status_char + name
         tree.append(f"{intersection} {name}")
         if muted:
             code += 10
@@ -2186,7 +2276,8 @@ def generate_tree(dms, guilds, threads, unseen, mentioned, guild_folders, activi
 
     # sort guilds and folders
     guilds_sorted = []
-    guilds_used_index = []
+    guilds_used_index = set()
+    guilds_index = {guild["guild_id"]: num for num, guild in enumerate(guilds)}
     for num_f, folder in enumerate(guild_folders):
         if show_folders and folder["id"] and folder["id"] != "MISSING":
             for folder_name in folder_names:
@@ -2201,11 +2292,10 @@ def generate_tree(dms, guilds, threads, unseen, mentioned, guild_folders, activi
                 "name": name,
             })
         for guild_id in folder["guilds"]:
-            for num, guild in enumerate(guilds):
-                if guild["guild_id"] == guild_id:
-                    guilds_sorted.append(guilds[num])
-                    guilds_used_index.append(num)
-                    break
+            num = guilds_index.get(guild_id)
+            if num is not None:
+                guilds_sorted.append(guilds[num])
+                guilds_used_index.add(num)
         if show_folders and folder["id"] and folder["id"] != "MISSING":
             guilds_sorted.append({
                 "folder": True,
@@ -2218,13 +2308,16 @@ def generate_tree(dms, guilds, threads, unseen, mentioned, guild_folders, activi
             guilds_sorted.append(guild)
 
     # generator loop
+    threads_by_guild = {guild_th["guild_id"]: guild_th["channels"] for guild_th in reversed(threads)}
     have_uncollapsed_folder = False
     in_folder = None
+    folder_index = None
     for guild in guilds_sorted:
         # handle folders
         if "folder" in guild:
             if "name" in guild:
                 in_folder = guild["id"]
+                folder_index = len(tree_format)
                 tree.append(f"{dd_folder} {guild["name"]}")
                 if not have_uncollapsed_folder and guild["id"] not in collapsed:
                     code = 1
@@ -2250,16 +2343,13 @@ def generate_tree(dms, guilds, threads, unseen, mentioned, guild_folders, activi
         muted_guild = guild.get("muted", False)
         unseen_guild = False
         ping_guild = False
-        for guild_th in threads:
-            if guild_th["guild_id"] == guild["guild_id"]:
-                threads_guild = guild_th["channels"]
-                break
-        else:
-            threads_guild = []
+        threads_guild = threads_by_guild.get(guild["guild_id"], [])
+        threads_channel = {channel_th["channel_id"]: channel_th["threads"] for channel_th in reversed(threads_guild)}
 
         # sort categories and channels
         categories = []
         categories_position = []
+        categories_by_id = {}
         for channel in guild["channels"]:
             if channel["type"] == 4:
                 # categories are also hidden if they have no visible channels
@@ -2281,6 +2371,7 @@ def generate_tree(dms, guilds, threads, unseen, mentioned, guild_folders, activi
                     "unseen": False,
                     "ping": False,
                 })
+                categories_by_id.setdefault(channel["id"], categories[-1])
                 categories_position.append(channel["position"])
 
         # separately sort channels in their categories
@@ -2289,48 +2380,42 @@ def generate_tree(dms, guilds, threads, unseen, mentioned, guild_folders, activi
         for channel in guild["channels"]:
             if channel["type"] in (0, 5, 15):
                 # find this channel threads, if any
-                for channel_th in threads_guild:
-                    if channel_th["channel_id"] == channel["id"]:
-                        threads_ch = channel_th["threads"]
-                        break
-                else:
-                    threads_ch = []
+                threads_ch = threads_channel.get(channel["id"], [])
                 unseen_ch = False
                 mentioned_ch = False
                 if channel["id"] in unseen:
                     unseen_ch = True
                 if channel["id"] in mentioned:
                     mentioned_ch = True
-                for category in categories:
-                    if channel["parent_id"] == category["id"]:
-                        muted_ch = channel.get("muted", False)
-                        hidden_ch = channel.get("hidden", False)
-                        # hide restricted channels now because they can be marked as unseen/ping
-                        if not channel.get("permitted", False):
-                            hidden_ch = True
-                        if not (category["muted"] or category["hidden"] == 2 or hidden_ch or muted_ch):
-                            if unseen_ch:
-                                category["unseen"] = True
-                                unseen_guild = True
-                            if mentioned_ch:
-                                category["ping"] = True
-                                ping_guild = True
-                        if not hidden_ch and category["hidden"] != 2:
-                            category["hidden"] = False
-                        active = (channel["id"] == active_channel_id)
-                        category["channels"].append({
-                            "id": channel["id"],
-                            "name": channel["name"],
-                            "position": channel["position"],
-                            "muted": muted_ch,
-                            "hidden": hidden_ch,
-                            "unseen": unseen_ch,
-                            "ping": mentioned_ch,
-                            "active": active,
-                            "threads": threads_ch,
-                            "forum": channel["type"] == 15,
-                        })
-                        break
+                category = categories_by_id.get(channel["parent_id"])
+                if category:
+                    muted_ch = channel.get("muted", False)
+                    hidden_ch = channel.get("hidden", False)
+                    # hide restricted channels now because they can be marked as unseen/ping
+                    if not channel.get("permitted", False):
+                        hidden_ch = True
+                    if not (category["muted"] or category["hidden"] == 2 or hidden_ch or muted_ch):
+                        if unseen_ch:
+                            category["unseen"] = True
+                            unseen_guild = True
+                        if mentioned_ch:
+                            category["ping"] = True
+                            ping_guild = True
+                    if not hidden_ch and category["hidden"] != 2:
+                        category["hidden"] = False
+                    active = (channel["id"] == active_channel_id)
+                    category["channels"].append({
+                        "id": channel["id"],
+                        "name": channel["name"],
+                        "position": channel["position"],
+                        "muted": muted_ch,
+                        "hidden": hidden_ch,
+                        "unseen": unseen_ch,
+                        "ping": mentioned_ch,
+                        "active": active,
+                        "threads": threads_ch,
+                        "forum": channel["type"] == 15,
+                    })
                 else:
                     # top level channels can be inaccessible
                     muted_ch = channel.get("muted", False)
@@ -2381,13 +2466,10 @@ def generate_tree(dms, guilds, threads, unseen, mentioned, guild_folders, activi
 
         # mark folder as unread/mention
         if in_folder:
-            for num, folder in enumerate(tree_metadata):
-                if folder and folder["id"] == in_folder:
-                    if ping_guild and not muted_guild:
-                        tree_format[num] += 20
-                    elif unseen_guild and not muted_guild:
-                        tree_format[num] += 30
-                    break
+            if ping_guild and not muted_guild:
+                tree_format[folder_index] += 20
+            elif unseen_guild and not muted_guild:
+                tree_format[folder_index] += 30
 
         # add categories to the tree
         for category in categories:
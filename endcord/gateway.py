@@ -1,7 +1,10 @@
 import base64
+import collections
 import gc
 import http.client
+import importlib.util
 import logging
+import os
 import random
 import socket
 import ssl
@@ -22,9 +25,28 @@ from google.protobuf.json_format import MessageToDict
 from endcord import debug, perms
 from endcord.message import prepare_message, prepare_special_message_types
 
+if importlib.util.find_spec("compression") and importlib.util.find_spec("compression.zstd"):
+    from compression import zstd
+    zstd_decompressobj = zstd.ZstdDecompressor
+    ZstdError = zstd.ZstdError
+elif importlib.util.find_spec("zstandard"):
+    import zstandard
+    zstd_decompressobj = lambda: zstandard.ZstdDecompressor().decompressobj()   # noqa
+    ZstdError = zstandard.ZstdError
+else:
+    zstd_decompressobj = None
+
 DISCORD_HOST = "discord.com"
-LOCAL_MEMBER_COUNT = 50   # members per guild, CPU-RAM intensive
+LOCAL_MEMBER_COUNT = 1000   # members with roles per guild, least recently seen are removed
+LOCAL_MEMBER_GUILDS = 10   # guilds with member roles, least recently used are removed
+MEMBER_LIST_CHUNK = 100   # member list rows per subscribed range
+SESSION_MAX_AGE = 300   # seconds after exit in which saved session is resumed on next start
+SESSION_STATE = (   # attributes derived from READY event that are saved with session
+    "my_id", "my_user_data", "premium", "guilds", "roles", "my_roles", "dms", "dms_id",
+    "read_state", "blocked", "emojis", "stickers", "user_settings_proto", "legacy",
+)
 ZLIB_SUFFIX = b"\x00\x00\xff\xff"
+COMPRESSIONS = ("zlib-stream", "zstd-stream")   # supported gateway transport compressions
 VOICE_FLAGS = 3   # CLIPS_ENABLED and ALLOW_VOICE_RECORDING
 QOS_HEARTBEAT = True
 QOS_PAYLOAD = {"ver": 26, "active": True, "reason": "foregrounded"}
@@ -34,29 +56,84 @@ code_unpacker = struct.Struct("!H")
 
 
 def zlib_decompress(data):
-    """Decompress zlib data, if it is not zlib compressed, return data instead"""
-    buffer = bytearray()
-    buffer.extend(data)
-    if len(data) < 4 or data[-4:] != ZLIB_SUFFIX:
+    """Decompress zlib-stream data, if it is not zlib compressed, return data instead"""
+    if data[-4:] != ZLIB_SUFFIX:
         return data
     try:
-        return inflator.decompress(buffer)
+        return inflator.decompress(data)   # data is not copied, inflator accepts any bytes-like object
     except zlib.error as e:
         logger.error(f"zlib error: {e}")
         return None
 
 
-def reset_inflator():
-    """Resets inflator object"""
+def zstd_decompress(data):
+    """Decompress zstd-stream data, each message is flushed so it is decompressed whole"""
+    try:
+        return inflator.decompress(data)
+    except ZstdError as e:
+        logger.error(f"zstd error: {e}")
+        return None
+
+
+def drain_buffer(buffer, max_n=None):
+    """Pop up to max_n events from the left side of deque buffer, or all events if max_n is None"""
+    events = []
+    if max_n is None:
+        max_n = len(buffer)
+    try:
+        for _ in range(max_n):
+            events.append(buffer.popleft())
+    except IndexError:   # buffer was emptied from another thread
+        pass
+    return events
+
+
+def prepare_member_list_item(item):
+    """Prepare member list item from GUILD_MEMBER_LIST_UPDATE, keeping only necessary data, the rest can be fetched with discord.get_user_guild()"""
+    if "group" in item:
+        return {"group": item["group"]["id"]}
+    member_data = item["member"]
+    custom_status = None
+    activities = []
+    for activity in member_data["presence"]["activities"]:
+        if activity["type"] == 4:
+            custom_status = activity.get("state", "")
+        elif activity["type"] in (0, 2):
+            assets = activity.get("assets", {})
+            activities.append({
+                "type": activity["type"],
+                "name": activity["name"],
+                "state": activity.get("state"),
+                "details": activity.get("details"),
+                "small_text": assets.get("small_text"),
+                "large_text": assets.get("large_text"),
+            })
+    return {
+        "id": member_data["user"]["id"],
+        "username": member_data["user"]["username"],
+        "global_name": member_data["user"].get("global_name"),   # spacebar_fix - get
+        "nick": member_data["nick"],
+        "roles": member_data["roles"],
+        "status": member_data["presence"]["status"],
+        "custom_status": custom_status,
+        "activities": activities,
+    }
+
+
+def reset_inflator(compression="zlib-stream"):
+    """Resets inflator object for this compression"""
     global inflator
     del inflator
-    inflator = zlib.decompressobj()   # noqa
+    if compression == "zstd-stream":
+        inflator = zstd_decompressobj()   # noqa
+    else:
+        inflator = zlib.decompressobj()   # noqa
 
 
 class Gateway():
     """Methods for fetching and sending data to Discord gateway through websocket"""
 
-    def __init__(self, token, host, client_prop, user_agent, proxy=None):
+    def __init__(self, token, host, client_prop, user_agent, proxy=None, compression="zlib-stream"):
         if host:
             host_obj = urllib.parse.urlsplit(host)
             if host_obj.netloc:
@@ -81,15 +158,18 @@ class Gateway():
         self.sequence = None
         self.resume_gateway_url = ""
         self.session_id = ""
+        self.ready_time_profile = []   # [(stage, seconds, items), ...] of last READY event
         self.clear_ready_vars()
         self.want_member_list = False
         self.want_summaries = True
-        self.messages_buffer = []
-        self.typing_buffer = []
-        self.summaries_buffer = []
-        self.msg_ack_buffer = []
-        self.threads_buffer = []
-        self.call_buffer = []
+        self.messages_buffer = collections.deque()
+        self.typing_buffer = collections.deque()
+        self.summaries_buffer = collections.deque()
+        self.msg_ack_buffer = collections.deque()
+        self.threads_buffer = collections.deque()
+        self.call_buffer = collections.deque()
+        self.removed_channels_buffer = collections.deque()
+        self.active_guild_id = None   # member roles of this guild are never evicted
         self.reconnect_requested = False
         self.status_changed = False
         self.dm_activities_changed = False
@@ -97,6 +177,15 @@ class Gateway():
         self.user_settings_proto = None
         self.proto_changed = False
         self.legacy = "spacebar" in self.host
+        if compression not in COMPRESSIONS:
+            logger.warning(f"Unknown gateway compression: {compression}, using zlib-stream")
+            compression = "zlib-stream"
+        elif compression == "zstd-stream" and (self.legacy or not zstd_decompressobj):
+            logger.warning("zstd-stream is not available, using zlib-stream")
+            compression = "zlib-stream"
+        self.compression = compression
+        self.decompress = zstd_decompress if compression == "zstd-stream" else zlib_decompress
+        reset_inflator(compression)
         self.activities = []
         self.activities_changed = []
         self.subscribed_activities = []
@@ -112,6 +201,9 @@ class Gateway():
         self.querying_members = False
         self.member_query_results = []
         self.resumable = False
+        self.session_file = None
+        self.restoring = False
+        self.event_queue = None
         threading.Thread(target=self.thread_guard, daemon=True, args=()).start()
 
 
@@ -123,9 +215,10 @@ class Gateway():
         self.guilds_changed = True
         self.guilds = []
         self.roles = []
-        self.member_roles = []
+        self.member_roles = collections.OrderedDict()   # guild_id: {user_id: member}, both least recently used first
         self.read_state = {}
         self.subscribed = []
+        self.member_list_ranges = {}   # guild_id: (channel_id, ranges) of last member list subscription
         self.dms = []
         self.dms_id = []
         self.blocked = []
@@ -156,14 +249,14 @@ class Gateway():
         self.ws = websocket.WebSocket()
         if self.proxy.scheme:
             self.ws.connect(
-                gateway_url + "/?v=9&encoding=json&compress=zlib-stream",
+                gateway_url + f"/?v=9&encoding=json&compress={self.compression}",
                 header=self.header,
                 proxy_type=self.proxy.scheme,
                 http_proxy_host=self.proxy.hostname,
                 http_proxy_port=self.proxy.port,
             )
         else:
-            self.ws.connect(gateway_url + "/?v=9&encoding=json&compress=zlib-stream", header=self.header)
+            self.ws.connect(gateway_url + f"/?v=9&encoding=json&compress={self.compression}", header=self.header)
 
 
     def connect(self):
@@ -207,15 +300,114 @@ class Gateway():
             logger.error(f"Failed to get gateway url. Response code: {response.status}. Exiting...")
             raise SystemExit(f"Failed to get gateway url. Response code: {response.status}. Exiting...")
 
-        self.connect_ws()
+        session = self.load_session()
+        if session:
+            self.restore_session(session)
+            try:
+                self.connect_ws(resume=True)
+            except websocket._exceptions.WebSocketBadStatusException:
+                logger.info("Failed to connect to saved session gateway")
+                self.discard_restored_session()
+                self.connect_ws()
+        else:
+            self.connect_ws()
         self.state = 1
-        self.heartbeat_interval = int(json.loads(zlib_decompress(self.ws.recv()))["d"]["heartbeat_interval"])
+        self.heartbeat_interval = int(json.loads(self.decompress(self.ws.recv()))["d"]["heartbeat_interval"])
         self.receiver_thread = threading.Thread(target=self.safe_function_wrapper, daemon=True, args=(self.receiver, ))
         self.receiver_thread.start()
         self.heartbeat_thread = threading.Thread(target=self.send_heartbeat, daemon=True)
         self.heartbeat_thread.start()
         self.reconnect_thread = threading.Thread()
-        self.authenticate()
+        if self.restoring:
+            self.send({"op": 6, "d": {"token": self.token, "session_id": self.session_id, "seq": self.sequence}})
+        else:
+            self.authenticate()
+
+
+    def set_session_file(self, path):
+        """Set file where resumable session is saved on exit, and from which it is resumed on next start"""
+        self.session_file = path
+
+
+    def save_session(self, threads=()):
+        """Disconnect without invalidating session, then save it with state derived from READY event into session file"""
+        if not self.session_file or not self.ready or self.state != 1:
+            return
+        self.run = False
+        try:
+            self.ws.close(status=4000, timeout=0)   # closing with 1000 or 1001 would invalidate session
+        except websocket._exceptions.WebSocketException:
+            return
+        self.receiver_thread.join(timeout=1)   # so sequence wont change anymore
+        session = {
+            "time": time.time(),
+            "session_id": self.session_id,
+            "sequence": self.sequence,
+            "resume_gateway_url": self.resume_gateway_url,
+            "threads": threads,
+        }
+        for key in SESSION_STATE:
+            session[key] = getattr(self, key)
+        try:
+            with open(self.session_file, "wb") as f:
+                f.write(json.dumps(session))
+            logger.info("Gateway session saved")
+        except (OSError, TypeError) as e:
+            logger.warning(f"Failed to save gateway session: {e}")
+
+
+    def load_session(self):
+        """Load session saved on last exit, it is removed from disk so its used only once, returns None if it is too old"""
+        if not self.session_file:
+            return None
+        try:
+            with open(self.session_file, "rb") as f:
+                session = json.loads(f.read())
+            os.remove(self.session_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Failed to load saved gateway session: {e}")
+            return None
+        if time.time() - session.get("time", 0) > SESSION_MAX_AGE or not session.get("session_id"):
+            return None
+        return session
+
+
+    def restore_session(self, session):
+        """Restore saved session and its state, client is ready only after RESUMED event is received"""
+        self.clear_ready_vars()
+        self.session_id = session["session_id"]
+        self.sequence = session["sequence"]
+        self.resume_gateway_url = session["resume_gateway_url"]
+        for key in SESSION_STATE:
+            setattr(self, key, session[key])
+        for guild in session["threads"]:
+            threads = []
+            for channel in guild["channels"]:
+                for thread in channel["threads"]:
+                    thread["parent_id"] = channel["channel_id"]
+                    threads.append(thread)
+            self.threads_buffer.append({
+                "op": "THREAD_UPDATE",
+                "guild_id": guild["guild_id"],
+                "threads": threads,
+            })
+        self.guilds_changed = True
+        self.proto_changed = True
+        self.restoring = True
+        logger.info("Resuming saved gateway session")
+
+
+    def discard_restored_session(self):
+        """Drop state restored from saved session, it will be received again in READY event"""
+        self.restoring = False
+        self.clear_ready_vars()
+        self.threads_buffer.clear()
+        self.emojis = []
+        self.stickers = []
+        self.user_settings_proto = None
+        self.proto_changed = False
 
 
     def safe_function_wrapper(self, function, args=()):
@@ -227,6 +419,13 @@ class Gateway():
             function(*args)
         except BaseException as e:
             self.error = "".join(traceback.format_exception(e))
+            self.notify("ERROR")
+
+
+    def notify(self, event_type):
+        """Push event type to the event queue so main loop can wake up and process it"""
+        if self.event_queue is not None:
+            self.event_queue.put(event_type)
 
 
     def send(self, request):
@@ -238,26 +437,27 @@ class Gateway():
 
 
     def add_member_roles(self, guild_id, user_id, roles):
-        """Add member-role pair to corresponding guild, number of users per guild is limited"""
-        num = -1
-        for num, guild in enumerate(self.member_roles):
-            if guild["guild_id"] == guild_id:
-                break
+        """Add member-role pair to corresponding guild, number of users per guild and number of guilds is limited"""
+        guild = self.member_roles.get(guild_id)
+        if guild is None:
+            guild = collections.OrderedDict()
+            self.member_roles[guild_id] = guild
+            if len(self.member_roles) > LOCAL_MEMBER_GUILDS:
+                for evicted_id in self.member_roles:
+                    if evicted_id != self.active_guild_id:
+                        del self.member_roles[evicted_id]
+                        break
         else:
-            self.member_roles.append({
-                "guild_id": guild_id,
-                "members": [],
-            })
-            num += 1
-        for member in self.member_roles[num]["members"]:
-            if member["user_id"] == user_id:
-                return
-        self.member_roles[num]["members"].insert(0, {
+            self.member_roles.move_to_end(guild_id)
+        if user_id in guild:
+            guild.move_to_end(user_id)
+            return
+        guild[user_id] = {
             "user_id": user_id,
             "roles": roles,
-        })
-        if len(self.member_roles[num]) > LOCAL_MEMBER_COUNT:
-            self.member_roles[num].pop(-1)
+        }
+        if len(guild) > LOCAL_MEMBER_COUNT:
+            guild.popitem(last=False)
         if not self.roles_changed:
             self.roles_changed = True
 
@@ -269,6 +469,11 @@ class Gateway():
                 owned = guild["owned"]
                 community = guild["community"]
                 opt_in_channels = guild.pop("opt_in_channels", False)
+                # group channels by category so each category is not searching all channels
+                children = {}
+                for channel in guild["channels"]:
+                    if channel["parent_id"]:
+                        children.setdefault(channel["parent_id"], []).append(channel)
                 for category_num, category in enumerate(guild["channels"]):
                     if owned or not community or opt_in_channels:   # cant hide channels in owned and non-community guild
                         self.guilds[guild_num]["channels"][category_num]["hidden"] = False
@@ -277,16 +482,14 @@ class Gateway():
                         category_id = category["id"]
                         if not category["hidden"]:
                             # if category is not hidden - show its channels
-                            for channel in guild["channels"]:
-                                if channel["parent_id"] == category_id:
-                                    channel["hidden"] = False
+                            for channel in children.get(category_id, []):
+                                channel["hidden"] = False
                         else:
                             # if category is hidden - hide its channels
-                            for channel in guild["channels"]:
-                                if channel["parent_id"] == category_id:
-                                    if not channel["hidden"]:
-                                        self.guilds[guild_num]["channels"][category_num]["hidden"] = False
-                                        break
+                            for channel in children.get(category_id, []):
+                                if not channel["hidden"]:
+                                    self.guilds[guild_num]["channels"][category_num]["hidden"] = False
+                                    break
 
 
     def add_guild(self, guild):
@@ -422,8 +625,8 @@ class Gateway():
         })
 
 
-    def add_dm(self, dm, data=[]):
-        """Process received dm channel object and add it to dms list"""
+    def add_dm(self, dm, users={}):
+        """Process received dm channel object and add it to dms list, users is {user_id: user} map from READY event"""
         channel_id = dm["id"]
 
         recipients = []
@@ -437,17 +640,17 @@ class Gateway():
                 })
             else:   # spacebar_fix - can open dm with self
                 add_me = True
-        elif data:
+        elif users:
             for recipient_id in dm["recipient_ids"]:
-                for user in data["users"]:
-                    if user["id"] == recipient_id:
-                        recipients.append({
-                            "id": recipient_id,
-                            "username": user["username"],
-                            "global_name": user.get("global_name"),   # spacebar_fix - get
-                        })
-                    elif recipient_id == self.my_id:   # spacebar_fix - can open dm with self
-                        recipients.append(self.my_user_data)
+                user = users.get(recipient_id)
+                if user:
+                    recipients.append({
+                        "id": recipient_id,
+                        "username": user["username"],
+                        "global_name": user.get("global_name"),   # spacebar_fix - get
+                    })
+                elif recipient_id == self.my_id:   # spacebar_fix - can open dm with self
+                    recipients.append(self.my_user_data)
         if add_me:
             recipients.append(self.my_user_data)
 
@@ -561,7 +764,7 @@ class Gateway():
                 self.resumable = code in (4000, 4009)
                 break
             try:
-                data = zlib_decompress(data)
+                data = self.decompress(data)
                 if data:
                     try:
                         response = json.loads(data)
@@ -599,12 +802,11 @@ class Gateway():
                 role = None
                 guild_roles = None
                 if optext == "READY":
-                    ready_time_start = time.time()
+                    time_profile = debug.TimeProfile("READY event")
                     self.resume_gateway_url = data["resume_gateway_url"]
                     self.session_id = data["session_id"]
                     self.clear_ready_vars()
-                    time_log_string = "READY event time profile:\n"
-                    last_messages = []
+                    last_messages = {}   # {channel_id: last_message_id}
                     # get my user data
                     self.set_my_user_data(data["user"])
                     self.my_id = data["user"]["id"]
@@ -616,76 +818,80 @@ class Gateway():
                         logger.warning("Abnormal READY event received, if its always happening, report this")
                         self.resumable = True
                         break
-                    for guild in data["guilds"]:
+                    # READY is processed in stages, each section is removed from data when its processed,
+                    # and each raw guild is released right after it is added, to keep peak memory low
+                    guilds = data.pop("guilds")
+                    merged_members = data.pop("merged_members", [])
+                    for num, guild in enumerate(guilds):
+                        guilds[num] = None
+                        if guild.get("unavailable"):
+                            continue
                         self.add_guild(guild)
-                        if not guild.get("unavailable"):
-                            # build list of last messages from each channel
-                            for channel in guild["channels"]:
-                                if channel["type"] != 15:   # skip forums
-                                    last_messages.append({
-                                        "message_id": channel.get("last_message_id", 0),   # really last message id
-                                        "channel_id": channel["id"],
-                                    })
-                            # add threads to list of last messages from channels
-                            for thread in guild["threads"]:
-                                last_messages.append({
-                                    "message_id": thread.get("last_message_id", 0),   # really last message id
-                                    "channel_id": thread["id"],
-                                })
-                    time_log_string += f"    guilds - {round((time.time() - ready_time_start) * 1000, 3)}ms\n"
-                    ready_time_mid = time.time()
+                        # build map of last messages from each channel
+                        for channel in guild["channels"]:
+                            if channel["type"] != 15:   # skip forums
+                                last_messages.setdefault(channel["id"], channel.get("last_message_id", 0))   # really last message id
+                        # add threads to map of last messages from channels
+                        for thread in guild["threads"]:
+                            last_messages.setdefault(thread["id"], thread.get("last_message_id", 0))
+                        # get my roles, merged_members is in same order as guilds
+                        roles = []
+                        if num < len(merged_members):
+                            for member in merged_members[num]:
+                                if member.get("user_id") == self.my_id or member.get("id") == self.my_id:   # spacebar_fix - user_id -> id
+                                    roles = member["roles"]
+                                    break
+                        self.my_roles.append({
+                            "guild_id": guild["id"],
+                            "roles": roles,
+                        })
+                    del (guilds, merged_members)
+                    time_profile.stage("guilds and roles", len(self.guilds))
                     # DM channels
-                    for dm in data["private_channels"]:
-                        self.add_dm(dm, data)
+                    users = {user["id"]: user for user in data.pop("users", [])}
+                    for dm in data.pop("private_channels"):
+                        self.add_dm(dm, users)
                         if "last_message_id" in dm:
-                            last_messages.append({
-                                "message_id": dm["last_message_id"],   # really last message id
-                                "channel_id": dm["id"],
-                            })
+                            last_messages.setdefault(dm["id"], dm["last_message_id"])
+                    del users
                     self.dms = sorted(self.dms, key=lambda x: x["last_message_id"], reverse=True)
                     self.dms = sorted(self.dms, key=lambda x: x["last_message_id"] == 0)
                     for dm in self.dms:   # dont need it anymore
                         dm.pop("last_message_id")
                     for dm in self.dms:
                         self.dms_id.append(dm["id"])
-                    time_log_string += f"    DMs - {round((time.time() - ready_time_mid) * 1000, 3)}ms\n"
-                    ready_time_mid = time.time()
+                    time_profile.stage("DMs", len(self.dms))
                     # unread messages and pings
-                    read_state = []
-                    msg_ping = []
-                    for channel in data["read_state"]["entries"]:
+                    for channel in data.pop("read_state")["entries"]:
                         # last_message_id in unread_state is actually last_ACKED_message_id
-                        if "last_message_id" in channel and "mention_count" in channel:
-                            read_state.append((channel["id"], channel["last_message_id"]))
-                            if channel["mention_count"]:
-                                msg_ping.append(channel["id"])
-                    for channel_id, last_acked in read_state:   # add relevant data
-                        for last_message in last_messages:
-                            if last_message["channel_id"] == channel_id:
-                                last_message_id = last_message["message_id"]
-                                break
-                        else:
+                        if "last_message_id" not in channel or "mention_count" not in channel:
+                            continue
+                        channel_id = channel["id"]
+                        if channel_id not in last_messages:
                             continue
+                        last_message_id = last_messages[channel_id]
+                        last_acked = channel["last_message_id"]
                         unseen_channel = {
                             "last_message_id": last_message_id,
                             "last_acked_message_id": last_acked if last_acked else 0,   # dont allow it to be None
-                            "mentions": ["True"] if channel_id in msg_ping else [],   # message_id is unknown
+                            "mentions": ["True"] if channel["mention_count"] else [],   # message_id is unknown
                         }
                         if not last_message_id or int(unseen_channel["last_acked_message_id"]) < int(last_message_id):
                             unseen_channel["last_acked_unreads_line"] = unseen_channel["last_acked_message_id"]
                         self.read_state[channel_id] = unseen_channel
-                    time_log_string += f"    read state ({len(self.read_state)} channels) - {round((time.time() - ready_time_mid) * 1000, 3)}ms\n"
-                    ready_time_mid = time.time()
+                    del last_messages
+                    time_profile.stage("read state", len(self.read_state))
                     # guild and dm settings
-                    for guild in data["user_guild_settings"]["entries"]:
+                    guilds_by_id = {guild_g["guild_id"]: guild_g for guild_g in self.guilds}
+                    dms_by_id = {dm_g["id"]: dm_g for dm_g in self.dms}
+                    user_guild_settings = data.pop("user_guild_settings")["entries"]
+                    for guild in user_guild_settings:
                         if guild["guild_id"]:
                             # find this guild in self.guilds
-                            for guild_num, guild_g in enumerate(self.guilds):
-                                if guild_g["guild_id"] == guild["guild_id"]:
-                                    break
-                            else:
+                            guild_g = guilds_by_id.get(guild["guild_id"])
+                            if not guild_g:
                                 continue
-                            self.guilds[guild_num].update({
+                            guild_g.update({
                                 "suppress_everyone": guild["suppress_everyone"],
                                 "suppress_roles": guild["suppress_roles"],
                                 "message_notifications": guild["message_notifications"],
@@ -694,20 +900,19 @@ class Gateway():
                             guild_flags = int(guild.get("flags", 0))
                             # opt_in_channels means: show all guild channels - when guild is joined
                             opt_in_channels = not perms.decode_flag(guild_flags, 14) or perms.decode_flag(guild_flags, 13)
-                            self.guilds[guild_num]["opt_in_channels"] = opt_in_channels
+                            guild_g["opt_in_channels"] = opt_in_channels
+                            if not guild["channel_overrides"]:
+                                continue
+                            channels_by_id = {channel_g["id"]: channel_g for channel_g in guild_g["channels"]}
                             for channel in guild["channel_overrides"]:
-                                found = False
-                                for channel_num, channel_g in enumerate(self.guilds[guild_num]["channels"]):
-                                    if channel_g["id"] == channel["channel_id"]:
-                                        found = True
-                                        break
-                                if found:
+                                channel_g = channels_by_id.get(channel["channel_id"])
+                                if channel_g:
                                     if channel_g["type"] in (0, 2, 4, 5, 15):
                                         flags = int(channel.get("flags", 0))
                                         hidden = not perms.decode_flag(flags, 12)   # manually hidden
                                     else:
                                         hidden = False
-                                    self.guilds[guild_num]["channels"][channel_num].update({
+                                    channel_g.update({
                                         "message_notifications": channel["message_notifications"],
                                         "muted": channel["muted"],
                                         "hidden": hidden,
@@ -715,22 +920,23 @@ class Gateway():
                                     })
                         else:
                             for dm in guild["channel_overrides"]:
-                                for dm_num, dm_g in enumerate(self.dms):
-                                    if dm_g["id"] == dm["channel_id"]:
-                                        break
-                                self.dms[dm_num].update({
-                                    "message_notifications": dm["message_notifications"],
-                                    "muted": dm["muted"],
-                                })
+                                dm_g = dms_by_id.get(dm["channel_id"])
+                                if dm_g:
+                                    dm_g.update({
+                                        "message_notifications": dm["message_notifications"],
+                                        "muted": dm["muted"],
+                                    })
+                    time_profile.stage("channel settings", len(user_guild_settings))
+                    del (user_guild_settings, guilds_by_id, dms_by_id)
                     self.process_hidden_channels()
                     self.guilds_changed = True
-                    time_log_string += f"    channel settings - {round((time.time() - ready_time_mid) * 1000, 3)}ms\n"
-                    ready_time_mid = time.time()
-                    for user in data["relationships"]:
+                    time_profile.stage("hidden channels")
+                    relationships = data.pop("relationships")
+                    for user in relationships:
                         if user["type"] == 2 or user.get("user_ignored"):
                             self.blocked.append(user["id"])
-                    time_log_string += f"    blocked users - {round((time.time() - ready_time_mid) * 1000, 3)}ms\n"
-                    ready_time_mid = time.time()
+                    time_profile.stage("blocked users", len(relationships))
+                    del relationships
                     # get user settings
                     if "user_settings_proto" in data and not self.legacy:
                         decoded = PreloadedUserSettings.FromString(base64.b64decode(data["user_settings_proto"]))
@@ -750,34 +956,24 @@ class Gateway():
                         if old_user_settings.get("custom_status"):
                             self.user_settings_proto["status"]["customStatus"] = old_user_settings["custom_status"]
                     self.proto_changed = True
-                    time_log_string += f"    protobuf - {round((time.time() - ready_time_mid) * 1000, 3)}ms\n"
-                    ready_time_mid = time.time()
-                    # get my roles
-                    if self.guilds:
-                        for num, guild in enumerate(data["merged_members"]):
-                            guild_id = self.guilds[num]["guild_id"]
-                            roles = []
-                            for member in guild:
-                                if member.get("user_id") == self.my_id or member.get("id") == self.my_id:   # spacebar_fix - user_id -> id
-                                    roles = member["roles"]
-                            self.my_roles.append({
-                                "guild_id": guild_id,
-                                "roles": roles,
-                            })
-                    time_log_string += f"    roles - {round((time.time() - ready_time_mid) * 1000, 3)}ms\n"
-                    ready_time_mid = time.time()
+                    time_profile.stage("protobuf")
                     # write debug data
                     if logger.getEffectiveLevel() == logging.DEBUG:
                         debug.save_json(debug.anonymize_guilds(self.guilds), "guilds.json")
-                    # blocked users
-                    time_log_string += f"    debug data - {round((time.time() - ready_time_mid) * 1000, 3)}ms\n"
+                    time_profile.stage("debug data")
                     self.ready = True
-                    time_log_string += f"    total - {round((time.time() - ready_time_start) * 1000, 3)}ms"
-                    logger.debug(time_log_string)
+                    self.ready_time_profile = time_profile.stages
+                    logger.debug(time_profile.report())
                     # READY is huge so lets save some memory
-                    del (response, data, guild, guild_channels, role, guild_roles, last_messages, time_log_string)
+                    del (response, data, guild, guild_channels, role, guild_roles, time_profile)
                     gc.collect()
 
+                elif optext == "RESUMED":
+                    if self.restoring:
+                        self.restoring = False
+                        self.ready = True
+                        logger.info("Saved gateway session resumed")
+
                 elif optext == "READY_SUPPLEMENTAL":
                     for guild in data["merged_presences"]["guilds"]:
                         for user in guild:
@@ -1141,107 +1337,66 @@ class Gateway():
                         if guild["guild_id"] == guild_id:
                             break
                     else:
-                        self.activities.append({"guild_id": guild_id, "members": []})
+                        self.activities.append({"guild_id": guild_id, "members": [], "last_index": None})
                         guild_index = -1
+                    # member list is sparse, rows that are not in subscribed ranges are None
+                    members = self.activities[guild_index]["members"]
+                    last_index = None
+                    synced = False
                     for memlist in data["ops"]:
-                        # keeping only necessary data, because the rest can be fetched with discord.get_user_guild()
-                        if memlist["op"] == "SYNC":
-                            if memlist["range"][0] != 0:
-                                # keeping only first chunk (first 99)
-                                continue
-                            members_sync = []
-                            for item in memlist["items"]:
-                                if "group" in item:
-                                    members_sync.append({"group": item["group"]["id"]})
-                                else:
-                                    custom_status = None
-                                    member_data = item["member"]
-                                    activities = []
-                                    for activity in member_data["presence"]["activities"]:
-                                        if activity["type"] == 4:
-                                            custom_status = activity.get("state", "")
-                                        elif activity["type"] in (0, 2):
-                                            assets = activity.get("assets", {})
-                                            activities.append({
-                                                "type": activity["type"],
-                                                "name": activity["name"],
-                                                "state": activity.get("state"),
-                                                "details": activity.get("details"),
-                                                "small_text": assets.get("small_text"),
-                                                "large_text": assets.get("large_text"),
-                                            })
-                                    members_sync.append({
-                                        "id": member_data["user"]["id"],
-                                        "username": member_data["user"]["username"],
-                                        "global_name": member_data["user"].get("global_name"),   # spacebar_fix - get
-                                        "nick": member_data["nick"],
-                                        "roles": member_data["roles"],
-                                        "status": member_data["presence"]["status"],
-                                        "custom_status": custom_status,
-                                        "activities": activities,
-
-                                    })
-                            self.activities[guild_index]["members"] = members_sync
-                            self.activities[guild_index]["last_index"] = 0
-                            self.activities_changed.append(guild_id)
-
-                        elif memlist["op"] == "DELETE":
+                        op = memlist["op"]
+                        if op == "SYNC":
+                            start = memlist["range"][0]
+                            items = [prepare_member_list_item(item) for item in memlist["items"]]
+                            if len(members) < start + len(items):
+                                members.extend([None] * (start + len(items) - len(members)))
+                            members[start:start + len(items)] = items
+                            synced = True
+                        elif op == "INVALIDATE":
+                            start, end = memlist["range"]
+                            end = min(end + 1, len(members))
+                            if start < end:
+                                members[start:end] = [None] * (end - start)
+                            synced = True
+                        elif op == "DELETE":
                             try:
-                                del self.activities[guild_index]["members"][memlist["index"]]
+                                del members[memlist["index"]]
                             except IndexError:
                                 pass
-                        elif memlist["op"] in ("UPDATE", "INSERT"):
-                            custom_status = None
-                            if "group" in memlist["item"]:
-                                # group can only be inserted
-                                self.activities[guild_index]["members"].insert(memlist["index"], {"group": memlist["item"]["group"]["id"]})
-                                if len(self.activities[guild_index]["members"]) > 100:
-                                    self.activities[guild_index]["members"].pop(-1)
-                                self.activities_changed.append(guild_id)
-                                self.activities[guild_index]["last_index"] = int(memlist["index"])
-                                continue
-                            member_data = memlist["item"]["member"]
-                            activities = []
-                            for activity in member_data["presence"]["activities"]:
-                                if activity["type"] == 4:
-                                    custom_status = activity.get("state", "")
-                                elif activity["type"] in (0, 2):
-                                    assets = activity.get("assets", {})
-                                    activities.append({
-                                        "type": activity["type"],
-                                        "name": activity["name"],
-                                        "state": activity.get("state"),
-                                        "details": activity.get("details"),
-                                        "small_text": assets.get("small_text"),
-                                        "large_text": assets.get("large_text"),
-                                    })
-                            member_id = member_data["user"]["id"]
-                            ready_data = {
-                                "id": member_id,
-                                "username": member_data["user"]["username"],
-                                "global_name": member_data["user"].get("global_name"),   # spacebar_fix - get
-                                "nick": member_data["nick"],
-                                "roles": member_data["roles"],
-                                "status": member_data["presence"]["status"],
-                                "custom_status": custom_status,
-                                "activities": activities,
-                            }
-                            if memlist["op"] == "UPDATE":
-                                try:
-                                    if self.activities[guild_index]["members"][memlist["index"]].get("id") == member_id:
-                                        self.activities[guild_index]["members"][memlist["index"]].update(ready_data)
-                                    else:   # failsafe
-                                        for num, member in enumerate(self.activities[guild_index]["members"]):
-                                            if member.get("id") == member_id:
-                                                self.activities[guild_index]["members"][num].update(ready_data)
-                                except IndexError:
-                                    pass
-                            else:   # INSERT
-                                self.activities[guild_index]["members"].insert(memlist["index"], ready_data)
-                                if len(self.activities[guild_index]["members"]) > 100:   # lets have some limits
-                                    self.activities[guild_index]["members"].pop(-1)
-                            self.activities[guild_index]["last_index"] = int(memlist["index"])
-                        self.activities_changed.append(guild_id)
+                            last_index = memlist["index"]
+                        elif op in ("UPDATE", "INSERT"):
+                            index = memlist["index"]
+                            item = prepare_member_list_item(memlist["item"])
+                            if len(members) < index:
+                                members.extend([None] * (index - len(members)))
+                            if op == "INSERT":
+                                members.insert(index, item)
+                            elif index < len(members):
+                                members[index] = item
+                            else:
+                                members.append(item)
+                            last_index = index
+                    # groups hold total number of rows after all ops are applied
+                    if "groups" in data:
+                        total = sum(group["count"] + 1 for group in data["groups"] if group.get("count"))
+                        if len(members) > total:
+                            del members[total:]
+                        else:
+                            members.extend([None] * (total - len(members)))
+                    if synced:
+                        # drop rows that are no longer in subscribed ranges
+                        ranges = self.member_list_ranges.get(guild_id, (None, [[0, MEMBER_LIST_CHUNK - 1]]))[1]
+                        end = 0
+                        for range_start, range_end in ranges:
+                            clear_end = min(range_start, len(members))
+                            if end < clear_end:
+                                members[end:clear_end] = [None] * (clear_end - end)
+                            end = max(end, range_end + 1)
+                        if end < len(members):
+                            members[end:] = [None] * (len(members) - end)
+                        last_index = None
+                    self.activities[guild_index]["last_index"] = last_index
+                    self.activities_changed.append(guild_id)
 
                 elif optext == "USER_SETTINGS_PROTO_UPDATE":
                     if data["partial"] or data["settings"]["type"] != 1:
@@ -1280,15 +1435,14 @@ class Gateway():
                                 hidden = False
                             self.guilds[guild_num]["channels"][channel_num]["hidden"] = hidden
                             self.guilds[guild_num]["channels"][channel_num]["muted"] = False
+                        channels_by_id = {channel_g["id"]: channel_g for channel_g in self.guilds[guild_num]["channels"]}
                         for channel in data["channel_overrides"]:
-                            for channel_num, channel_g in enumerate(self.guilds[guild_num]["channels"]):
-                                if channel_g["id"] == channel["channel_id"]:
-                                    break
-                            else:
+                            channel_g = channels_by_id.get(channel["channel_id"])
+                            if not channel_g:
                                 continue
                             flags = int(channel.get("flags", 0))
                             hidden = not perms.decode_flag(flags, 12)
-                            self.guilds[guild_num]["channels"][channel_num].update({
+                            channel_g.update({
                                 "message_notifications": channel["message_notifications"],
                                 "muted": channel["muted"],
                                 "hidden": hidden,
@@ -1298,13 +1452,12 @@ class Gateway():
                         for dm_g in self.dms:
                             dm_g.pop("message_notifications", None)   # reset to default
                             dm_g.pop("muted", None)
+                        dms_by_id = {dm_g["id"]: dm_g for dm_g in self.dms}
                         for dm in data["channel_overrides"]:
-                            for dm_num, dm_g in enumerate(self.dms):
-                                if dm_g["id"] == dm["channel_id"]:
-                                    break
-                            else:
+                            dm_g = dms_by_id.get(dm["channel_id"])
+                            if not dm_g:
                                 continue
-                            self.dms[dm_num].update({
+                            dm_g.update({
                                 "message_notifications": dm["message_notifications"],
                                 "muted": dm["muted"],
                             })
@@ -1433,15 +1586,18 @@ class Gateway():
                                 if dm["id"] == channel_id:
                                     self.dms.pop(num)
                                     break
+                            self.removed_channels_buffer.append(channel_id)
                         else:
                             self.add_dm(new_channel)
                         self.dms_id = []
                         for dm in self.dms:
                             self.dms_id.append(dm["id"])
                         self.guilds_changed = True
+                        self.notify(optext)
                         continue
 
                     if optext == "CHANNEL_DELETE":
+                        self.removed_channels_buffer.append(channel_id)
                         for num, guild in enumerate(self.guilds):
                             if guild["guild_id"] == guild_id:
                                 for num_ch, channel in enumerate(guild["channels"]):
@@ -1510,6 +1666,8 @@ class Gateway():
                         for num, guild in enumerate(self.guilds):
                             if guild["guild_id"] == guild_id:
                                 self.guilds.pop(num)
+                                if not data.get("unavailable"):   # left guild, not outage
+                                    self.removed_channels_buffer.extend(channel["id"] for channel in guild["channels"])
                                 self.guilds_changed = True
                                 break
 
@@ -1570,6 +1728,9 @@ class Gateway():
                                 self.guild_roles_changed = (guild_id, role["id"])
                                 break
 
+                # wake up main loop only after event is fully processed
+                self.notify(optext)
+
             elif opcode == 7:
                 logger.info("Host requested reconnect")
                 self.resumable = True
@@ -1579,11 +1740,16 @@ class Gateway():
                 if response["d"]:
                     logger.info("Session invalidated, reconnecting")
                     break
+                if self.restoring:
+                    logger.info("Saved gateway session could not be resumed")
+                    self.discard_restored_session()
+                    self.authenticate()
 
         self.state = 0
         logger.info("Receiver stopped")
         self.reconnect_requested = True
         self.heartbeat_running = False
+        self.notify("STATE")
 
 
     def send_heartbeat(self):
@@ -1640,6 +1806,7 @@ class Gateway():
         self.state = 0
         logger.debug("Heartbeater stopped")
         self.reconnect_requested = True
+        self.notify("STATE")
 
 
     def authenticate(self):
@@ -1668,18 +1835,18 @@ class Gateway():
         """
         self.ws.close(timeout=0)   # this will stop receiver
         time.sleep(1)   # so receiver ends before opening new socket
-        reset_inflator()   # otherwise decompression wont work
+        reset_inflator(self.compression)   # otherwise decompression wont work
         self.ws = websocket.WebSocket()
         try:
             self.connect_ws(resume=True)
         except websocket._exceptions.WebSocketBadStatusException:
             logger.info("Failed to resume connection")
             return 9
-        _ = zlib_decompress(self.ws.recv())
+        _ = self.decompress(self.ws.recv())
         payload = {"op": 6, "d": {"token": self.token, "session_id": self.session_id, "seq": self.sequence}}
         self.send(payload)
         try:
-            op = json.loads(zlib_decompress(self.ws.recv()))["op"]
+            op = json.loads(self.decompress(self.ws.recv()))["op"]
             logger.debug(f"Connection resumed with code {op}")
             return op or True
         except json.JSONDecodeError:
@@ -1692,6 +1859,7 @@ class Gateway():
         if not self.wait:
             self.state = 2
             logger.info("Trying to reconnect")
+            self.notify("STATE")
         try:
             code = None
             if self.resumable:
@@ -1701,7 +1869,7 @@ class Gateway():
                 logger.debug("Restarting connection")
                 self.ws.close(timeout=0)   # this will stop receiver
                 time.sleep(1)   # so receiver ends before opening new socket
-                reset_inflator()   # otherwise decompression wont work
+                reset_inflator(self.compression)   # otherwise decompression wont work
                 self.ready = False   # will receive new ready event
                 self.ws = websocket.WebSocket()
                 self.connect_ws()
@@ -1716,6 +1884,7 @@ class Gateway():
                 self.heartbeat_thread.start()
             self.state = 1
             logger.info("Connection established")
+            self.notify("STATE")
         except websocket._exceptions.WebSocketAddressException:
             if not self.wait:   # if not running from wait_oline
                 logger.warning("No internet connection")
@@ -1773,6 +1942,9 @@ class Gateway():
         Subscribe to the channel to receive "typing" events from gateway for specified channel,
         and threads updates, and member presence updates for this guild.
         """
+        self.active_guild_id = guild_id
+        if guild_id in self.member_roles:
+            self.member_roles.move_to_end(guild_id)
         if guild_id:
             # when subscribing, add channel to list of subscribed channels
             # then send whole list
@@ -1787,7 +1959,8 @@ class Gateway():
                         guild["channels"].append(channel_id)
                         channels = {}
                         for channel in guild["channels"]:
-                            channels[channel] = [[0, 99]]   # what is [[0, 99]]?
+                            channels[channel] = [[0, MEMBER_LIST_CHUNK - 1]]   # member list ranges
+                        self.member_list_ranges[guild_id] = (channel_id, channels[channel_id])
                         payload = {
                             "op": 37,   # changed in gateway v10
                             "d": {
@@ -1807,6 +1980,7 @@ class Gateway():
                     "channels": [channel_id],
                     "members": [],
                 })
+                self.member_list_ranges[guild_id] = (channel_id, [[0, MEMBER_LIST_CHUNK - 1]])
                 payload = {
                     "op": 37,   # changed in gateway v10
                     "d": {
@@ -1816,7 +1990,7 @@ class Gateway():
                                 "activities": self.want_member_list,
                                 "threads": True,
                                 "channels": {
-                                    channel_id: [[0, 99]],
+                                    channel_id: [[0, MEMBER_LIST_CHUNK - 1]],
                                 },
                             },
                         },
@@ -1834,6 +2008,44 @@ class Gateway():
             logger.debug("Subscribed to a DM")
 
 
+    def subscribe_member_list(self, channel_id, guild_id, index):
+        """
+        Subscribe to member list ranges around this index, so member list can be scrolled past first chunk.
+        First chunk is always subscribed, payload is sent only when ranges change.
+        """
+        if not self.want_member_list:
+            return
+        for guild in self.subscribed:
+            if guild["guild_id"] == guild_id and channel_id in guild["channels"]:
+                break
+        else:
+            return
+        chunk = index // MEMBER_LIST_CHUNK
+        ranges = [[0, MEMBER_LIST_CHUNK - 1]]
+        for num in (chunk, chunk + 1):
+            if num:
+                ranges.append([num * MEMBER_LIST_CHUNK, (num + 1) * MEMBER_LIST_CHUNK - 1])
+        if self.member_list_ranges.get(guild_id) == (channel_id, ranges):
+            return
+        self.member_list_ranges[guild_id] = (channel_id, ranges)
+        channels = {}
+        for channel in guild["channels"]:
+            channels[channel] = [[0, MEMBER_LIST_CHUNK - 1]]
+        channels[channel_id] = ranges
+        payload = {
+            "op": 37,
+            "d": {
+                "subscriptions": {
+                    guild_id: {
+                        "channels": channels,
+                    },
+                },
+            },
+        }
+        self.send(payload)
+        logger.debug(f"Subscribed to member list ranges: {ranges}")
+
+
     def subscribe_member(self, member_id, guild_id):
         """Subscribe to the member account to receive presence updates from gateway"""
         # same as subscribe() just with members instead channels
@@ -1947,6 +2159,11 @@ class Gateway():
         self.subscribed_channels = subscribed_channels
 
 
+    def set_event_queue(self, event_queue):
+        """Set queue into which type of each processed event is pushed, used to wake up main loop"""
+        self.event_queue = event_queue
+
+
     def set_want_member_list(self, want):
         """Set if client wants to receive member list updates"""
         self.want_member_list = want
@@ -2093,7 +2310,7 @@ class Gateway():
 
 
     def get_member_roles(self):
-        """Get member roles, updated regularly."""
+        """Get member roles per guild, as dict of user_id: member, updated regularly."""
         if self.roles_changed:
             temp = self.roles_changed
             self.roles_changed = False
@@ -2161,10 +2378,11 @@ class Gateway():
         return None
 
 
-    # all following "get_*" work like this:
+    # all following "get_*" and "drain_*" work like this:
     # internally:
-    #    get events and append them to list
-    #    when get_messages() is called, remove event from list and return it
+    #    get events and append them to deque
+    #    when get_messages() is called, remove event from deque and return it
+    #    when drain_messages() is called, remove up to max_n events from deque and return them as list
     # externally:
     #    in main get initial data
     #    main loop in app runs get_*() functions:
@@ -2181,9 +2399,10 @@ class Gateway():
         Get message CREATE, EDIT, DELETE and ACK events for every guild and channel.
         Returns 1 by 1 event as an update for list of messages.
         """
-        if len(self.messages_buffer) == 0:
+        try:
+            return self.messages_buffer.popleft()
+        except IndexError:
             return None
-        return self.messages_buffer.pop(0)
 
 
     def get_typing(self):
@@ -2191,9 +2410,10 @@ class Gateway():
         Get typing across guilds.
         Returns 1 by 1 event as an update for list of typing.
         """
-        if len(self.typing_buffer) == 0:
+        try:
+            return self.typing_buffer.popleft()
+        except IndexError:
             return None
-        return self.typing_buffer.pop(0)
 
 
     def get_summaries(self):
@@ -2201,9 +2421,10 @@ class Gateway():
         Get summaries.
         Returns 1 by 1 event as an update for list of summaries.
         """
-        if len(self.summaries_buffer) == 0:
+        try:
+            return self.summaries_buffer.popleft()
+        except IndexError:
             return None
-        return self.summaries_buffer.pop(0)
 
 
     def get_message_ack(self):
@@ -2211,9 +2432,10 @@ class Gateway():
         Get messages seen by other clients.
         Returns 1 by 1 ack event.
         """
-        if len(self.msg_ack_buffer) == 0:
+        try:
+            return self.msg_ack_buffer.popleft()
+        except IndexError:
             return None
-        return self.msg_ack_buffer.pop(0)
 
 
     def get_threads(self):
@@ -2221,9 +2443,10 @@ class Gateway():
         Get thread update related events: update, crate and delete.
         Returns 1 by 1 update event with opcode.
         """
-        if len(self.threads_buffer) == 0:
+        try:
+            return self.threads_buffer.popleft()
+        except IndexError:
             return None
-        return self.threads_buffer.pop(0)
 
 
     def get_call_events(self):
@@ -2231,6 +2454,45 @@ class Gateway():
         Get call events.
         Returns 1 by 1 call event.
         """
-        if len(self.call_buffer) == 0:
+        try:
+            return self.call_buffer.popleft()
+        except IndexError:
             return None
-        return self.call_buffer.pop(0)
+
+
+    def drain_messages(self, max_n=None):
+        """
+        Get up to max_n message events, same as get_messages(), but in one call.
+        Returns list of events, all pending events if max_n is None.
+        """
+        return drain_buffer(self.messages_buffer, max_n)
+
+
+    def drain_typing(self, max_n=None):
+        """Get up to max_n typing events as list, all pending events if max_n is None"""
+        return drain_buffer(self.typing_buffer, max_n)
+
+
+    def drain_summaries(self, max_n=None):
+        """Get up to max_n summaries as list, all pending summaries if max_n is None"""
+        return drain_buffer(self.summaries_buffer, max_n)
+
+
+    def drain_message_ack(self, max_n=None):
+        """Get up to max_n ack events as list, all pending events if max_n is None"""
+        return drain_buffer(self.msg_ack_buffer, max_n)
+
+
+    def drain_threads(self, max_n=None):
+        """Get up to max_n thread update events as list, all pending events if max_n is None"""
+        return drain_buffer(self.threads_buffer, max_n)
+
+
+    def drain_removed_channels(self, max_n=None):
+        """Get up to max_n ids of deleted channels and channels of left guilds as list, all pending if max_n is None"""
+        return drain_buffer(self.removed_channels_buffer, max_n)
+
+
+    def drain_call_events(self, max_n=None):
+        """Get up to max_n call events as list, all pending events if max_n is None"""
+        return drain_buffer(self.call_buffer, max_n)
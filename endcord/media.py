@@ -13,7 +13,8 @@ from queue import Queue
 
 import av
 import filetype
-from PIL import Image, ImageEnhance
+import numpy as np
+from PIL import Image
 
 # safely import soundcard, in case there is no sound system
 try:
@@ -25,6 +26,10 @@ except (AssertionError, RuntimeError):
 from endcord import xterm256
 
 logger = logging.getLogger(__name__)
+LUT_BITS = 6   # bits per channel in RGB to xterm256 lookup table
+GRAY_WEIGHTS = np.array((0.299, 0.587, 0.114), dtype=np.float32)   # same as pillow "L" conversion
+FRAME_CACHE_LIMIT = 200   # max number of converted animation frames kept in cache
+xterm256_lut = None
 match_youtube = re.compile(r"(?:https?:\/\/)?(?:www\.)?(?:youtube\.com\/(?:watch\?v=|embed\/)|youtu\.be\/)[a-zA-Z0-9_-]{11}")
 
 
@@ -36,11 +41,24 @@ def get_mime(path):
     return "unknown/unknown"
 
 
-def img_to_curses(screen, img, img_gray, start_color_id, ascii_palette, ascii_palette_len, screen_width, screen_height, width, height):
-    """Draw image using curses with padding"""
-    pixels = img.load()
-    pixels_gray = img_gray.load()
-
+def get_xterm256_lut():
+    """Get lookup table from RGB reduced to LUT_BITS per channel, to nearest xterm256 color index without first 16 colors"""
+    global xterm256_lut
+    if xterm256_lut is None:
+        palette = np.array(xterm256.palette_short, dtype=np.int32).reshape(-1, 3)
+        shift = 8 - LUT_BITS
+        levels = (np.arange(1 << LUT_BITS, dtype=np.int32) << shift) + ((1 << shift) >> 1)   # centers of reduced values
+        diff = (levels[:, None, None] - palette[None, :, :]) ** 2   # (level, color, channel)
+        xterm256_lut = np.empty((1 << LUT_BITS, ) * 3, dtype=np.uint8)
+        dist_gb = diff[:, None, :, 1] + diff[None, :, :, 2]   # (g, b, color)
+        for r in range(1 << LUT_BITS):
+            xterm256_lut[r] = np.argmin(diff[r, :, 0] + dist_gb, axis=2)
+    return xterm256_lut
+
+
+def img_to_curses(screen, rows, colors, start_color_id, screen_width, screen_height):
+    """Draw image rows using curses with padding, each run of same color is drawn at once"""
+    height, width = colors.shape
     padding_h = (screen_height - height) // 2
     padding_w = (screen_width - width) // 2
     bg_color = curses.color_pair(start_color_id + 1)
@@ -57,15 +75,17 @@ def img_to_curses(screen, img, img_gray, start_color_id, ascii_palette, ascii_pa
         if padding_w > 0:
             screen.insstr(row_y, 0, " " * padding_w, bg_color)
 
-        for x in range(width):
-            gray_val = pixels_gray[x, y]
-            character = ascii_palette[(gray_val * ascii_palette_len) // 255]
-            color = start_color_id + pixels[x, y] + 16
-            screen.insch(row_y, x + padding_w, character, curses.color_pair(color))
+        row = rows[y]
+        row_colors = colors[y]
+        start = 0
+        for end in (np.flatnonzero(row_colors[1:] != row_colors[:-1]) + 1).tolist() + [width]:
+            color = start_color_id + int(row_colors[start]) + 16
+            screen.insstr(row_y, start + padding_w, row[start:end], curses.color_pair(color))
+            start = end
 
         # right padding
-        if x + padding_w + 1 < screen_width:
-            screen.insstr(row_y, x + padding_w + 1, " " * (screen_width - (x + padding_w + 1)), bg_color)
+        if width + padding_w < screen_width:
+            screen.insstr(row_y, width + padding_w, " " * (screen_width - (width + padding_w)), bg_color)
 
     # bottom padding
     if screen_height != height:
@@ -77,7 +97,30 @@ def img_to_curses(screen, img, img_gray, start_color_id, ascii_palette, ascii_pa
 
     screen.noutrefresh()
 
-# use cython if available, ~1.15 times faster
+
+def img_diff_to_curses(screen, rows, chars, colors, prev_chars, prev_colors, start_color_id, screen_width, screen_height):
+    """Draw only cells that changed since previous image of same size was drawn, each run of same color is drawn at once"""
+    height, width = colors.shape
+    padding_h = (screen_height - height) // 2
+    padding_w = (screen_width - width) // 2
+    changed = (chars != prev_chars) | (colors != prev_colors)
+
+    for y in np.flatnonzero(changed.any(axis=1)).tolist():
+        row = rows[y]
+        keys = np.where(changed[y], colors[y].astype(np.int16), -1)   # -1 - unchanged cell
+        start = 0
+        for end in (np.flatnonzero(keys[1:] != keys[:-1]) + 1).tolist() + [width]:
+            key = int(keys[start])
+            if key != -1:
+                try:
+                    screen.addstr(y + padding_h, start + padding_w, row[start:end], curses.color_pair(start_color_id + key + 16))
+                except curses.error:
+                    pass   # when writing to the last cell of the screen
+            start = end
+
+    screen.noutrefresh()
+
+# use cython if available
 if importlib.util.find_spec("endcord_cython") and importlib.util.find_spec("endcord_cython.media"):
     from endcord_cython.media import img_to_curses
 
@@ -110,8 +153,8 @@ class CursesMedia():
         if self.default_color == -1:
             self.default_color = 0
         self.start_color_id = start_color_id
-        self.ascii_palette_len = len(self.ascii_palette) - 1
-        self.xterm_256_palette = xterm256.palette_short
+        ascii_palette_len = len(self.ascii_palette) - 1
+        self.gray_to_char = np.array([self.ascii_palette[(gray * ascii_palette_len) // 255] for gray in range(256)], dtype="<U1")
         self.run = False
         self.playing = False
         self.ended = False
@@ -120,6 +163,8 @@ class CursesMedia():
         self.path = None
         self.media_type = None
         self.seek = None
+        self.drawn_frame = None
+        self.drawn_screen = None
 
         self.lock = threading.RLock()
         self.need_update = threading.Event()
@@ -148,9 +193,8 @@ class CursesMedia():
                 self.need_update.clear()
 
 
-    def pil_img_to_curses(self, img, remove_alpha=True):
-        """Convert pillow image to ascii art and display it with curses"""
-        screen_height, screen_width = self.media_screen.getmaxyx()
+    def img_to_ascii(self, img, remove_alpha=True):
+        """Convert pillow image to ascii art frame scaled to media screen: row strings, characters and color indexes"""
         height, width = self.media_screen.getmaxyx()
 
         # scale image
@@ -162,40 +206,68 @@ class CursesMedia():
             width = wsize
         else:
             height = hsize
-        img = img.resize((width, height), Image.Resampling.LANCZOS)
-        img_gray = img.convert("L")
+        img = img.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        if remove_alpha and img.mode != "RGB" and img.mode != "L":
+            pixels = np.asarray(img.convert("RGBA"), dtype=np.float32)
+            alpha = pixels[:, :, 3:] / 255
+            pixels = pixels[:, :, :3]
+        else:
+            pixels = np.asarray(img.convert("RGB"), dtype=np.float32)
+            alpha = None
+        gray = pixels @ GRAY_WEIGHTS
 
         # increase saturation
         if self.saturation:
-            sat = ImageEnhance.Color(img)
-            img = sat.enhance(self.saturation)
+            pixels = gray[:, :, None] + (pixels - gray[:, :, None]) * self.saturation
 
-        if remove_alpha and img.mode != "RGB" and img.mode != "L":
-            background = Image.new("RGB", img.size, (0, 0, 0))
-            background.paste(img, mask=img.split()[3])
-            img = background
-
-        # apply xterm256 palette
-        img_palette = Image.new("P", (16, 16))
-        img_palette.putpalette(self.xterm_256_palette)
-        img = img.quantize(palette=img_palette, dither=0)
-
-        # draw with curses
-        img_to_curses(
-            self.media_screen,
-            img,
-            img_gray,
-            self.start_color_id,
-            self.ascii_palette,
-            self.ascii_palette_len,
-            screen_width,
-            screen_height,
-            width,
-            height,
-        )
+        # blend with black background
+        if alpha is not None:
+            pixels = pixels * alpha
+
+        # apply xterm256 palette and ascii palette
+        pixels = np.clip(pixels, 0, 255).astype(np.uint8) >> (8 - LUT_BITS)
+        colors = get_xterm256_lut()[pixels[:, :, 0], pixels[:, :, 1], pixels[:, :, 2]]
+        chars = self.gray_to_char[np.clip(gray, 0, 255).astype(np.uint8)]
+        rows = np.ascontiguousarray(chars).view(f"<U{width}").ravel().tolist()
+        return rows, chars, colors
+
+
+    def draw_frame(self, frame):
+        """Draw ascii art frame with curses, if previous frame is on the same screen, only changed cells are drawn"""
+        screen_height, screen_width = self.media_screen.getmaxyx()
+        rows, chars, colors = frame
+        screen = (self.media_screen, screen_height, screen_width)
+        if self.drawn_frame and self.drawn_screen == screen and self.drawn_frame[2].shape == colors.shape:
+            img_diff_to_curses(
+                self.media_screen,
+                rows,
+                chars,
+                colors,
+                self.drawn_frame[1],
+                self.drawn_frame[2],
+                self.start_color_id,
+                screen_width,
+                screen_height,
+            )
+        else:
+            img_to_curses(
+                self.media_screen,
+                rows,
+                colors,
+                self.start_color_id,
+                screen_width,
+                screen_height,
+            )
+        self.drawn_frame = frame
+        self.drawn_screen = screen
         self.need_update.set()
 
 
+    def pil_img_to_curses(self, img, remove_alpha=True):
+        """Convert pillow image to ascii art and display it with curses"""
+        self.draw_frame(self.img_to_ascii(img, remove_alpha))
+
+
     def play_img(self, img_path):
         """
         Convert image to colored ascii art and draw it with curses.
@@ -220,20 +292,35 @@ class CursesMedia():
 
 
     def play_anim(self, gif_path):
-        """Convert animated image to colored ascii art and draw it with curses"""
+        """
+        Convert animated image to colored ascii art and draw it with curses.
+        Converted frames are cached for current screen size, so next loops are only drawn.
+        """
         self.init_colors()   # 255_curses_bug
         self.hide_ui()
         gif = Image.open(gif_path)
         frame = 0
         loop = bool(gif.info.get("loop", 1))
+        frames = {}   # {frame: (ascii_frame, frame_duration)}
+        frames_size = None
         while self.playing:
             try:
                 start_time = time.time()
-                frame_duration = gif.info["duration"] / 1000
-                gif.seek(frame)
-                img = Image.new("RGB", gif.size)
-                img.paste(gif)
-                self.pil_img_to_curses(img, remove_alpha=False)
+                screen_size = self.media_screen.getmaxyx()
+                if screen_size != frames_size:
+                    frames = {}
+                    frames_size = screen_size
+                if frame in frames:
+                    ascii_frame, frame_duration = frames[frame]
+                else:
+                    frame_duration = gif.info["duration"] / 1000
+                    gif.seek(frame)
+                    img = Image.new("RGB", gif.size)
+                    img.paste(gif)
+                    ascii_frame = self.img_to_ascii(img, remove_alpha=False)
+                    if len(frames) < FRAME_CACHE_LIMIT:
+                        frames[frame] = (ascii_frame, frame_duration)
+                self.draw_frame(ascii_frame)
                 frame += 1
                 time.sleep(max(frame_duration - (time.time() - start_time), 0))
             except EOFError:
@@ -259,6 +346,7 @@ class CursesMedia():
 
         # fill screen
         if self.ui:
+            self.drawn_frame = None
             self.media_screen.clear()
             h, w = self.media_screen.getmaxyx()
             for y in range(h):
@@ -443,6 +531,7 @@ class CursesMedia():
         self.path = path
         self.ui = True
         self.run = True
+        self.drawn_frame = None   # screen could be drawn over since last playback
         self.screen_update_thread = threading.Thread(target=self.screen_update, daemon=True)
         self.screen_update_thread.start()
         self.playing = True
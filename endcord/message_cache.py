@@ -0,0 +1,105 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import orjson as json
+
+from endcord import peripherals
+
+logger = logging.getLogger(__name__)
+
+
+class MessageCache:
+    """Persistent on-disk cache of prepared messages per channel, stored in sqlite database"""
+
+    def __init__(self, file, max_channels=50, max_age=24):
+        self.max_channels = max_channels
+        self.max_age = max_age * 3600
+        self.lock = threading.Lock()
+        path = os.path.join(os.path.expanduser(peripherals.config_path), file)
+        try:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS channels (channel_id TEXT PRIMARY KEY, saved REAL, messages BLOB)")
+            self.db.commit()
+            self.evict()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to open message cache: {e}")
+            self.db = None
+
+
+    def save(self, channel_id, messages):
+        """Save messages for this channel, newest message first, deleted messages are skipped"""
+        if not self.db or not channel_id:
+            return
+        messages = [x for x in messages if not x.get("deleted")]
+        if not messages:
+            return
+        try:
+            data = json.dumps(messages)
+        except TypeError as e:
+            logger.warning(f"Failed to serialize messages for message cache: {e}")
+            return
+        with self.lock:
+            try:
+                self.db.execute("INSERT OR REPLACE INTO channels VALUES (?, ?, ?)", (channel_id, time.time(), data))
+                self.db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to save to message cache: {e}")
+
+
+    def load(self, channel_id):
+        """Load cached messages for this channel, returns None if channel is not cached or cache is too old"""
+        if not self.db or not channel_id:
+            return None
+        with self.lock:
+            try:
+                row = self.db.execute("SELECT saved, messages FROM channels WHERE channel_id = ?", (channel_id, )).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to load from message cache: {e}")
+                return None
+        if not row or time.time() - row[0] > self.max_age:
+            return None
+        try:
+            return json.loads(row[1])
+        except json.JSONDecodeError:
+            return None
+
+
+    def remove(self, channel_id):
+        """Remove this channel from cache"""
+        if not self.db:
+            return
+        with self.lock:
+            try:
+                self.db.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id, ))
+                self.db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to remove from message cache: {e}")
+
+
+    def evict(self):
+        """Remove channels that are too old and oldest channels above the limit"""
+        if not self.db:
+            return
+        with self.lock:
+            try:
+                self.db.execute("DELETE FROM channels WHERE saved < ?", (time.time() - self.max_age, ))
+                self.db.execute(
+                    "DELETE FROM channels WHERE channel_id NOT IN (SELECT channel_id FROM channels ORDER BY saved DESC LIMIT ?)",
+                    (self.max_channels, ),
+                )
+                self.db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to evict message cache: {e}")
+
+
+    def close(self):
+        """Evict old channels and close database"""
+        if not self.db:
+            return
+        self.evict()
+        with self.lock:
+            self.db.close()
+            self.db = None
@@ -20,14 +20,9 @@ def decode_permission(permission, flag):
     return (permission & flag) == flag
 
 
-def compute_permissions(guilds, this_guild_roles, this_guild_id, my_roles, my_id):
-    """Read channel permissions and add permitted and allowed_embeds to each channel"""
-    # select guild
-    for guild in guilds:
-        if guild["guild_id"] == this_guild_id:
-            break
-    else:
-        return guilds
+def compute_permissions(guild, this_guild_roles, my_roles, my_id):
+    """Read channel permissions and add permitted and allowed_embeds to each channel of this guild"""
+    this_guild_id = guild["guild_id"]
 
     # check if this user is admin
     admin = False
@@ -47,7 +42,7 @@ def compute_permissions(guilds, this_guild_roles, this_guild_id, my_roles, my_id
             guild["channels"][num]["allow_write"] = True
             guild["channels"][num].get("permission_overwrites", None)
         guild["admin"] = True
-        return guilds
+        return guild
 
     # base permissions
     base_permissions = int(guild["base_permissions"])
@@ -94,7 +89,7 @@ def compute_permissions(guilds, this_guild_roles, this_guild_id, my_roles, my_id
         guild["channels"][num]["permitted"] = decode_permission(permissions, 0x400)    # VIEW_CHANNEL
         guild["channels"][num]["allow_write"] = decode_permission(permissions, 0x800)    # SEND_MESSAGES
         guild["channels"][num]["allow_attach"] = decode_permission(permissions, 0x8000)   # ATTACH_FILES
-    return guilds
+    return guild
 
 
 def compute_command_permissions(commands, all_app_perms, this_channel_id, this_guild_id, my_roles, my_id, admin, my_this_channel_perms):
@@ -5,6 +5,10 @@ import re
 import emoji
 
 COMMAND_OPT_TYPE = ("subcommand", "group", "string", "integer", "True/False", "user ID", "channel ID", "role ID", "mentionable ID", "number", "attachment")
+SEARCH_INDEX_LIMIT = 20   # max number of prebuilt search indexes kept in cache
+
+search_indexes = {}   # {key: SearchIndex}
+standard_emoji_index = None
 
 
 def fuzzy_match_score_single(query, candidate):
@@ -56,6 +60,84 @@ if importlib.util.find_spec("endcord_cython") and importlib.util.find_spec("endc
     from endcord_cython.search import fuzzy_match_score
 
 
+class SearchIndex:
+    """
+    Prebuilt search candidates with lowercased strings and their character sets.
+    Candidates missing any query character are skipped without scoring.
+    When query only grows, previous matches are narrowed instead of scanning all candidates.
+    """
+
+    def __init__(self, candidates, texts=None):
+        self.candidates = candidates   # [(formatted, value, weight), ...]
+        if texts is None:
+            texts = [candidate[0] for candidate in candidates]
+        self.lowered = [text.lower() for text in texts]
+        self.charsets = [frozenset(text) for text in self.lowered]
+        self.last_query = None
+        self.last_matches = []
+
+
+    def matches(self, query):
+        """Get index and unweighted score of all candidates matching query, in candidates order"""
+        query = query.lower()
+        query_chars = set("".join(query.split()))
+        if self.last_query is not None and query.startswith(self.last_query):
+            # candidates not matching shorter query cant match longer query
+            pool = self.last_matches
+        else:
+            pool = range(len(self.candidates))
+        matches = []
+        for num in pool:
+            if query_chars <= self.charsets[num]:
+                score = fuzzy_match_score(query, self.lowered[num])
+                if score:
+                    matches.append((num, score))
+        if query_chars:
+            self.last_query = query
+            self.last_matches = [num for num, _ in matches]
+        else:
+            self.last_query = None
+        return matches
+
+
+    def search(self, query, limit=50, score_cutoff=15, results=None):
+        """Search candidates and push best ones to results heap, unsorted"""
+        if results is None:
+            results = []
+        worst_score = score_cutoff
+        if score_cutoff > 0:
+            matches = self.matches(query)
+        else:   # non-matching candidates can pass cutoff
+            query = query.lower()
+            matches = ((num, fuzzy_match_score(query, text)) for num, text in enumerate(self.lowered))
+        for num, score in matches:
+            formatted, value, weight = self.candidates[num]
+            weighted = score * weight
+            if weighted < worst_score:
+                continue
+            heapq.heappush(results, (formatted, value, weighted))
+            if len(results) > limit:
+                heapq.heappop(results)
+                worst_score = results[0][2]
+        return results
+
+
+def get_search_index(key, build):
+    """Get prebuilt search index by key, build it with provided function if its missing"""
+    index = search_indexes.get(key)
+    if index is None:
+        if len(search_indexes) >= SEARCH_INDEX_LIMIT:
+            search_indexes.clear()
+        index = SearchIndex(*build())
+        search_indexes[key] = index
+    return index
+
+
+def clear_search_indexes():
+    """Remove all prebuilt search indexes, run when guilds, channels, dms, emojis or stickers change"""
+    search_indexes.clear()
+
+
 def search_channels_guild(channels, query, limit=50, score_cutoff=15):
     """Search for channels in one guild"""
     results = []
@@ -84,35 +166,14 @@ def search_channels_guild(channels, query, limit=50, score_cutoff=15):
     return sorted(results, key=lambda x: x[2], reverse=True)
 
 
-def search_channels_all(guilds, dms, query, full_input, limit=50, score_cutoff=15):
-    """Search for guilds/categories/channels/DMs"""
-    results = []
-    worst_score = score_cutoff
-
+def build_channels_all(guilds, dms, full):
+    """Build search candidates for guilds/categories/channels/DMs"""
+    candidates = []
     for dm in dms:
-        formatted = f"{dm["name"]} (DM)"
-        score = fuzzy_match_score(query, formatted) * 4   # dms get more score so they are on top
-        if score < worst_score:
-            continue
-        heapq.heappush(results, (formatted, dm["id"], score))
-        if len(results) > limit:
-            heapq.heappop(results)
-            worst_score = results[0][2]
-
-    if full_input.startswith("toggle_mute") or full_input.startswith("mark_as_read") or full_input.startswith("goto"):
-        full = True   # include guilds and categories
-    else:
-        full = False
+        candidates.append((f"{dm["name"]} (DM)", dm["id"], 4))   # dms get more score so they are on top
     for guild in guilds:
         if full:
-            formatted = f"{guild["name"]} - server"
-            score = fuzzy_match_score(query, formatted) * 2   # guilds get more score so they are on top
-            if score >= worst_score:
-                heapq.heappush(results, (formatted, guild["guild_id"], score))
-                if len(results) > limit:
-                    heapq.heappop(results)
-                    worst_score = results[0][2]
-
+            candidates.append((f"{guild["name"]} - server", guild["guild_id"], 2))   # guilds get more score so they are on top
         for channel in guild["channels"]:
             if channel["permitted"]:
                 if channel["type"] == 2:
@@ -125,14 +186,21 @@ def search_channels_all(guilds, dms, query, full_input, limit=50, score_cutoff=1
                     formatted = f"{channel["name"]} - forum ({guild["name"]})"
                 else:
                     formatted = f"{channel["name"]} ({guild["name"]})"
-                score = fuzzy_match_score(query, formatted)
-                if score < worst_score:
-                    continue
-                heapq.heappush(results, (formatted, channel["id"], score))
-                if len(results) > limit:
-                    heapq.heappop(results)
-                    worst_score = results[0][2]
+                candidates.append((formatted, channel["id"], 1))
+    return (candidates, )
+
 
+def search_channels_all(guilds, dms, query, full_input, limit=50, score_cutoff=15):
+    """Search for guilds/categories/channels/DMs"""
+    if full_input.startswith("toggle_mute") or full_input.startswith("mark_as_read") or full_input.startswith("goto"):
+        full = True   # include guilds and categories
+    else:
+        full = False
+    index = get_search_index(
+        ("channels", full, len(guilds), len(dms)),
+        lambda: build_channels_all(guilds, dms, full),
+    )
+    results = index.search(query, limit, score_cutoff)
     return sorted(results, key=lambda x: x[2], reverse=True)
 
 
@@ -177,12 +245,8 @@ def search_usernames_roles(roles, query_results, guild_id, gateway, query, limit
     return sorted(results, key=lambda x: x[2], reverse=True)
 
 
-def search_emojis(all_emojis, premium, guild_id, query, limit=50, score_cutoff=15):
-    """Search for emoji"""
-    results = []
-    worst_score = score_cutoff
-
-    # guild emoji
+def build_emojis(all_emojis, premium, guild_id):
+    """Build search candidates for guild emoji"""
     if not premium:
         for guild in all_emojis:
             if guild["guild_id"] == guild_id:
@@ -192,42 +256,48 @@ def search_emojis(all_emojis, premium, guild_id, query, limit=50, score_cutoff=1
             emojis = []
     else:
         emojis = all_emojis
+    candidates = []
     for guild in emojis:
         guild_name = guild["guild_name"]
         for guild_emoji in guild["emojis"]:
-            formatted = f"{guild_emoji["name"]} ({guild_name})"
-            score = fuzzy_match_score(query, formatted)
-            if score < worst_score:
-                continue
-            heapq.heappush(results, (formatted, f"<:{guild_emoji["name"]}:{guild_emoji["id"]}>", score))
-            if len(results) > limit:
-                heapq.heappop(results)
-                worst_score = results[0][2]
+            candidates.append((f"{guild_emoji["name"]} ({guild_name})", f"<:{guild_emoji["name"]}:{guild_emoji["id"]}>", 1))
+    return (candidates, )
+
+
+def build_standard_emojis():
+    """Build search candidates for standard emoji"""
+    candidates = []
+    for key, item in emoji.EMOJI_DATA.items():
+        if item["status"] > 2:   # skip unqualified and minimally qualified emoji
+            continue
+        # emoji.EMOJI_DATA = {emoji: {"en": ":emoji_name:", "status": 2, "E": 3}...}
+        # using only qualified emojis (status: 2)
+        candidates.append((f"{item["en"]} - {key}", item["en"], 1))
+    return (candidates, )
+
+
+def search_emojis(all_emojis, premium, guild_id, query, limit=50, score_cutoff=15):
+    """Search for emoji"""
+    global standard_emoji_index
+
+    # guild emoji
+    index = get_search_index(
+        ("emojis", premium, None if premium else guild_id, len(all_emojis)),
+        lambda: build_emojis(all_emojis, premium, guild_id),
+    )
+    results = index.search(query, limit, score_cutoff)
 
     # standard emoji
     if len(results) < limit:
-        for key, item in emoji.EMOJI_DATA.items():
-            if item["status"] > 2:   # skip unqualified and minimally qualified emoji
-                continue
-            # emoji.EMOJI_DATA = {emoji: {"en": ":emoji_name:", "status": 2, "E": 3}...}
-            # using only qualified emojis (status: 2)
-            formatted = f"{item["en"]} - {key}"
-            score = fuzzy_match_score(query, formatted)
-            if score < worst_score:
-                continue
-            heapq.heappush(results, (formatted, item["en"], score))
-            if len(results) > limit:
-                heapq.heappop(results)
-                worst_score = results[0][2]
+        if not standard_emoji_index:
+            standard_emoji_index = SearchIndex(*build_standard_emojis())
+        results = standard_emoji_index.search(query, limit, score_cutoff, results=results)
 
     return sorted(results, key=lambda x: x[2], reverse=True)
 
 
-def search_stickers(all_stickers, default_stickers, premium, guild_id, query, limit=50, score_cutoff=15):
-    """Search for stickers"""
-    results = []
-    worst_score = score_cutoff
-
+def build_stickers(all_stickers, default_stickers, premium, guild_id):
+    """Build search candidates for stickers"""
     if not premium:
         for pack in all_stickers:
             if pack["pack_id"] == guild_id:
@@ -237,18 +307,21 @@ def search_stickers(all_stickers, default_stickers, premium, guild_id, query, li
             stickers = []
     else:
         stickers = all_stickers
+    candidates = []
     for pack in stickers + default_stickers:
         pack_name = pack["pack_name"]
         for sticker in pack["stickers"]:
-            formatted = f"{sticker["name"]} ({pack_name})"
-            score = fuzzy_match_score(query, formatted)
-            if score < worst_score:
-                continue
-            heapq.heappush(results, (formatted, sticker["id"], score))
-            if len(results) > limit:
-                heapq.heappop(results)
-                worst_score = results[0][2]
+            candidates.append((f"{sticker["name"]} ({pack_name})", sticker["id"], 1))
+    return (candidates, )
 
+
+def search_stickers(all_stickers, default_stickers, premium, guild_id, query, limit=50, score_cutoff=15):
+    """Search for stickers"""
+    index = get_search_index(
+        ("stickers", premium, None if premium else guild_id, len(all_stickers), len(default_stickers)),
+        lambda: build_stickers(all_stickers, default_stickers, premium, guild_id),
+    )
+    results = index.search(query, limit, score_cutoff)
     return sorted(results, key=lambda x: x[2], reverse=True)
 
 
@@ -353,18 +426,11 @@ def search_set_notifications(guilds, dms, guild_id, channel_id, ping_options, qu
 
 def search_client_commands(commands, query, limit=50, score_cutoff=15):
     """Search for client commands"""
-    results = []
-    worst_score = score_cutoff
-
-    for command in commands:
-        score = fuzzy_match_score(query, command[1])
-        if score < worst_score:
-            continue
-        heapq.heappush(results, (*command, score))
-        if len(results) > limit:
-            heapq.heappop(results)
-            worst_score = results[0][2]
-
+    index = get_search_index(
+        ("commands", id(commands), len(commands)),
+        lambda: ([(*command, 1) for command in commands], [command[1] for command in commands]),
+    )
+    results = index.search(query, limit, score_cutoff)
     return sorted(results, key=lambda x: x[2], reverse=True)
 
 
@@ -1,5 +1,6 @@
 import curses
 import importlib.util
+import itertools
 import logging
 import re
 import sys
@@ -133,54 +134,73 @@ def get_key(screen):
         return first
 
 
-def draw_chat(win_chat, h, w, chat_buffer, chat_format, chat_index, chat_selected, attrib_map, color_default):
-    """Draw chat with applied color formatting"""
+def draw_chat(win_chat, h, w, chat_buffer, chat_format, chat_index, chat_selected, attrib_map, color_default, drawn_rows):
+    """
+    Draw chat with applied color formatting.
+    Each line is drawn as runs of same colored text, one insstr per run.
+    drawn_rows is list of keys for rows that are already on screen, rows with same key are skipped, it is updated in place.
+    """
     y = h
     # drawing from down to up
-    chat_format = chat_format[chat_index:]
     for num in range(len(chat_buffer) - chat_index):
         line_idx = chat_index + num
-        if line_idx >= len(chat_buffer):
-            break
         y = h - (num + 1)
-        if y < 0 or y >= h:
+        if y < 0:
             break
 
         line = chat_buffer[line_idx]
         if num == chat_selected - chat_index:
+            key = (line, w, True)
+            if drawn_rows[y] == key:
+                continue
             fill_len = w - len(line)
             win_chat.insstr(y, 0, line + (" " * fill_len) + "\n", curses.color_pair(16))
-        else:
-            line_format = chat_format[num]
-            default_color_id = line_format[0][0]
-            # filled with spaces so background is drawn all the way
-            default_color = curses.color_pair(default_color_id) | attrib_map[default_color_id]
-            win_chat.insstr(y, 0, " " * w + "\n", curses.color_pair(default_color_id))
-
-            for pos in range(min(len(line), w)):
-                character = line[pos]
-                for format_part in line_format[1:]:
-                    color = format_part[0]
-                    start = format_part[1]
-                    end = format_part[2]
-                    if start <= pos < end:
-                        # assuming never to have id > 65536, if value is that large its definitely attribute
-                        if color >= 0x00010000:
-                            # using base color because it is in message content anyway
-                            color_ready = curses.color_pair(default_color_id) | color
-                        else:
-                            if color > 255:   # set all colors after 255 to default color
-                                color = color_default
-                            color_ready = curses.color_pair(color) | attrib_map[color]
-                        safe_insch(win_chat, y, pos, character, color_ready)
-                        break
-                else:
-                    safe_insch(win_chat, y, pos, character, default_color)
+            drawn_rows[y] = key
+            continue
+
+        line_format = chat_format[line_idx]
+        key = (line, w, tuple(map(tuple, line_format)))
+        if drawn_rows[y] == key:
+            continue
+        default_color_id = line_format[0][0]
+        # filled with spaces so background is drawn all the way
+        default_color = curses.color_pair(default_color_id) | attrib_map[default_color_id]
+        win_chat.insstr(y, 0, " " * w + "\n", curses.color_pair(default_color_id))
+
+        # color of each character, first matching format part has priority so they are applied in reverse
+        line = line[:w]
+        length = len(line)
+        colors = [default_color] * length
+        for format_part in reversed(line_format[1:]):
+            color = format_part[0]
+            start = format_part[1]
+            end = min(format_part[2], length)
+            if start >= end:
+                continue
+            # assuming never to have id > 65536, if value is that large its definitely attribute
+            if color >= 0x00010000:
+                # using base color because it is in message content anyway
+                color_ready = curses.color_pair(default_color_id) | color
+            else:
+                if color > 255:   # set all colors after 255 to default color
+                    color = color_default
+                color_ready = curses.color_pair(color) | attrib_map[color]
+            colors[start:end] = [color_ready] * (end - start)
+
+        # draw runs of same color
+        pos = 0
+        for color, run in itertools.groupby(colors):
+            run_len = sum(1 for _ in run)
+            win_chat.insstr(y, pos, line[pos:pos+run_len], color)
+            pos += run_len
+        drawn_rows[y] = key
 
     # fill empty lines with spaces so background is drawn all the way
     y -= 1
     while y >= 0:
-        win_chat.insstr(y, 0, "\n", curses.color_pair(0))
+        if drawn_rows[y] is not None:
+            win_chat.insstr(y, 0, "\n", curses.color_pair(0))
+            drawn_rows[y] = None
         y -= 1
 
 
@@ -280,6 +300,10 @@ class TUI():
         else:
             self.enable_blink_cursor = True
         self.disable_drawing = False
+        self.chat_drawn_win = None   # chat window that chat_drawn_rows belong to
+        self.chat_drawn_rows = []
+        self.tree_drawn_win = None   # tree window that tree_drawn_rows belong to
+        self.tree_drawn_rows = []
         self.prompt = "> "
         self.input_buffer = ""
         self.status_txt_l = ""
@@ -326,6 +350,10 @@ class TUI():
         self.extra_window_body = ""
         self.member_list = []
         self.member_list_format = []
+        self.member_list_start = 0   # index of first member_list row in whole member list
+        self.member_list_len = 0
+        self.mlist_drawn_win = None   # member list window that mlist_drawn_rows belong to
+        self.mlist_drawn_rows = []
         self.red_list = []
         self.extra_selected = -1
         self.extra_index = 0
@@ -346,6 +374,7 @@ class TUI():
         self.mouse_rel_x = None
         self.wrap_around_disable = False
         self.pressed_num_key = None
+        self.event_queue = None
 
         # lock for thread-safe drawing with curses
         self.lock = threading.RLock()
@@ -376,6 +405,9 @@ class TUI():
 
     def resize(self, redraw_only=False):
         """Resize screen area and redraw ui"""
+        self.chat_drawn_win = None   # whole chat is redrawn
+        self.tree_drawn_win = None
+        self.mlist_drawn_win = None
         # re-init areas
         if not redraw_only:
             h, w = self.screen.getmaxyx()
@@ -445,6 +477,9 @@ class TUI():
 
     def resize_bordered(self, redraw_only=False):
         """Resize screen area and redraw ui in bordered mode"""
+        self.chat_drawn_win = None   # whole chat is redrawn
+        self.tree_drawn_win = None
+        self.mlist_drawn_win = None
         h, w = self.screen.getmaxyx()
         chat_hwyx = (
             h - 4 - self.have_title,
@@ -520,6 +555,9 @@ class TUI():
 
     def force_redraw(self):
         """Forcibly redraw entire screen"""
+        self.chat_drawn_win = None
+        self.tree_drawn_win = None
+        self.mlist_drawn_win = None
         self.screen.clear()
         self.screen.redrawwin()
         if sys.platform == "win32":
@@ -574,6 +612,9 @@ class TUI():
         if lock:
             self.hibernate_cursor = 10
         else:
+            self.chat_drawn_win = None
+            self.tree_drawn_win = None
+            self.mlist_drawn_win = None
             self.screen.clear()
             self.resize(redraw_only=True)
 
@@ -801,6 +842,11 @@ class TUI():
                 time.sleep(0.3)
 
 
+    def set_event_queue(self, event_queue):
+        """Set queue into which input events are signaled, used to wake up main loop"""
+        self.event_queue = event_queue
+
+
     def disable_wrap_around(self, disable):
         """Explicitly disable wrap around in extra window"""
         self.wrap_around_disable = disable
@@ -1161,10 +1207,18 @@ class TUI():
             self.need_update.set()
 
 
+    def invalidate_chat(self):
+        """Force redrawing all chat rows on next draw_chat"""
+        self.chat_drawn_rows = [False] * self.chat_hw[0]   # False - unknown row content
+
+
     def draw_chat(self, norefresh=False):
         """Draw chat with applied color formatting"""
         with self.lock:
             try:
+                if self.chat_drawn_win is not self.win_chat or len(self.chat_drawn_rows) != self.chat_hw[0]:
+                    self.chat_drawn_win = self.win_chat
+                    self.invalidate_chat()
                 draw_chat(
                     self.win_chat,
                     self.chat_hw[0],
@@ -1175,6 +1229,7 @@ class TUI():
                     self.chat_selected,
                     self.attrib_map,
                     self.default_color,
+                    self.chat_drawn_rows,
                 )
                 self.win_chat.noutrefresh()
                 if not norefresh:
@@ -1186,10 +1241,13 @@ class TUI():
 
 
     def draw_tree(self):
-        """Draw channel tree"""
+        """Draw channel tree, rows that are unchanged since last draw are skipped"""
         with self.lock:
             try:
                 h, w = self.tree_hw
+                if self.tree_drawn_win is not self.win_tree or len(self.tree_drawn_rows) != h:
+                    self.tree_drawn_win = self.win_tree
+                    self.tree_drawn_rows = [False] * h   # False - unknown row content
                 # drawing from top to down
                 skipped = 0   # skipping drop-down ends (code 1XXX)
                 drop_down_skip_folder = False
@@ -1236,7 +1294,9 @@ class TUI():
                         drop_down_skip_category = True
                     elif first_digit == 0 and 500 <= code <= 599:
                         drop_down_skip_channel = True
-                    y = max(num - skipped - self.tree_index, 0)
+                    y = num - skipped - self.tree_index
+                    if y < 0:
+                        continue
                     if y >= h:
                         break
                     second_digit = (code % 100) // 10
@@ -1260,6 +1320,10 @@ class TUI():
                         color_line = curses.color_pair(4)
                         self.tree_selected_abs = self.tree_selected + skipped
                         selected = True
+                    row_key = (line, code, selected, text_start, w)
+                    if self.tree_drawn_rows[y] == row_key:
+                        continue
+                    self.tree_drawn_rows[y] = row_key
                     # filled with spaces so background is drawn all the way
                     self.win_tree.insstr(y, 0, " " * w + "\n", color_line)
                     self.win_tree.insstr(y, 0, line[:text_start], color_line)
@@ -1274,9 +1338,11 @@ class TUI():
                             self.win_tree.addch(y, 4, self.tree_dm_status, curses.color_pair(19))
                         elif first_digit == 4:   # dnd
                             self.win_tree.addch(y, 4, self.tree_dm_status, curses.color_pair(20))
-                y += 1
+                y = max(y + 1, 0)
                 while y < h:
-                    self.win_tree.insstr(y, 0, "\n", curses.color_pair(1))
+                    if self.tree_drawn_rows[y] is not None:
+                        self.win_tree.insstr(y, 0, "\n", curses.color_pair(1))
+                        self.tree_drawn_rows[y] = None
                     y += 1
                 self.win_tree.noutrefresh()
                 self.need_update.set()
@@ -1454,11 +1520,19 @@ class TUI():
                 self.draw_member_list(self.member_list, self.member_list_format, force=True)
 
 
-    def draw_member_list(self, member_list, member_list_format, force=False, reset=False):
-        """Draw member list and resize chat"""
+    def draw_member_list(self, member_list, member_list_format, force=False, reset=False, start=None, total=None):
+        """
+        Draw member list and resize chat, rows that are unchanged since last draw are skipped.
+        member_list is part of whole member list beginning at start index, total is length of whole member list.
+        start and total are kept from previous call if not provided.
+        """
         with self.lock:
             self.member_list = member_list
             self.member_list_format = member_list_format
+            if start is not None:
+                self.member_list_start = start
+            if total is not None:
+                self.member_list_len = total
             if member_list and not self.disable_drawing:
                 h, w = self.screen.getmaxyx()
                 if reset:
@@ -1488,34 +1562,47 @@ class TUI():
                         self.screen.vline(1, w - self.member_list_width-1, self.vert_line, common_h, curses.color_pair(self.default_color))
 
                 h, w = self.win_member_list.getmaxyx()
+                if self.mlist_drawn_win is not self.win_member_list or len(self.mlist_drawn_rows) != h:
+                    self.mlist_drawn_win = self.win_member_list
+                    self.mlist_drawn_rows = [False] * h   # False - unknown row content
                 w -= 1
-                y = 0
-                for num, line in enumerate(member_list):
-                    y =  max(num - self.mlist_index, 0)
-                    if y >= h:
-                        break
-                    line_format = member_list_format[num]
-                    if num == self.mlist_selected:
-                        self.win_member_list.insstr(y, 0, line, curses.color_pair(4) | self.attrib_map[4])
+                self.mlist_index = min(self.mlist_index, max(self.member_list_len - 1, 0))
+                for y in range(h):
+                    num = self.mlist_index + y
+                    row = num - self.member_list_start
+                    if num < self.member_list_len and 0 <= row < len(member_list):
+                        line = member_list[row][:w + 1]
+                        line_format = member_list_format[row]
                     else:
-                        for pos, character in enumerate(line):
-                            if pos > w:
-                                break
-                            for format_part in line_format:
-                                if format_part[1] <= pos < format_part[2]:
-                                    color = format_part[0]
-                                    if color > 255:   # set all colors after 255 to default color
-                                        color = self.default_color
-                                    color_ready = curses.color_pair(color) | self.attrib_map[color]
-                                    safe_insch(self.win_member_list, y, pos, character, color_ready)
-                                    break
-                            else:
-                                safe_insch(self.win_member_list, y, pos, character, curses.color_pair(self.default_color) | self.attrib_map[self.default_color])
-
-                y += 1
-                while y < h:
+                        line = None
+                        line_format = None
+                    selected = num == self.mlist_selected
+                    row_key = (line, line_format, selected)
+                    if self.mlist_drawn_rows[y] == row_key:
+                        continue
+                    self.mlist_drawn_rows[y] = row_key
                     self.win_member_list.insstr(y, 0, "\n", curses.color_pair(1))
-                    y += 1
+                    if line is None:
+                        continue
+                    if selected:
+                        self.win_member_list.insstr(y, 0, line, curses.color_pair(4) | self.attrib_map[4])
+                        continue
+                    # draw each run of same color at once
+                    edges = {0, len(line)}
+                    for format_part in line_format:
+                        edges.add(min(format_part[1], len(line)))
+                        edges.add(min(format_part[2], len(line)))
+                    edges = sorted(edges)
+                    for pos, end in zip(edges, edges[1:]):
+                        for format_part in line_format:
+                            if format_part[1] <= pos < format_part[2]:
+                                color = format_part[0]
+                                if color > 255:   # set all colors after 255 to default color
+                                    color = self.default_color
+                                break
+                        else:
+                            color = self.default_color
+                        self.win_member_list.insstr(y, pos, line[pos:end], curses.color_pair(color) | self.attrib_map[color])
                 self.win_member_list.noutrefresh()
                 self.need_update.set()
 
@@ -1527,6 +1614,8 @@ class TUI():
                 del (self.win_member_list, self.win_chat)
                 self.member_list = []
                 self.member_list_format = []
+                self.member_list_start = 0
+                self.member_list_len = 0
                 self.win_member_list = None
                 h, w = self.screen.getmaxyx()
                 self.init_chat()
@@ -1985,9 +2074,9 @@ class TUI():
                     self.extra_index += 1
                     self.draw_extra_window(self.extra_window_title, self.extra_window_body, self.extra_select)
             elif self.win_member_list:
-                if self.mlist_selected + 1 < len(self.member_list):
+                if self.mlist_selected + 1 < self.member_list_len:
                     top_line = self.mlist_index + self.win_member_list.getmaxyx()[0] - 1
-                    if top_line < len(self.member_list) and self.mlist_selected >= top_line - 1:
+                    if top_line < self.member_list_len and self.mlist_selected >= top_line - 1:
                         self.mlist_index += 1
                     self.mlist_selected += 1
                     self.draw_member_list(self.member_list, self.member_list_format)
@@ -2038,6 +2127,9 @@ class TUI():
         self.keybinding_chain = None
         key = -1
         while self.run:
+            if self.event_queue is not None:
+                # previous key is processed, wake up main loop so it can react to it
+                self.event_queue.put("INPUT")
             key = get_key(self.screen)
 
             if self.mouse and key == curses.KEY_MOUSE:
@@ -2701,6 +2793,6 @@ class TUI():
                 if self.mlist_index:
                     self.mlist_index -= min(self.mouse_scroll_sensitivity, self.mlist_index)
                     self.draw_member_list(self.member_list, self.member_list_format)
-            elif self.mlist_index + self.win_member_list.getmaxyx()[0] - 1 < len(self.member_list):
+            elif self.mlist_index + self.win_member_list.getmaxyx()[0] - 1 < self.member_list_len:
                 self.mlist_index += self.mouse_scroll_sensitivity
                 self.draw_member_list(self.member_list, self.member_list_format)
@@ -1,5 +1,5 @@
+import collections
 import logging
-import queue
 import random
 import socket
 import struct
@@ -10,6 +10,7 @@ import urllib.parse
 
 import av
 import nacl.bindings
+import numpy as np
 import orjson as json
 import socks
 import websocket
@@ -25,6 +26,11 @@ DISCORD_HOST = "discord.com"
 LOCAL_MEMBER_COUNT = 50   # members per guild, CPU-RAM intensive
 VOICE_FLAGS = 3   # CLIPS_ENABLED and ALLOW_VOICE_RECORDING
 UDP_TIMEOUT = 10
+SAMPLE_RATE = 48000
+CHANNELS = 2
+BLOCK_SAMPLES = 960   # 20ms at 48kHz, size of one mixed block
+JITTER_MIN_DELAY = 2   # min number of packets buffered before speaker playback starts
+JITTER_MAX_DELAY = 15   # max number of packets buffered per speaker, oldest are dropped above this
 logger = logging.getLogger(__name__)
 CODECS = [
     # pyav depends on ffmpeg, and its usually built without encode for av1 and vp9
@@ -39,6 +45,11 @@ CODECS = [
 rtp_unpacker = struct.Struct(">xxHII")
 
 
+def seq_diff(a, b):
+    """Get difference between two 16-bit RTP sequence numbers, accounting for wrap-around"""
+    return ((a - b + 32768) & 0xFFFF) - 32768
+
+
 # get speaker
 if have_soundcard:
     try:
@@ -70,9 +81,11 @@ class Gateway():
         self.resumable = False
         self.voice_handler = None
         self.voice_handler_thread = None
-        self.call_buffer = []
+        self.call_buffer = collections.deque()
+        self.event_queue = None
         self.mute = mute
         self.media_session_id = None
+        self.ssrc_users = {}
         self.connect()
 
 
@@ -274,14 +287,21 @@ class Gateway():
 
             elif opcode == 5:   # SPEAKING
                 data = response["d"]
+                if "ssrc" in data:
+                    self.ssrc_users[data["ssrc"]] = data["user_id"]
                 self.call_buffer.append({
                     "op": "USER_SPEAKING",
                     "user_id": data["user_id"],
                     "speaking": bool(data["user_id"]),
                 })
 
+            if opcode in (11, 13, 5) and self.event_queue is not None:
+                self.event_queue.put("VOICE")
+
         logger.info("Receiver stopped")
         self.disconnect()
+        if self.event_queue is not None:
+            self.event_queue.put("VOICE")
 
 
     def send_heartbeat(self):
@@ -407,14 +427,20 @@ class Gateway():
             logger.info("Gateway disconnected")
 
 
+    def set_event_queue(self, event_queue):
+        """Set queue into which call events are signaled, used to wake up main loop"""
+        self.event_queue = event_queue
+
+
     def get_call_events(self):
         """
         Get call events.
         Returns 1 by 1 call event.
         """
-        if len(self.call_buffer) == 0:
+        try:
+            return self.call_buffer.popleft()
+        except IndexError:
             return None
-        return self.call_buffer.pop(0)
 
 
     def get_media_session_id(self):
@@ -422,12 +448,116 @@ class Gateway():
         return self.media_session_id
 
 
+    def get_receive_stats(self):
+        """Get received audio statistics for each speaker, see VoiceHandler.get_stats()"""
+        if not self.voice_handler:
+            return []
+        stats = self.voice_handler.get_stats()
+        for speaker_stats in stats:
+            speaker_stats["user_id"] = self.ssrc_users.get(speaker_stats["ssrc"])
+        return stats
+
+
     def set_mute(self, state):
         """Set muted state, will stop recording and sending sound"""
         self.mute = state
 
 
 
+class JitterBuffer:
+    """
+    Audio receive buffer for one speaker (SSRC).
+    Packets are reordered by sequence number and decoded in order into fixed size blocks.
+    Buffered delay is adapted to measured network jitter.
+    """
+
+    def __init__(self):
+        self.opus_decoder = av.codec.CodecContext.create("opus", "r")
+        self.packets = {}   # {sequence: payload}
+        self.next_seq = None
+        self.buffering = True
+        self.pcm = np.zeros((0, CHANNELS), dtype=np.float32)
+        self.jitter = 0   # interarrival jitter in samples, as in RFC 3550
+        self.last_transit = None
+        self.received = 0
+        self.lost = 0
+        self.late = 0
+
+
+    def get_delay(self):
+        """Get number of packets that should be buffered before playback starts, according to current jitter"""
+        return min(max(JITTER_MIN_DELAY, int(2 * self.jitter / BLOCK_SAMPLES) + 1), JITTER_MAX_DELAY)
+
+
+    def push(self, sequence, timestamp, payload, arrival):
+        """Add received packet to buffer"""
+        transit = arrival * SAMPLE_RATE - timestamp
+        if self.last_transit is not None:
+            difference = abs(transit - self.last_transit)
+            if difference < SAMPLE_RATE:   # skip timestamp wrap-around
+                self.jitter += (difference - self.jitter) / 16
+        self.last_transit = transit
+        if self.next_seq is not None and seq_diff(sequence, self.next_seq) < 0:
+            self.late += 1   # already played or skipped
+            return
+        self.packets[sequence] = payload
+        self.received += 1
+
+
+    def decode_next(self):
+        """Decode next packet in sequence order and add it to pcm, return False if there is nothing to decode"""
+        if not self.packets:
+            self.buffering = True   # wait for buffer to fill again
+            return False
+        if self.buffering:
+            if len(self.packets) < self.get_delay():
+                return False
+            self.buffering = False
+            reference = next(iter(self.packets))
+            self.next_seq = min(self.packets, key=lambda seq: seq_diff(seq, reference))
+
+        # drop oldest packets if too much is buffered
+        while len(self.packets) > JITTER_MAX_DELAY:
+            if self.packets.pop(self.next_seq, None) is None:
+                self.lost += 1
+            else:
+                self.late += 1
+            self.next_seq = (self.next_seq + 1) & 0xFFFF
+
+        payload = self.packets.pop(self.next_seq, None)
+        self.next_seq = (self.next_seq + 1) & 0xFFFF
+        if payload is None:   # there are newer packets so this one is lost
+            self.lost += 1
+            self.pcm = np.concatenate((self.pcm, np.zeros((BLOCK_SAMPLES, CHANNELS), dtype=np.float32)))
+            return True
+        try:
+            frames = self.opus_decoder.decode(av.packet.Packet(payload))
+        except Exception as e:
+            logger.error(f"PyAV opus decoding failed. Error: {e}")
+            return True
+        for frame in frames:
+            pcm = frame.to_ndarray().astype("float32").T
+            if pcm.shape[1] != CHANNELS:
+                pcm = np.repeat(pcm[:, :1], CHANNELS, axis=1)
+            self.pcm = np.concatenate((self.pcm, pcm))
+        return True
+
+
+    def read(self):
+        """Get next block of BLOCK_SAMPLES samples, padded with silence, or None if there is nothing to play"""
+        while len(self.pcm) < BLOCK_SAMPLES:
+            if not self.decode_next():
+                break
+        if not len(self.pcm):
+            return None
+        if len(self.pcm) < BLOCK_SAMPLES:
+            self.pcm = np.concatenate((self.pcm, np.zeros((BLOCK_SAMPLES - len(self.pcm), CHANNELS), dtype=np.float32)))
+        block = self.pcm[:BLOCK_SAMPLES]
+        self.pcm = self.pcm[BLOCK_SAMPLES:]
+        return block
+
+
+
 class VoiceHandler:
     """Voice call sound receiver and transmitter, player and recorder"""
 
@@ -436,8 +566,8 @@ class VoiceHandler:
         self.udp = udp
         self.secret_key = bytes(secret_key)
         self.mode = encryption_mode
-        self.audio_queue = queue.Queue(maxsize=10)
-        self.opus_decoder = av.codec.CodecContext.create("opus", "r")
+        self.buffers = {}   # {ssrc: JitterBuffer}
+        self.lock = threading.Lock()
 
 
     def start(self):
@@ -450,7 +580,7 @@ class VoiceHandler:
 
         if have_sound:
             # start player
-            self.audio_thread = threading.Thread(target=self.audio_player, args=(48000, 2), daemon=True)
+            self.audio_thread = threading.Thread(target=self.audio_player, args=(SAMPLE_RATE, CHANNELS), daemon=True)
             self.audio_thread.start()
 
             # start receiver
@@ -463,7 +593,6 @@ class VoiceHandler:
     def stop(self):
         """Stop voice handler"""
         self.run = False
-        self.audio_queue.put(None)
         try:
             self.udp.close()
         except Exception:
@@ -471,7 +600,7 @@ class VoiceHandler:
 
 
     def receiver_loop(self):
-        """Receive, unpack, decrypt, decode received data, and put it to queue"""
+        """Receive, unpack, decrypt received data, and add it to jitter buffer of its speaker"""
         logger.debug("Voice receiver started")
         while self.run:
             # receive
@@ -517,22 +646,51 @@ class VoiceHandler:
                     logger.error(f"Decryption failed for mode: {self.mode}. Error: {e}")
                     continue
 
-                # decode opus and add to audio queue
-                try:
-                    av_packet = av.packet.Packet(payload)
-                    frames = self.opus_decoder.decode(av_packet)
-                    for frame in frames:
-                        self.audio_queue.put(frame)
-                except Exception as e:
-                    logger.error(f"PyAV opus decoding failed. Error: {e}")
+                # add to speaker jitter buffer
+                with self.lock:
+                    jitter_buffer = self.buffers.get(ssrc)
+                    if not jitter_buffer:
+                        jitter_buffer = JitterBuffer()
+                        self.buffers[ssrc] = jitter_buffer
+                    jitter_buffer.push(sequence, timestamp, payload, time.time())
         self.gateway.disconnect()
 
 
+    def mix(self):
+        """Mix next block from all speakers, return None if no one is speaking"""
+        mixed = None
+        with self.lock:
+            for jitter_buffer in self.buffers.values():
+                block = jitter_buffer.read()
+                if block is None:
+                    continue
+                if mixed is None:
+                    mixed = block.copy()
+                else:
+                    mixed += block
+        if mixed is not None:
+            np.clip(mixed, -1, 1, out=mixed)
+        return mixed
+
+
+    def get_stats(self):
+        """Get received packets, lost packets, late packets and current buffer delay in packets, for each speaker (SSRC)"""
+        with self.lock:
+            return [{
+                "ssrc": ssrc,
+                "received": jitter_buffer.received,
+                "lost": jitter_buffer.lost,
+                "late": jitter_buffer.late,
+                "delay": jitter_buffer.get_delay(),
+            } for ssrc, jitter_buffer in self.buffers.items()]
+
+
     def audio_player(self, samplerate, channels):
-        """Play audio frames from the queue"""
+        """Play mixed audio blocks, playback pace is driven by speaker"""
+        silence = np.zeros((BLOCK_SAMPLES, channels), dtype=np.float32)
         with speaker.player(samplerate=samplerate, channels=channels, blocksize=1152) as stream:
             while self.run:
-                frame = self.audio_queue.get()
-                if frame is None:
-                    break
-                stream.play(frame.to_ndarray().astype("float32").T)
+                block = self.mix()
+                if block is None:
+                    block = silence
+                stream.play(block)
@@ -6,14 +6,14 @@ cdef inline int bisearch(int ucs, object ranges):
     cdef Py_ssize_t mid
     cdef int start, end
 
-    if ucs < ranges[0][0] or ucs > ranges[high][1]:
+    if ucs < ranges[0][0] or ucs >= ranges[high][1]:
         return 0
 
     while low <= high:
         mid = (low + high) >> 1
         start, end = ranges[mid]
 
-        if ucs > end:
+        if ucs >= end:
             low = mid + 1
         elif ucs < start:
             high = mid - 1
@@ -23,7 +23,7 @@ cdef inline int bisearch(int ucs, object ranges):
     return 0
 
 
-cpdef limit_width_wch(str text, int max_width, object ranges):
+cpdef crop_width_wch(str text, int max_width, const unsigned char[:] bmp, object astral):
     cdef int total_width = 0
     cdef int character, char_width
     cdef Py_ssize_t i, n = len(text)
@@ -32,8 +32,10 @@ cpdef limit_width_wch(str text, int max_width, object ranges):
         character = ord(text[i])
         if 32 <= character < 0x7f:
             char_width = 1
+        elif character < 0x10000:
+            char_width = 1 + ((bmp[character >> 3] >> (character & 7)) & 1)
         else:
-            char_width = 1 + bisearch(character, ranges)
+            char_width = 1 + bisearch(character, astral)
         if total_width + char_width > max_width:
             return text[:i], total_width
         total_width += char_width
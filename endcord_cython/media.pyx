@@ -1,26 +1,22 @@
 # cython: boundscheck=False, wraparound=False
 
 import curses
+import numpy as np
 cimport cython
 
 cpdef void img_to_curses(
     object screen,
-    object img,
-    object img_gray,
+    list rows,
+    object colors,
     int start_color_id,
-    list ascii_palette,
-    int ascii_palette_len,
     int screen_width,
-    int screen_height,
-    int width,
-    int height
+    int screen_height
 ):
-    cdef int x, y, y_fill, padding_h, padding_w, color
-    cdef object character
-    cdef int gray_val
-
-    cdef object pixels = img.load()
-    cdef object pixels_gray = img_gray.load()
+    cdef int y, y_fill, padding_h, padding_w, color, start, end, row_y
+    cdef int height = colors.shape[0]
+    cdef int width = colors.shape[1]
+    cdef str row
+    cdef list row_colors, ends
 
     padding_h = (screen_height - height) // 2
     padding_w = (screen_width - width) // 2
@@ -38,15 +34,19 @@ cpdef void img_to_curses(
         if padding_w > 0:
             screen.insstr(row_y, 0, " " * padding_w, bg_color)
 
-        for x in range(width):
-            gray_val = pixels_gray[x, y]
-            character = ascii_palette[(gray_val * ascii_palette_len) // 255]
-            color = start_color_id + pixels[x, y] + 16
-            screen.insch(row_y, x + padding_w, character, curses.color_pair(color))
+        row = rows[y]
+        row_colors = colors[y].tolist()
+        ends = (np.flatnonzero(colors[y, 1:] != colors[y, :-1]) + 1).tolist()
+        ends.append(width)
+        start = 0
+        for end in ends:
+            color = start_color_id + <int>row_colors[start] + 16
+            screen.insstr(row_y, start + padding_w, row[start:end], curses.color_pair(color))
+            start = end
 
         # right padding
-        if x + padding_w + 1 < screen_width:
-            screen.insstr(row_y, x + padding_w + 1, " " * (screen_width - (x + padding_w + 1)), bg_color)
+        if width + padding_w < screen_width:
+            screen.insstr(row_y, width + padding_w, " " * (screen_width - (width + padding_w)), bg_color)
 
     # bottom padding
     if screen_height != height:
@@ -4,6 +4,8 @@ import socket
 from datetime import datetime, timezone
 from urllib.parse import urlparse
 
+BMP_SIZE = 0x10000
+BITMAP_LINE_BYTES = 32   # bitmap bytes per line in generated file
 utc_date = datetime.now(timezone.utc).strftime("%Y-%m-%d, %H:%M:%S") + " UTC"
 header = f"""# {utc_date}
 # Generated from:
@@ -118,6 +120,36 @@ def merge_codepoints_to_ranges(values):
     return ranges
 
 
+def build_bmp_bitmap(ranges):
+    """Build bitmap of wide characters in basic multilingual plane, one bit per codepoint"""
+    bitmap = bytearray(BMP_SIZE // 8)
+    for start, end in ranges:
+        for cp in range(start, min(end, BMP_SIZE)):
+            bitmap[cp >> 3] |= 1 << (cp & 7)
+    return bytes(bitmap)
+
+
+def write_wide_ranges(ranges, path):
+    """Write BMP bitmap and astral ranges of wide characters as python file"""
+    bitmap = build_bmp_bitmap(ranges)
+    with open(path, "w") as f:
+        f.write(header)
+        f.write("\n")
+        f.write("# bit (cp & 7) of byte (cp >> 3) is set if codepoint is wide\n")
+        f.write("WIDE_BMP = bytes.fromhex(\n")
+        for i in range(0, len(bitmap), BITMAP_LINE_BYTES):
+            comma = "," if i + BITMAP_LINE_BYTES >= len(bitmap) else ""
+            f.write(f'    "{bitmap[i:i+BITMAP_LINE_BYTES].hex()}"{comma}\n')
+        f.write(")\n")
+        f.write("\n")
+        f.write("# (start, end) ranges of wide codepoints above BMP, end is excluded\n")
+        f.write("WIDE_ASTRAL = (\n")
+        for start, end in ranges:
+            if end > BMP_SIZE:
+                f.write(f"    {str((max(start, BMP_SIZE), end))},\n")
+        f.write(")\n")
+
+
 def update_wide_ranged():
     """Download latest unicode data and build list of ranges of wide characters as python file"""
     # download lists
@@ -171,13 +203,7 @@ def update_wide_ranged():
 
     # build py file
     path = os.path.expanduser("./endcord/wide_ranges.py")
-    with open(path, "w") as f:
-        f.write(header)
-        f.write("\n")
-        f.write("WIDE_RANGES = (\n")
-        for line in ranges:
-            f.write(f"    {str(line)},\n")
-        f.write(")\n")
+    write_wide_ranges(ranges, path)
 
     print(f"Wide unicode characters ranges saved to {path}")
 